@@ -0,0 +1,418 @@
+"""
+Live Room Load Benchmark
+Simulates listeners and speakers on /api/live-sessions/ws/{id} and
+reports fan-out latency, frame throughput and server CPU / memory
+
+Usage (from backend/):
+    # Spawn a local uvicorn against MONGO_URL (scratch database, dropped afterwards)
+    python -m benchmarks.live_room_load --listeners 500 --speakers 4 --chat-rate 2
+
+    # Benchmark a server that is already running
+    python -m benchmarks.live_room_load --url http://localhost:8001 --server-pid 1234
+
+    # CI-like local mode: small room, fail if p99 regresses
+    python -m benchmarks.live_room_load --ci --max-p99-ms 250
+
+MONGO_URL may point at any throwaway mongod, e.g. one started with
+--dbpath on a tmpfs (or --storageEngine inMemory) for an in-memory run.
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+import uuid
+from typing import List, Optional
+from urllib.parse import quote
+
+import httpx
+import websockets
+
+from services import live_protocol
+
+try:
+    import psutil
+except ImportError:  # Falls back to /proc (Linux only)
+    psutil = None
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Marker embedded in benchmark chat messages: "bench|<seq>|<perf_counter>"
+CHAT_MARKER = "bench|"
+
+# Limits applied to the spawned server unless --keep-rate-limits is set;
+# the per-user production limits (chat: 1/s) would reject synthetic load
+BENCH_RATE_LIMITS = "chat:1000:1000:reject,reaction:1000:1000:drop,*:1000:1000:drop"
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class ProcessSampler:
+    """Samples CPU % and RSS of the server process once per second"""
+
+    def __init__(self, pid: Optional[int]):
+        self.pid = pid
+        self.cpu_samples: List[float] = []
+        self.rss_samples: List[int] = []
+        self._task: Optional[asyncio.Task] = None
+        self._clock_ticks = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+    def start(self):
+        if self.pid:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+
+    def summary(self) -> dict:
+        if not self.cpu_samples:
+            return {"cpu_avg_pct": None, "cpu_max_pct": None, "rss_max_mb": None}
+        return {
+            "cpu_avg_pct": round(sum(self.cpu_samples) / len(self.cpu_samples), 1),
+            "cpu_max_pct": round(max(self.cpu_samples), 1),
+            "rss_max_mb": round(max(self.rss_samples) / 1024 / 1024, 1)
+        }
+
+    def _read(self) -> tuple:
+        """(cpu seconds, rss bytes)"""
+        if psutil is not None:
+            proc = psutil.Process(self.pid)
+            times = proc.cpu_times()
+            return times.user + times.system, proc.memory_info().rss
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        cpu = (int(fields[11]) + int(fields[12])) / self._clock_ticks
+        rss = int(fields[21]) * os.sysconf("SC_PAGE_SIZE")
+        return cpu, rss
+
+    async def _run(self):
+        try:
+            last_cpu, _ = self._read()
+            last_t = time.monotonic()
+            while True:
+                await asyncio.sleep(1.0)
+                cpu, rss = self._read()
+                now = time.monotonic()
+                self.cpu_samples.append((cpu - last_cpu) / (now - last_t) * 100)
+                self.rss_samples.append(rss)
+                last_cpu, last_t = cpu, now
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Process exited or /proc is unavailable
+            print(f"⚠️  Server sampling stopped: {e}")
+
+
+class BenchClient:
+    """One simulated participant"""
+
+    def __init__(self, bench: "LiveRoomBenchmark", index: int, role: str):
+        self.bench = bench
+        self.user_id = f"bench_{role}_{index}_{uuid.uuid4().hex[:6]}"
+        self.role = role
+        self.ws = None
+        self.frames = 0
+        self.connected = False
+
+    async def connect(self):
+        args = self.bench.args
+        url = (
+            f"{self.bench.ws_url}/api/live-sessions/ws/{self.bench.session_id}"
+            f"?user_id={self.user_id}&username={quote(self.user_id)}&role={self.role}"
+        )
+        subprotocols = ["fomo.msgpack.v1"] if args.encoding == live_protocol.MSGPACK else None
+        self.ws = await websockets.connect(
+            url,
+            subprotocols=subprotocols,
+            max_size=None,
+            ping_interval=None,
+            open_timeout=30
+        )
+        self.connected = True
+
+    async def receive_loop(self):
+        """Count frames and record chat fan-out latency"""
+        try:
+            async for frame in self.ws:
+                received_at = time.perf_counter()
+                self.frames += 1
+                message = live_protocol.decode_frame(frame)
+                if not message:
+                    continue
+                msg_type = message.get("type")
+                if msg_type == "chat_message":
+                    text = (message.get("message") or {}).get("message", "")
+                    if text.startswith(CHAT_MARKER) and self.bench.measuring:
+                        sent_at = float(text.rsplit("|", 1)[1])
+                        self.bench.latencies.append((received_at - sent_at) * 1000)
+                elif msg_type == "ping":
+                    await self.send({"type": "pong"})
+                elif msg_type == "rate_limited":
+                    self.bench.rate_limited += 1
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            self.connected = False
+
+    async def send(self, message: dict):
+        await self.ws.send(live_protocol.encode_frame(message, self.bench.args.encoding))
+
+    async def speak_loop(self, stop_at: float):
+        """Send chat and reactions at the configured per-speaker rates"""
+        args = self.bench.args
+        seq = 0
+        next_chat = time.monotonic()
+        next_reaction = time.monotonic()
+        while time.monotonic() < stop_at and self.connected:
+            now = time.monotonic()
+            if args.chat_rate > 0 and now >= next_chat:
+                seq += 1
+                await self.send({
+                    "type": "chat",
+                    "message": f"{CHAT_MARKER}{seq}|{time.perf_counter()}"
+                })
+                self.bench.chats_sent += 1
+                next_chat += 1 / args.chat_rate
+            if args.reaction_rate > 0 and now >= next_reaction:
+                await self.send({"type": "reaction", "emoji": "🔥"})
+                self.bench.reactions_sent += 1
+                next_reaction += 1 / args.reaction_rate
+            upcoming = [
+                t for t, rate in ((next_chat, args.chat_rate), (next_reaction, args.reaction_rate))
+                if rate > 0
+            ]
+            wake_at = min(upcoming + [stop_at])
+            await asyncio.sleep(max(0.0, wake_at - time.monotonic()))
+
+    async def close(self):
+        if self.ws is not None:
+            await self.ws.close()
+
+
+class LiveRoomBenchmark:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.base_url = args.url.rstrip("/")
+        self.ws_url = self.base_url.replace("http://", "ws://").replace("https://", "wss://")
+        self.session_id = args.session_id
+        self.server: Optional[subprocess.Popen] = None
+        self.server_pid = args.server_pid
+        self.latencies: List[float] = []
+        self.measuring = False
+        self.chats_sent = 0
+        self.reactions_sent = 0
+        self.rate_limited = 0
+
+    async def run(self) -> dict:
+        try:
+            if self.args.spawn:
+                await self._spawn_server()
+            if not self.session_id:
+                self.session_id = await self._create_session()
+            return await self._run_load()
+        finally:
+            self._stop_server()
+
+    async def _run_load(self) -> dict:
+        args = self.args
+        listeners = [BenchClient(self, i, "listener") for i in range(args.listeners)]
+        speakers = [BenchClient(self, i, "speaker") for i in range(args.speakers)]
+        clients = listeners + speakers
+
+        # Ramp up in batches so the connect storm itself is measurable
+        connect_started = time.monotonic()
+        for i in range(0, len(clients), args.connect_batch):
+            batch = clients[i:i + args.connect_batch]
+            results = await asyncio.gather(*[c.connect() for c in batch], return_exceptions=True)
+            for result in results:
+                if isinstance(result, Exception):
+                    print(f"⚠️  Connect failed: {result}")
+        connected = [c for c in clients if c.connected]
+        connect_seconds = time.monotonic() - connect_started
+        print(f"🔌 {len(connected)}/{len(clients)} clients connected in {connect_seconds:.1f}s")
+
+        receivers = [asyncio.create_task(c.receive_loop()) for c in connected]
+        sampler = ProcessSampler(self.server_pid)
+
+        # Warm-up traffic is not measured
+        await asyncio.gather(*[
+            s.speak_loop(time.monotonic() + args.warmup) for s in speakers if s.connected
+        ])
+        frames_before = sum(c.frames for c in connected)
+        self.latencies.clear()
+        self.measuring = True
+        sampler.start()
+
+        started = time.monotonic()
+        await asyncio.gather(*[
+            s.speak_loop(started + args.duration) for s in speakers if s.connected
+        ])
+        # Let in-flight frames drain
+        await asyncio.sleep(args.drain)
+        elapsed = time.monotonic() - started
+        self.measuring = False
+        await sampler.stop()
+
+        frames = sum(c.frames for c in connected) - frames_before
+        expected_deliveries = self._expected_deliveries(speakers, connected)
+
+        await asyncio.gather(*[c.close() for c in connected], return_exceptions=True)
+        for task in receivers:
+            task.cancel()
+
+        return {
+            "listeners": args.listeners,
+            "speakers": args.speakers,
+            "encoding": args.encoding,
+            "connected": len(connected),
+            "connect_seconds": round(connect_seconds, 2),
+            "duration_seconds": round(elapsed, 2),
+            "chat_deliveries": len(self.latencies),
+            "chat_deliveries_expected": expected_deliveries,
+            "fanout_p50_ms": round(percentile(self.latencies, 50), 2),
+            "fanout_p99_ms": round(percentile(self.latencies, 99), 2),
+            "fanout_max_ms": round(max(self.latencies, default=0.0), 2),
+            "frames_per_second": round(frames / elapsed, 1) if elapsed else 0.0,
+            "rate_limited": self.rate_limited,
+            **sampler.summary()
+        }
+
+    def _expected_deliveries(self, speakers: List[BenchClient], connected: List[BenchClient]) -> int:
+        """Deliveries expected if every chat reached every connected client"""
+        rate = self.args.chat_rate * len([s for s in speakers if s.connected])
+        return int(rate * self.args.duration * len(connected))
+
+    async def _create_session(self) -> str:
+        async with httpx.AsyncClient(base_url=self.base_url, timeout=30) as client:
+            response = await client.post("/api/live-sessions/sessions", json={
+                "title": f"Load benchmark {time.strftime('%Y-%m-%d %H:%M:%S')}",
+                "description": "Created by benchmarks.live_room_load"
+            })
+            response.raise_for_status()
+            return response.json()["session_id"]
+
+    async def _spawn_server(self):
+        env = dict(os.environ)
+        env.setdefault("MONGO_URL", "mongodb://localhost:27017")
+        env["DB_NAME"] = self.args.db_name
+        if not self.args.keep_rate_limits:
+            env["LIVE_RATE_LIMITS"] = BENCH_RATE_LIMITS
+
+        log = open(self.args.server_log, "w") if self.args.server_log else subprocess.DEVNULL
+        self.server = subprocess.Popen(
+            [
+                sys.executable, "-m", "uvicorn", "server:app",
+                "--host", "127.0.0.1", "--port", str(self.args.port),
+                "--log-level", "warning"
+            ],
+            cwd=BACKEND_DIR,
+            env=env,
+            stdout=log,
+            stderr=subprocess.STDOUT
+        )
+        self.server_pid = self.server.pid
+
+        # Wait for the app to answer
+        async with httpx.AsyncClient(base_url=self.base_url, timeout=2) as client:
+            deadline = time.monotonic() + 30
+            while time.monotonic() < deadline:
+                if self.server.poll() is not None:
+                    raise RuntimeError(f"Server exited with code {self.server.returncode}")
+                try:
+                    await client.get("/api/live-sessions/protocol")
+                    print(f"🚀 Server started (pid {self.server_pid}, db {self.args.db_name})")
+                    return
+                except httpx.HTTPError:
+                    await asyncio.sleep(0.25)
+        raise RuntimeError("Server did not start within 30s")
+
+    def _stop_server(self):
+        if self.server is None:
+            return
+        self.server.send_signal(signal.SIGINT)
+        try:
+            self.server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.server.kill()
+
+        if not self.args.keep_db:
+            from pymongo import MongoClient
+            try:
+                client = MongoClient(os.environ.get("MONGO_URL", "mongodb://localhost:27017"), serverSelectionTimeoutMS=2000)
+                client.drop_database(self.args.db_name)
+                client.close()
+            except Exception as e:
+                print(f"⚠️  Could not drop {self.args.db_name}: {e}")
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Live room WebSocket load benchmark")
+    parser.add_argument("--url", default=None, help="Existing server base URL (default: spawn one)")
+    parser.add_argument("--server-pid", type=int, default=None, help="PID to sample when using --url")
+    parser.add_argument("--port", type=int, default=8765, help="Port for the spawned server")
+    parser.add_argument("--session-id", default=None, help="Existing session (default: create one)")
+    parser.add_argument("--listeners", type=int, default=200)
+    parser.add_argument("--speakers", type=int, default=2)
+    parser.add_argument("--chat-rate", type=float, default=1.0, help="Chat messages per second per speaker")
+    parser.add_argument("--reaction-rate", type=float, default=5.0, help="Reactions per second per speaker")
+    parser.add_argument("--duration", type=float, default=30.0, help="Measured seconds")
+    parser.add_argument("--warmup", type=float, default=3.0, help="Unmeasured seconds before measuring")
+    parser.add_argument("--drain", type=float, default=1.0, help="Seconds to wait for in-flight frames")
+    parser.add_argument("--connect-batch", type=int, default=100, help="Concurrent connects during ramp-up")
+    parser.add_argument("--encoding", choices=[live_protocol.JSON, live_protocol.MSGPACK], default=live_protocol.JSON)
+    parser.add_argument("--db-name", default=f"fomo_bench_{uuid.uuid4().hex[:8]}")
+    parser.add_argument("--keep-db", action="store_true", help="Don't drop the scratch database")
+    parser.add_argument("--keep-rate-limits", action="store_true", help="Run the spawned server with default rate limits")
+    parser.add_argument("--server-log", default=None, help="Write spawned server output here")
+    parser.add_argument("--ci", action="store_true", help="Small, short run (100 listeners, 10s)")
+    parser.add_argument("--max-p99-ms", type=float, default=None, help="Exit 1 if fan-out p99 exceeds this")
+    parser.add_argument("--json", dest="json_out", default=None, help="Also write results to this file")
+    args = parser.parse_args(argv)
+
+    if args.ci:
+        args.listeners, args.speakers, args.duration, args.warmup = 100, 2, 10.0, 2.0
+    args.spawn = args.url is None
+    if args.spawn:
+        args.url = f"http://127.0.0.1:{args.port}"
+    return args
+
+
+def print_report(result: dict):
+    print("\n" + "=" * 60)
+    print("LIVE ROOM LOAD BENCHMARK")
+    print("=" * 60)
+    for key, value in result.items():
+        print(f"  {key:<26} {value}")
+    print("=" * 60)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    result = asyncio.run(LiveRoomBenchmark(args).run())
+    print_report(result)
+
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump(result, f, indent=2)
+
+    if args.max_p99_ms is not None and result["fanout_p99_ms"] > args.max_p99_ms:
+        print(f"❌ Fan-out p99 {result['fanout_p99_ms']}ms exceeds {args.max_p99_ms}ms")
+        return 1
+    if result["connected"] < args.listeners + args.speakers:
+        print("❌ Not every client could connect")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
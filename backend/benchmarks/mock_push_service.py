@@ -0,0 +1,218 @@
+"""
+Mock Web Push Service
+Local stand-in for FCM / Mozilla autopush: hands out PushSubscription
+objects whose endpoints point at itself, verifies the VAPID JWT and
+decrypts every message it receives, so services.web_push can be tested
+and load-tested without a browser
+
+Usage (from backend/):
+    # Serve on :8090; subscriptions from GET /subscription/{id}
+    python -m benchmarks.mock_push_service --port 8090 --latency-ms 30
+
+    # Send 2000 messages through WebPushService against an in-process mock
+    python -m benchmarks.mock_push_service --bench 2000 --gone-ratio 0.05
+
+Subscription ids starting with "gone" answer 410, like an expired
+browser subscription; --fail-ratio answers 500 at random.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import sys
+import time
+from typing import Dict, List, Tuple
+
+import uvicorn
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.asymmetric.utils import encode_dss_signature
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from fastapi import FastAPI, Request, Response
+
+
+def _b64url(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _b64url_decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def _hkdf(salt: bytes, ikm: bytes, info: bytes, length: int) -> bytes:
+    return HKDF(algorithm=hashes.SHA256(), length=length, salt=salt, info=info).derive(ikm)
+
+
+class BrowserKeys:
+    """Key pair and auth secret a browser would generate for one subscription"""
+
+    def __init__(self):
+        self.private_key = ec.generate_private_key(ec.SECP256R1())
+        self.public_bytes = self.private_key.public_key().public_bytes(
+            serialization.Encoding.X962, serialization.PublicFormat.UncompressedPoint
+        )
+        self.auth = os.urandom(16)
+
+    def decrypt(self, body: bytes) -> bytes:
+        """Decrypt an aes128gcm push message (RFC 8291, receiving side)"""
+        salt = body[:16]
+        key_length = body[20]
+        as_public = body[21:21 + key_length]
+        ciphertext = body[21 + key_length:]
+
+        as_key = ec.EllipticCurvePublicKey.from_encoded_point(ec.SECP256R1(), as_public)
+        shared_secret = self.private_key.exchange(ec.ECDH(), as_key)
+        ikm = _hkdf(self.auth, shared_secret, b"WebPush: info\x00" + self.public_bytes + as_public, 32)
+        cek = _hkdf(salt, ikm, b"Content-Encoding: aes128gcm\x00", 16)
+        nonce = _hkdf(salt, ikm, b"Content-Encoding: nonce\x00", 12)
+        plaintext = AESGCM(cek).decrypt(nonce, ciphertext, None)
+        # Strip padding and the last-record delimiter
+        return plaintext.rstrip(b"\x00")[:-1]
+
+
+def verify_vapid(authorization: str, audience: str) -> Tuple[bool, str]:
+    """Check a `vapid t=<jwt>, k=<key>` header the way a push service does"""
+    try:
+        params = dict(part.strip().split("=", 1) for part in authorization[len("vapid "):].split(","))
+        header, claims, signature = params["t"].split(".")
+        public_key = ec.EllipticCurvePublicKey.from_encoded_point(ec.SECP256R1(), _b64url_decode(params["k"]))
+        raw = _b64url_decode(signature)
+        public_key.verify(
+            encode_dss_signature(int.from_bytes(raw[:32], "big"), int.from_bytes(raw[32:], "big")),
+            f"{header}.{claims}".encode(),
+            ec.ECDSA(hashes.SHA256())
+        )
+        payload = json.loads(_b64url_decode(claims))
+    except (KeyError, ValueError, InvalidSignature) as e:
+        return False, f"invalid VAPID header ({type(e).__name__})"
+    if payload.get("aud") != audience:
+        return False, f"aud {payload.get('aud')} != {audience}"
+    if payload.get("exp", 0) < time.time():
+        return False, "expired JWT"
+    return True, ""
+
+
+def create_app(base_url: str, latency_ms: float = 0.0, fail_ratio: float = 0.0) -> FastAPI:
+    app = FastAPI(title="Mock Web Push Service")
+    subscriptions: Dict[str, BrowserKeys] = {}
+    stats = {"received": 0, "decrypted": 0, "rejected": 0, "gone": 0, "failed": 0}
+    app.state.subscriptions = subscriptions
+    app.state.stats = stats
+
+    @app.get("/subscription/{sub_id}")
+    async def get_subscription(sub_id: str):
+        keys = subscriptions.setdefault(sub_id, BrowserKeys())
+        return {
+            "endpoint": f"{base_url}/push/{sub_id}",
+            "keys": {"p256dh": _b64url(keys.public_bytes), "auth": _b64url(keys.auth)}
+        }
+
+    @app.post("/push/{sub_id}")
+    async def push(sub_id: str, request: Request):
+        stats["received"] += 1
+        if latency_ms:
+            await asyncio.sleep(random.uniform(0.5, 1.5) * latency_ms / 1000)
+        if sub_id.startswith("gone"):
+            stats["gone"] += 1
+            return Response(status_code=410)
+        if fail_ratio and random.random() < fail_ratio:
+            stats["failed"] += 1
+            return Response(status_code=500)
+
+        ok, error = verify_vapid(request.headers.get("authorization", ""), base_url)
+        keys = subscriptions.get(sub_id)
+        if not ok or keys is None or request.headers.get("content-encoding") != "aes128gcm":
+            stats["rejected"] += 1
+            return Response(error or "unknown subscription", status_code=403 if not ok else 400)
+        try:
+            json.loads(keys.decrypt(await request.body()))
+        except Exception as e:
+            stats["rejected"] += 1
+            return Response(f"decryption failed: {e}", status_code=400)
+        stats["decrypted"] += 1
+        return Response(status_code=201)
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    return app
+
+
+async def run_bench(args: argparse.Namespace) -> int:
+    from services.web_push import web_push
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    app = create_app(base_url, args.latency_ms, args.fail_ratio)
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=args.port, log_level="warning"))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    vapid_key = ec.generate_private_key(ec.SECP256R1())
+    web_push.set_vapid_keys(
+        _b64url(vapid_key.public_key().public_bytes(
+            serialization.Encoding.X962, serialization.PublicFormat.UncompressedPoint
+        )),
+        _b64url(vapid_key.private_numbers().private_value.to_bytes(32, "big"))
+    )
+
+    subscriptions: List[dict] = []
+    for i in range(args.bench):
+        sub_id = f"gone-{i}" if random.random() < args.gone_ratio else f"sub-{i}"
+        keys = app.state.subscriptions.setdefault(sub_id, BrowserKeys())
+        subscriptions.append({
+            "endpoint": f"{base_url}/push/{sub_id}",
+            "keys": {"p256dh": _b64url(keys.public_bytes), "auth": _b64url(keys.auth)}
+        })
+
+    message = {"title": "Benchmark", "body": "x" * args.payload_bytes, "data": {"url": "/", "type": "general"}}
+    started = time.perf_counter()
+    results = await asyncio.gather(*[web_push.send(sub, message) for sub in subscriptions])
+    elapsed = time.perf_counter() - started
+
+    await web_push.close()
+    server.should_exit = True
+    await server_task
+
+    stats = web_push.get_stats()
+    print("=" * 60)
+    print(f"  messages                   {args.bench}")
+    print(f"  elapsed_s                  {elapsed:.2f}")
+    print(f"  per_second                 {args.bench / elapsed:.0f}")
+    print(f"  sent / gone / failed       {stats['sent']} / "
+          f"{sum(1 for r in results if r.get('gone'))} / {stats['failed']}")
+    print(f"  push service               {json.dumps(app.state.stats)}")
+    for origin, latency in stats["push_services"].items():
+        print(f"  {origin:<26} p50 {latency['p50_ms']}ms  p95 {latency['p95_ms']}ms  max {latency['max_ms']}ms")
+    print("=" * 60)
+    return 0 if app.state.stats["rejected"] == 0 else 1
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Mock Web Push service")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--base-url", default=None, help="Public URL of this mock (default: http://127.0.0.1:PORT)")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Average simulated push service latency")
+    parser.add_argument("--fail-ratio", type=float, default=0.0, help="Share of requests answered with 500")
+    parser.add_argument("--bench", type=int, default=0, help="Send this many messages through WebPushService and exit")
+    parser.add_argument("--gone-ratio", type=float, default=0.0, help="Share of --bench subscriptions that answer 410")
+    parser.add_argument("--payload-bytes", type=int, default=200, help="Body size of --bench messages")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    if args.bench:
+        return asyncio.run(run_bench(args))
+    base_url = args.base_url or f"http://127.0.0.1:{args.port}"
+    uvicorn.run(create_app(base_url, args.latency_ms, args.fail_ratio), host="0.0.0.0", port=args.port)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -264,17 +264,26 @@ async def follow_author(author_id: str, user_id: str = Form(...)):
     notif_doc = notification.model_dump()
     notif_doc['created_at'] = notif_doc['created_at'].isoformat()
     await db.notifications.insert_one(notif_doc)
-    
-    # Trigger webhook
-    from webhook_service import webhook_service
-    follower = await db.authors.find_one({"id": user_id}, {"_id": 0})
-    await webhook_service.trigger_webhooks('follower.new', {
-        'author_id': author_id,
-        'author_name': author.get('name'),
-        'follower_id': user_id,
-        'follower_name': follower.get('name') if follower else 'Unknown',
-        'follower_username': follower.get('username') if follower else user_id
-    })
+    from services.unread_counters import unread_counters
+    from services.user_channel import user_channel
+    await unread_counters.notification_added(author_id)
+    user_channel.notification(notif_doc)
+    
+    # Trigger webhook (delivered by the notification outbox)
+    from services.webhook_subscriptions import webhook_subscriptions
+    if webhook_subscriptions.has_subscribers('follower.new'):
+        from services.notification_outbox import notification_outbox
+        follower = await db.authors.find_one({"id": user_id}, {"_id": 0})
+        await notification_outbox.enqueue("webhook", {
+            'event': 'follower.new',
+            'data': {
+                'author_id': author_id,
+                'author_name': author.get('name'),
+                'follower_id': user_id,
+                'follower_name': follower.get('name') if follower else 'Unknown',
+                'follower_username': follower.get('username') if follower else user_id
+            }
+        })
     
     return {"message": "Successfully followed", "is_following": True}
 
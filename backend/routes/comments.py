@@ -6,6 +6,8 @@ from typing import Optional
 import uuid
 from datetime import datetime, timezone
 
+from services.comment_threads import PAGE_SIZE, REPLY_PAGE_SIZE, comment_threads
+
 router = APIRouter(prefix="/podcasts", tags=["comments"])
 
 
@@ -15,23 +17,60 @@ async def get_db():
     return db
 
 
+@router.get("/comments/cache/stats")
+async def get_comment_cache_stats():
+    """Comment thread cache statistics"""
+    return comment_threads.get_stats()
+
+
 @router.get("/{podcast_id}/comments")
-async def get_podcast_comments(podcast_id: str):
-    """Get all comments for a podcast"""
+async def get_podcast_comments(
+    podcast_id: str,
+    limit: int = PAGE_SIZE,
+    before: Optional[str] = None,
+    user_id: Optional[str] = None
+):
+    """
+    Get comment threads for a podcast, newest first
+    
+    - before: the page after a top-level comment's `cursor`
+    - each comment carries `reply_count` and its first `replies`;
+      the rest load from /comments/{comment_id}/replies
+    - user_id: sets `liked_by_user` (liked_by itself is not returned)
+    
+    A page shorter than `limit` is the last one.
+    """
     db = await get_db()
     
-    # Check if podcast exists
-    podcast = await db.podcasts.find_one({"id": podcast_id})
-    if not podcast:
-        raise HTTPException(status_code=404, detail="Podcast not found")
+    try:
+        comments = await comment_threads.page(podcast_id, limit, before)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
     
-    # Get all comments for this podcast
-    comments = await db.comments.find(
-        {"podcast_id": podcast_id},
-        {"_id": 0}
-    ).sort("created_at", -1).to_list(1000)
+    # Check if podcast exists (only needed when there is nothing to show)
+    if not comments and not before:
+        podcast = await db.podcasts.find_one({"id": podcast_id}, {"_id": 1})
+        if not podcast:
+            raise HTTPException(status_code=404, detail="Podcast not found")
     
-    return comments
+    return await comment_threads.annotate(comments, user_id)
+
+
+@router.get("/{podcast_id}/comments/{comment_id}/replies")
+async def get_comment_replies(
+    podcast_id: str,
+    comment_id: str,
+    limit: int = REPLY_PAGE_SIZE,
+    after: Optional[str] = None,
+    user_id: Optional[str] = None
+):
+    """Get replies to a comment, oldest first (after: a reply's `cursor`)"""
+    try:
+        replies = await comment_threads.replies(podcast_id, comment_id, limit, after)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    
+    return await comment_threads.annotate(replies, user_id)
 
 
 @router.post("/{podcast_id}/comments")
@@ -81,6 +120,7 @@ async def add_comment(
         {"id": podcast_id},
         {"$inc": {"comments_count": 1}}
     )
+    comment_threads.invalidate(podcast_id)
     
     # Broadcast new comment via WebSocket
     try:
@@ -89,14 +129,19 @@ async def add_comment(
     except:
         pass
     
-    # Trigger webhook
+    # Trigger webhook (delivered by the notification outbox)
     try:
-        from webhook_service import webhook_service
-        await webhook_service.trigger_webhooks('comment.added', {
-            'podcast_id': podcast_id,
-            'comment_id': comment_id,
-            'user_id': user_id
-        })
+        from services.notification_outbox import notification_outbox
+        from services.webhook_subscriptions import webhook_subscriptions
+        if webhook_subscriptions.has_subscribers('comment.created'):
+            await notification_outbox.enqueue("webhook", {
+                'event': 'comment.created',
+                'data': {
+                    'podcast_id': podcast_id,
+                    'comment_id': comment_id,
+                    'user_id': user_id
+                }
+            }, idempotency_key=f"webhook:comment.created:{comment_id}")
     except:
         pass
     
@@ -111,7 +156,11 @@ async def like_comment(
     """Toggle like on a comment"""
     db = await get_db()
     
-    comment = await db.comments.find_one({"id": comment_id})
+    # Only this user's entry of liked_by, not the whole array
+    comment = await db.comments.find_one(
+        {"id": comment_id},
+        {"_id": 0, "podcast_id": 1, "likes_count": 1, "liked_by": {"$elemMatch": {"$eq": user_id}}}
+    )
     if not comment:
         raise HTTPException(status_code=404, detail="Comment not found")
     
@@ -126,7 +175,7 @@ async def like_comment(
                 "$inc": {"likes_count": -1}
             }
         )
-        return {"liked": False, "likes_count": comment.get("likes_count", 0) - 1}
+        result = {"liked": False, "likes_count": comment.get("likes_count", 0) - 1}
     else:
         # Like
         await db.comments.update_one(
@@ -136,7 +185,10 @@ async def like_comment(
                 "$inc": {"likes_count": 1}
             }
         )
-        return {"liked": True, "likes_count": comment.get("likes_count", 0) + 1}
+        result = {"liked": True, "likes_count": comment.get("likes_count", 0) + 1}
+    
+    comment_threads.invalidate(comment.get("podcast_id"))
+    return result
 
 
 @router.post("/comments/{comment_id}/reaction")
@@ -148,7 +200,7 @@ async def add_comment_reaction(
     """Add reaction to a comment"""
     db = await get_db()
     
-    comment = await db.comments.find_one({"id": comment_id})
+    comment = await db.comments.find_one({"id": comment_id}, {"_id": 0, "podcast_id": 1, "reactions": 1})
     if not comment:
         raise HTTPException(status_code=404, detail="Comment not found")
     
@@ -160,6 +212,7 @@ async def add_comment_reaction(
         {"id": comment_id},
         {"$set": {"reactions": reactions}}
     )
+    comment_threads.invalidate(comment.get("podcast_id"))
     
     return {"reaction_type": reaction_type, "count": reactions[reaction_type]}
 
@@ -172,7 +225,7 @@ async def delete_comment(
     """Delete a comment (only by owner)"""
     db = await get_db()
     
-    comment = await db.comments.find_one({"id": comment_id})
+    comment = await db.comments.find_one({"id": comment_id}, {"_id": 0, "podcast_id": 1, "user_id": 1})
     if not comment:
         raise HTTPException(status_code=404, detail="Comment not found")
     
@@ -188,5 +241,6 @@ async def delete_comment(
         {"id": comment.get("podcast_id")},
         {"$inc": {"comments_count": -1}}
     )
+    comment_threads.invalidate(comment.get("podcast_id"))
     
     return {"message": "Comment deleted"}
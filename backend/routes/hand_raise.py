@@ -13,6 +13,8 @@ from models import (
     HandRaiseCreate,
     HandRaiseApprove
 )
+from services.hand_raise_queue import hand_raise_queue, USER_FIELDS
+from services.live_session_registry import live_session_registry
 
 router = APIRouter(tags=["hand-raise"])
 logger = logging.getLogger(__name__)
@@ -23,6 +25,17 @@ db: Optional[AsyncIOMotorDatabase] = None
 def set_db(database: AsyncIOMotorDatabase):
     global db
     db = database
+    hand_raise_queue.set_db(database)
+    live_session_registry.set_db(database)
+    hand_raise_queue.set_on_change(push_hand_raise_queue)
+
+
+async def push_hand_raise_queue(session_id: str, message: dict):
+    """Push the updated queue to everyone in the session's live room"""
+    from routes.live_sessions import room_manager
+    from websocket_manager import manager
+    await room_manager.broadcast(session_id, message)
+    await manager.broadcast_to_room(session_id, message)
 
 
 async def check_moderator_permission(user_id: str) -> bool:
@@ -84,50 +97,43 @@ async def raise_hand(
     Query param: ?user_id=xxx
     """
     # Check if live session exists and is active
-    live_session = await db.live_sessions.find_one({"id": session_id, "is_live": True})
-    if not live_session:
+    live_session = await live_session_registry.get(session_id)
+    if not live_session or not live_session.get("is_live"):
         raise HTTPException(status_code=404, detail="Live session not found or not active")
     
     # Check if user exists
-    user = await db.users.find_one({"id": user_id})
+    user = await db.users.find_one({"id": user_id}, USER_FIELDS)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    # Check if user already has hand raised (pending)
-    existing = await db.hand_raise_events.find_one({
-        "user_id": user_id,
-        "live_session_id": session_id,
-        "status": "pending"
-    })
-    if existing:
+    # Pending hand raises live in the in-memory queue
+    queue = await hand_raise_queue.get(session_id)
+    if user_id in queue.by_user:
         raise HTTPException(status_code=400, detail="You already have your hand raised")
     
     # Check queue limit
-    club_settings = await db.club_settings.find_one({})
-    queue_limit = club_settings.get('hand_raise_queue_limit', 10) if club_settings else 10
-    
-    pending_count = await db.hand_raise_events.count_documents({
-        "live_session_id": session_id,
-        "status": "pending"
-    })
+    queue_limit = await hand_raise_queue.queue_limit()
+    pending_count = len(queue)
     
     if pending_count >= queue_limit:
         raise HTTPException(status_code=400, detail=f"Queue is full (max {queue_limit})")
     
     # Calculate queue position and priority
     priority_score = user.get('priority_score', 50.0)
-    queue_position = pending_count + 1
     
-    # Create hand raise event
+    # Create hand raise event (persisted in the background)
     hand_raise = HandRaiseEvent(
         user_id=user_id,
         live_session_id=session_id,
         status="pending",
-        queue_position=queue_position,
+        queue_position=pending_count + 1,
         priority_score=priority_score
     )
     
-    await db.hand_raise_events.insert_one(hand_raise.model_dump())
+    hand_raise_queue.add(session_id, queue, hand_raise.model_dump(), user)
+    queue_position = next(
+        e["queue_position"] for e in queue.snapshot() if e["hand_raise_id"] == hand_raise.id
+    )
     
     # Award XP for raising hand
     await award_xp_for_action(user_id, "hand_raised", 20, {
@@ -162,20 +168,15 @@ async def lower_hand(
     Query param: ?user_id=xxx
     """
     # Find pending hand raise
-    hand_raise = await db.hand_raise_events.find_one({
-        "user_id": user_id,
-        "live_session_id": session_id,
-        "status": "pending"
-    })
+    queue = await hand_raise_queue.get(session_id)
+    hand_raise_id = queue.by_user.get(user_id)
     
-    if not hand_raise:
+    if not hand_raise_id:
         raise HTTPException(status_code=404, detail="No pending hand raise found")
     
     # Update status to expired
-    await db.hand_raise_events.update_one(
-        {"id": hand_raise['id']},
-        {"$set": {"status": "expired"}}
-    )
+    hand_raise_queue.resolve(session_id, queue, hand_raise_id, {"status": "expired"})
+    await hand_raise_queue.flush()
     
     return {"message": "Hand lowered successfully"}
 
@@ -184,37 +185,13 @@ async def lower_hand(
 async def get_hand_raise_queue(session_id: str):
     """
     Get hand raise queue for live session
-    Sorted by priority_score (desc)
-    """
-    # Get all pending hand raises
-    hand_raises = await db.hand_raise_events.find({
-        "live_session_id": session_id,
-        "status": "pending"
-    }).sort("priority_score", -1).to_list(length=None)
-    
-    # Enrich with user data
-    queue = []
-    for idx, hr in enumerate(hand_raises):
-        user = await db.users.find_one({"id": hr['user_id']})
-        if user:
-            queue.append({
-                "hand_raise_id": hr['id'],
-                "user_id": user['id'],
-                "username": user['username'],
-                "name": user['name'],
-                "avatar": user.get('avatar'),
-                "role": user.get('role', 'listener'),
-                "level": user.get('level', 1),
-                "priority_score": hr['priority_score'],
-                "raised_at": hr['raised_at'],
-                "queue_position": idx + 1
-            })
+    Sorted by priority_score (desc), then raise time
     
-    return {
-        "live_session_id": session_id,
-        "queue": queue,
-        "total": len(queue)
-    }
+    Live-room sockets receive the same payload as a "hand_raise_queue"
+    message on every change, so clients don't need to poll this.
+    """
+    await hand_raise_queue.get(session_id)
+    return hand_raise_queue.payload(session_id)
 
 
 @router.post("/live/{session_id}/approve-speaker")
@@ -235,28 +212,20 @@ async def approve_speaker(
             detail="Only moderators, admins, or owner can approve speakers"
         )
     
-    # Find hand raise event
-    hand_raise = await db.hand_raise_events.find_one({
-        "id": hand_raise_id,
-        "live_session_id": session_id,
-        "status": "pending"
+    # Take hand raise out of the queue
+    queue = await hand_raise_queue.get(session_id)
+    speech_started_at = datetime.now(timezone.utc)
+    hand_raise = hand_raise_queue.resolve(session_id, queue, hand_raise_id, {
+        "status": "approved",
+        "approved_at": speech_started_at,
+        "approved_by": moderator_id,
+        "speech_started_at": speech_started_at
     })
     
     if not hand_raise:
         raise HTTPException(status_code=404, detail="Hand raise not found or already processed")
-    
-    # Update hand raise status
-    await db.hand_raise_events.update_one(
-        {"id": hand_raise_id},
-        {
-            "$set": {
-                "status": "approved",
-                "approved_at": datetime.now(timezone.utc),
-                "approved_by": moderator_id,
-                "speech_started_at": datetime.now(timezone.utc)
-            }
-        }
-    )
+    # end-speech and current-speaker read the approved event back
+    await hand_raise_queue.flush()
     
     # Update live session current speaker
     await db.live_sessions.update_one(
@@ -264,14 +233,12 @@ async def approve_speaker(
         {"$set": {"current_speaker_id": hand_raise['user_id']}}
     )
     
-    user = await db.users.find_one({"id": hand_raise['user_id']})
-    
-    logger.info(f"Moderator {moderator_id} approved speaker {user['name']} in session {session_id}")
+    logger.info(f"Moderator {moderator_id} approved speaker {hand_raise['name']} in session {session_id}")
     
     return {
-        "message": f"Speaker {user['name']} approved",
-        "speaker_id": user['id'],
-        "speech_started_at": datetime.now(timezone.utc).isoformat()
+        "message": f"Speaker {hand_raise['name']} approved",
+        "speaker_id": hand_raise['user_id'],
+        "speech_started_at": speech_started_at.isoformat()
     }
 
 
@@ -3,10 +3,11 @@ Live Room Routes - WebSocket and HTTP endpoints for live rooms
 """
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Form, Query, HTTPException
 from typing import Optional, List
-import json
 from datetime import datetime
 
 from websocket_manager import manager
+from services.live_chat_log import chat_log
+from services.live_rate_limit import live_rate_limiter
 
 router = APIRouter(prefix="/live", tags=["live"])
 
@@ -85,10 +86,11 @@ async def websocket_live_room(
     - user_id: User identifier
     - username: Display name
     - role: 'listener' or 'speaker'
+    - encoding: 'msgpack' for binary frames (or offer subprotocol 'fomo.msgpack.v1')
     """
     print(f"🔌 WebSocket connection attempt: room={room_id}, user={user_id}, role={role}")
     
-    await manager.connect(websocket, room_id, user_id, role)
+    websocket = await manager.connect(websocket, room_id, user_id, role)
     
     try:
         # Send initial room data
@@ -100,10 +102,14 @@ async def websocket_live_room(
         
         # Listen for messages
         while True:
-            data = await websocket.receive_text()
-            message = json.loads(data)
+            message = await websocket.receive()
+            manager.presence.touch(room_id, id(websocket))
+            if message is None:
+                continue
             
             msg_type = message.get("type")
+            if not await live_rate_limiter.admit(user_id, msg_type, websocket):
+                continue
             
             if msg_type == "chat_message":
                 await manager.handle_chat_message(
@@ -133,15 +139,9 @@ async def websocket_live_room(
                     
     except WebSocketDisconnect:
         print(f"❌ WebSocket disconnected: room={room_id}, user={user_id}")
+        # Leave event goes out in the next batched presence frame
         manager.disconnect(websocket, room_id, user_id)
         
-        # Broadcast user left
-        await manager.broadcast_to_room(room_id, {
-            "type": "user_left",
-            "user_id": user_id,
-            "stats": manager.get_room_stats(room_id)
-        })
-        
     except Exception as e:
         print(f"❌ WebSocket error: {e}")
         manager.disconnect(websocket, room_id, user_id)
@@ -163,16 +163,17 @@ async def send_chat_message(
     message: str = Form(...)
 ):
     """Send chat message via HTTP (fallback when WebSocket unavailable)"""
-    await manager.handle_chat_message(room_id, user_id, username, message)
+    chat_message = await manager.handle_chat_message(room_id, user_id, username, message)
     
-    # Return the message that was sent
-    chat_message = {
-        "id": f"{user_id}_{datetime.utcnow().timestamp()}",
-        "user_id": user_id,
-        "username": username,
-        "message": message,
-        "timestamp": datetime.utcnow().isoformat()
-    }
+    if chat_message is None:
+        # Room not open in this process; echo back as before
+        chat_message = {
+            "id": f"{user_id}_{datetime.utcnow().timestamp()}",
+            "user_id": user_id,
+            "username": username,
+            "message": message,
+            "timestamp": datetime.utcnow().isoformat()
+        }
     
     return {
         "success": True,
@@ -180,6 +181,26 @@ async def send_chat_message(
     }
 
 
+@router.get("/room/{room_id}/chat")
+async def get_room_chat(room_id: str, since: Optional[str] = None, limit: int = 50):
+    """
+    Replay room chat (late joiners and archive)
+    Pass next_since from the previous page as `since`
+    """
+    room = manager.rooms.get(room_id)
+    try:
+        page = await chat_log.replay(
+            room_id,
+            since=since,
+            limit=limit,
+            recent=room["chat_messages"] if room else None
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    
+    return {"room_id": room_id, **page}
+
+
 @router.post("/room/{room_id}/hand")
 async def toggle_hand_raise(
     room_id: str,
@@ -6,15 +6,29 @@ Real-time WebSocket support, LiveKit token generation, and XP rewards
 from fastapi import APIRouter, HTTPException, Depends, WebSocket, WebSocketDisconnect, Request
 from pydantic import BaseModel
 from typing import Optional, List, Dict
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 from motor.motor_asyncio import AsyncIOMotorDatabase
 import uuid
 import secrets
-import json
+import html
 import os
-import asyncio
 import logging
 
+from services.live_coalescer import RoomEventCoalescer
+from services.live_presence import PresenceService
+from services.hand_raise_queue import hand_raise_queue
+from services.live_chat_log import chat_log, new_ring_buffer, recent_messages
+from services import live_protocol
+from services.live_protocol import LiveSocket, FrameCache
+from services.live_rate_limit import live_rate_limiter
+from services.live_session_registry import live_session_registry
+from services.live_room_snapshots import RoomSnapshotService
+from services.live_timeline import TimelineRecorder, SAMPLE_INTERVAL
+from services.notification_outbox import notification_outbox
+from services.telegram_recipients import telegram_recipients
+from services.scheduler import scheduler, as_utc
+from services.xp_accrual import xp_accrual
+
 # Import auth middleware
 try:
     from middleware.auth import require_admin, get_current_user, AuthUser
@@ -34,6 +48,13 @@ db: Optional[AsyncIOMotorDatabase] = None
 def set_db(database: AsyncIOMotorDatabase):
     global db
     db = database
+    xp_accrual.set_db(database)
+    chat_log.set_db(database)
+    live_session_registry.set_db(database)
+    room_manager.snapshots.set_db(database)
+    room_manager.timeline.set_db(database)
+    notification_outbox.set_db(database)
+    scheduler.set_db(database)
 
 
 # ===========================================
@@ -50,57 +71,22 @@ XP_REWARDS = {
 }
 
 
-async def award_session_xp(user_id: str, action: str, metadata: dict = None):
-    """Award XP for live session actions"""
-    if db is None:
-        return
-    
+def award_session_xp(user_id: str, action: str, metadata: dict = None):
+    """
+    Award XP for live session actions
+    Queued in memory and written in batches by the XP accrual service
+    """
     xp_amount = XP_REWARDS.get(action, 0)
     if xp_amount == 0:
         return
     
-    try:
-        # Check user exists
-        user = await db.users.find_one({"id": user_id})
-        if not user:
-            # Try to find by wallet or create minimal record
-            logger.warning(f"User {user_id} not found for XP award")
-            return
-        
-        # Create XP transaction
-        xp_transaction = {
-            "user_id": user_id,
-            "action": f"live_{action}",
-            "xp_earned": xp_amount,
-            "timestamp": datetime.now(timezone.utc),
-            "metadata": metadata or {}
-        }
-        await db.xp_transactions.insert_one(xp_transaction)
-        
-        # Update user XP
-        current_xp = user.get('xp_total', 0)
-        new_xp = current_xp + xp_amount
-        
-        # Update XP breakdown
-        xp_breakdown = user.get('xp_breakdown', {})
-        xp_breakdown['live_attendance'] = xp_breakdown.get('live_attendance', 0) + xp_amount
-        
-        await db.users.update_one(
-            {"id": user_id},
-            {"$set": {"xp_total": new_xp, "xp_breakdown": xp_breakdown}}
-        )
-        
-        logger.info(f"Awarded {xp_amount} XP to {user_id} for {action}")
-        
-        # Check for badge awards
-        try:
-            from routes.badges import check_and_award_participation_badges
-            await check_and_award_participation_badges(user_id)
-        except Exception as e:
-            logger.error(f"Badge check error: {e}")
-            
-    except Exception as e:
-        logger.error(f"XP award error: {e}")
+    xp_accrual.award(
+        user_id,
+        f"live_{action}",
+        xp_amount,
+        "live_attendance",
+        metadata
+    )
 
 
 # ===========================================
@@ -110,10 +96,28 @@ class LiveRoomManager:
     """Manages WebSocket connections for live session rooms"""
     
     def __init__(self):
-        # session_id -> {user_id: WebSocket}
-        self.connections: Dict[str, Dict[str, WebSocket]] = {}
+        # session_id -> {user_id: LiveSocket}
+        self.connections: Dict[str, Dict[str, LiveSocket]] = {}
         # session_id -> room state
         self.rooms: Dict[str, dict] = {}
+        # Reactions are merged into one frame per room tick
+        self.coalescer = RoomEventCoalescer(
+            self.broadcast,
+            lambda session_id: len(self.connections.get(session_id, {}))
+        )
+        # Heartbeats, idle reaping, batched join/leave and time-in-room XP
+        self.presence = PresenceService(
+            self._reap_idle,
+            self._broadcast_presence,
+            on_reward=lambda session_id, user_id: award_session_xp(
+                user_id, "session_5min", {"session_id": session_id}
+            )
+        )
+        # Crash recovery: periodic snapshots, restored on first reconnect
+        self.snapshots = RoomSnapshotService(self._snapshot_state)
+        self._hydrated: set = set()
+        # Concurrency / activity samples for the session timeline
+        self.timeline = TimelineRecorder(self._timeline_sample)
     
     def get_room(self, session_id: str) -> dict:
         """Get or create room state"""
@@ -123,21 +127,98 @@ class LiveRoomManager:
                 "speakers": [],
                 "listeners": [],
                 "hand_raised": [],
-                "chat_messages": [],
-                "reactions": []
+                "chat_messages": new_ring_buffer(),
+                "reactions": [],
+                # user_id -> role decided in this room (speaker joins, promote/demote);
+                # survives reconnects and restarts
+                "roles": {},
+                "counters": {"chat_messages": 0, "reactions": 0},
+                # Hand raises restored from a snapshot, waiting for their users to return
+                "restored_hand_raised": [],
+                "hand_raise_order": {}
             }
         return self.rooms[session_id]
     
-    async def connect(self, websocket: WebSocket, session_id: str, user_id: str, username: str, role: str = "listener"):
-        """Connect user to live room"""
-        await websocket.accept()
+    async def load_room(self, session_id: str) -> dict:
+        """Get room state, restoring the last snapshot the first time a room is used"""
+        if session_id in self._hydrated:
+            return self.get_room(session_id)
+        
+        snapshot = await self.snapshots.load(session_id)
+        room = self.get_room(session_id)
+        if session_id in self._hydrated:
+            return room
+        self._hydrated.add(session_id)
+        
+        if snapshot:
+            room["roles"].update(snapshot.get("roles", {}))
+            room["counters"].update(snapshot.get("counters", {}))
+            room["restored_hand_raised"] = list(snapshot.get("hand_raised", []))
+            room["hand_raise_order"] = {
+                user_id: idx for idx, user_id in enumerate(room["restored_hand_raised"])
+            }
+            chat = new_ring_buffer()
+            chat.extend(snapshot.get("chat_messages", []))
+            chat.extend(room["chat_messages"])
+            room["chat_messages"] = chat
+            logger.info(f"Restored live room {session_id} from snapshot ({snapshot.get('updated_at')})")
+        return room
+    
+    def discard_snapshot(self, session_id: str):
+        """Forget a finished session's snapshot and hydration state"""
+        self.snapshots.discard(session_id)
+        self._hydrated.discard(session_id)
+    
+    def _snapshot_state(self, session_id: str) -> Optional[dict]:
+        """Recoverable part of a room (see RoomSnapshotService)"""
+        room = self.rooms.get(session_id)
+        if room is None:
+            return None
+        waiting = [
+            user_id for user_id in room["restored_hand_raised"]
+            if user_id not in room["participants"]
+        ]
+        return {
+            "roles": room["roles"],
+            "hand_raised": room["hand_raised"] + waiting,
+            "counters": room["counters"]
+        }
+    
+    def _timeline_sample(self, session_id: str) -> Optional[tuple]:
+        room = self.rooms.get(session_id)
+        if room is None:
+            return None
+        return (
+            len(room["listeners"]),
+            len(room["speakers"]),
+            room["counters"]["chat_messages"],
+            room["counters"]["reactions"]
+        )
+    
+    async def connect(self, websocket: WebSocket, session_id: str, user_id: str, username: str, role: str = "listener") -> LiveSocket:
+        """Connect user to live room (JSON or binary protocol, negotiated on accept)"""
+        room = await self.load_room(session_id)
+        conn = await live_protocol.accept(websocket)
         
         if session_id not in self.connections:
             self.connections[session_id] = {}
         
-        self.connections[session_id][user_id] = websocket
+        self.connections[session_id][user_id] = conn
+        
+        # Promotions / demotions outlive the connection
+        role = room["roles"].get(user_id, role)
+        if role == "speaker" and room["roles"].get(user_id) != "speaker":
+            room["roles"][user_id] = "speaker"
+            self.snapshots.mark(session_id)
+        
+        # Back after a restart with a hand raised: original queue order
+        if user_id in room["restored_hand_raised"]:
+            room["restored_hand_raised"].remove(user_id)
+            if user_id not in room["hand_raised"]:
+                order = room["hand_raise_order"]
+                room["hand_raised"].append(user_id)
+                room["hand_raised"].sort(key=lambda u: order.get(u, len(order)))
         
-        room = self.get_room(session_id)
         room["participants"][user_id] = {
             "user_id": user_id,
             "username": username,
@@ -160,26 +241,39 @@ class LiveRoomManager:
             "speakers": room["speakers"],
             "listeners": room["listeners"],
             "hand_raised": room["hand_raised"],
-            "chat_messages": room["chat_messages"][-50:],
+            "chat_messages": recent_messages(room["chat_messages"], 50),
             "stats": self.get_stats(session_id)
         })
         
-        # Then broadcast join event to OTHERS (not self)
-        await self.broadcast_except(session_id, user_id, {
-            "type": "user_joined",
+        self.timeline.track(session_id)
+        
+        # Join event reaches others in the next batched presence frame
+        self.presence.register(session_id, user_id, user_id, conn, {
             "user_id": user_id,
             "username": username,
-            "role": role,
-            "stats": self.get_stats(session_id)
+            "role": role
         })
-    
-    async def disconnect(self, session_id: str, user_id: str):
-        """Disconnect user from live room"""
-        if session_id in self.connections and user_id in self.connections[session_id]:
+        return conn
+    
+    async def disconnect(self, session_id: str, user_id: str, websocket: LiveSocket = None):
+        """
+        Disconnect user from live room
+        Ignored if websocket is given and the user has since reconnected
+        """
+        current = self.connections.get(session_id, {}).get(user_id)
+        if websocket is not None and current is not None and current is not websocket:
+            return
+        if current is None and user_id not in self.rooms.get(session_id, {}).get("participants", {}):
+            return
+        
+        self.presence.unregister(session_id, user_id)
+        
+        if current is not None:
             del self.connections[session_id][user_id]
             
             if not self.connections[session_id]:
                 del self.connections[session_id]
+                self.coalescer.discard(session_id)
         
         if session_id in self.rooms:
             room = self.rooms[session_id]
@@ -191,45 +285,59 @@ class LiveRoomManager:
                 room["listeners"].remove(user_id)
             if user_id in room["hand_raised"]:
                 room["hand_raised"].remove(user_id)
-            
-            # Broadcast leave event
-            await self.broadcast(session_id, {
-                "type": "user_left",
-                "user_id": user_id,
-                "stats": self.get_stats(session_id)
-            })
+                self.snapshots.mark(session_id)
+    
+    async def _reap_idle(self, session_id: str, user_id: str, websocket: LiveSocket):
+        """Close and remove a connection that stopped answering pings"""
+        try:
+            await websocket.close(code=4008)
+        except Exception:
+            pass
+        await self.disconnect(session_id, user_id, websocket)
+    
+    async def _broadcast_presence(self, session_id: str, joined: list, left: list):
+        """Send one frame with all joins/leaves since the last presence tick"""
+        await self.broadcast(session_id, {
+            "type": "presence",
+            "joined": joined,
+            "left": left,
+            "stats": self.get_stats(session_id)
+        })
     
     async def broadcast(self, session_id: str, message: dict):
         """Broadcast message to all users in room"""
         if session_id not in self.connections:
             return
         
+        # Encode once per wire format, not once per listener
+        frames = FrameCache(message)
         disconnected = []
-        for user_id, ws in self.connections[session_id].items():
+        for user_id, ws in list(self.connections[session_id].items()):
             try:
-                await ws.send_json(message)
+                await ws.send_frame(frames.get(ws.encoding))
             except Exception:
-                disconnected.append(user_id)
+                disconnected.append((user_id, ws))
         
-        for user_id in disconnected:
-            await self.disconnect(session_id, user_id)
+        for user_id, ws in disconnected:
+            await self.disconnect(session_id, user_id, ws)
     
     async def broadcast_except(self, session_id: str, except_user_id: str, message: dict):
         """Broadcast message to all users except one"""
         if session_id not in self.connections:
             return
         
+        frames = FrameCache(message)
         disconnected = []
-        for user_id, ws in self.connections[session_id].items():
+        for user_id, ws in list(self.connections[session_id].items()):
             if user_id == except_user_id:
                 continue
             try:
-                await ws.send_json(message)
+                await ws.send_frame(frames.get(ws.encoding))
             except Exception:
-                disconnected.append(user_id)
+                disconnected.append((user_id, ws))
         
-        for user_id in disconnected:
-            await self.disconnect(session_id, user_id)
+        for user_id, ws in disconnected:
+            await self.disconnect(session_id, user_id, ws)
     
     async def send_to_user(self, session_id: str, user_id: str, message: dict):
         """Send message to specific user"""
@@ -261,9 +369,11 @@ class LiveRoomManager:
             "timestamp": datetime.now(timezone.utc).isoformat()
         }
         
+        # Ring buffer drops the oldest message; full history is persisted in the background
         room["chat_messages"].append(chat_msg)
-        if len(room["chat_messages"]) > 100:
-            room["chat_messages"] = room["chat_messages"][-100:]
+        room["counters"]["chat_messages"] += 1
+        chat_log.append(session_id, chat_msg)
+        self.snapshots.add_chat(session_id, chat_msg)
         
         await self.broadcast(session_id, {
             "type": "chat_message",
@@ -271,14 +381,10 @@ class LiveRoomManager:
         })
     
     async def handle_reaction(self, session_id: str, user_id: str, username: str, emoji: str):
-        """Handle emoji reaction"""
-        await self.broadcast(session_id, {
-            "type": "reaction",
-            "user_id": user_id,
-            "username": username,
-            "emoji": emoji,
-            "timestamp": datetime.now(timezone.utc).isoformat()
-        })
+        """Handle emoji reaction (delivered in the next room_tick frame)"""
+        self.get_room(session_id)["counters"]["reactions"] += 1
+        self.snapshots.mark(session_id)
+        self.coalescer.add_reaction(session_id, emoji)
     
     async def handle_hand_raise(self, session_id: str, user_id: str, action: str):
         """Handle hand raise/lower"""
@@ -288,6 +394,7 @@ class LiveRoomManager:
             room["hand_raised"].append(user_id)
         elif action == "lower" and user_id in room["hand_raised"]:
             room["hand_raised"].remove(user_id)
+        self.snapshots.mark(session_id)
         
         await self.broadcast(session_id, {
             "type": "hand_raised_update",
@@ -310,6 +417,8 @@ class LiveRoomManager:
         
         if user_id in room["participants"]:
             room["participants"][user_id]["role"] = "speaker"
+        room["roles"][user_id] = "speaker"
+        self.snapshots.mark(session_id)
         
         await self.broadcast(session_id, {
             "type": "user_promoted",
@@ -328,6 +437,8 @@ class LiveRoomManager:
         
         if user_id in room["participants"]:
             room["participants"][user_id]["role"] = "listener"
+        room["roles"][user_id] = "listener"
+        self.snapshots.mark(session_id)
         
         await self.broadcast(session_id, {
             "type": "user_demoted",
@@ -358,136 +469,110 @@ class LiveSessionUpdate(BaseModel):
 # ===========================================
 # Reminder System
 # ===========================================
-reminder_task = None
-sent_reminders = set()  # Track sent reminders to avoid duplicates
+# Reminders are sent this many minutes before scheduled_at
+REMINDER_MINUTES = (15, 5)
+
+
+def reminder_job_id(session_id: str, minutes: int) -> str:
+    return f"live_reminder_{minutes}min:{session_id}"
 
 
-async def check_upcoming_sessions():
-    """Background task to send reminders for upcoming sessions"""
-    global sent_reminders
+async def schedule_session_reminders(session: dict):
+    """
+    (Re)schedule the reminder jobs of a session
     
-    while True:
-        try:
-            now = datetime.now(timezone.utc)
-            
-            # Find sessions scheduled in next 15 minutes that haven't been reminded
-            upcoming = await db.live_sessions.find({
-                "status": "scheduled",
-                "scheduled_at": {
-                    "$gte": now,
-                    "$lte": now + timedelta(minutes=16)
-                }
-            }).to_list(50)
-            
-            for session in upcoming:
-                session_id = session.get("id")
-                scheduled_at = session.get("scheduled_at")
-                
-                if not scheduled_at or session_id in sent_reminders:
-                    continue
-                
-                # Calculate minutes until start
-                if isinstance(scheduled_at, str):
-                    scheduled_at = datetime.fromisoformat(scheduled_at.replace('Z', '+00:00'))
-                
-                minutes_until = (scheduled_at - now).total_seconds() / 60
-                
-                # Send 15-minute reminder
-                if 14 <= minutes_until <= 16:
-                    logger.info(f"Sending 15-min reminder for session {session_id}")
-                    await send_session_reminder(session, minutes=15)
-                    sent_reminders.add(session_id)
-                
-                # Send 5-minute reminder
-                elif 4 <= minutes_until <= 6:
-                    reminder_key = f"{session_id}_5min"
-                    if reminder_key not in sent_reminders:
-                        logger.info(f"Sending 5-min reminder for session {session_id}")
-                        await send_session_reminder(session, minutes=5)
-                        sent_reminders.add(reminder_key)
-            
-            # Clean old reminders (older than 1 hour)
-            if len(sent_reminders) > 1000:
-                sent_reminders.clear()
-                
-        except Exception as e:
-            logger.error(f"Reminder check error: {e}")
-        
-        await asyncio.sleep(60)  # Check every minute
+    Called whenever a session is created or changed; reminders of
+    sessions that are no longer scheduled are cancelled.
+    """
+    session_id = session["id"]
+    scheduled_at = as_utc(session.get("scheduled_at"))
+    if session.get("status") != "scheduled" or not scheduled_at:
+        await scheduler.cancel([reminder_job_id(session_id, m) for m in REMINDER_MINUTES])
+        return
+    
+    now = datetime.now(timezone.utc)
+    for minutes in REMINDER_MINUTES:
+        job_id = reminder_job_id(session_id, minutes)
+        run_at = scheduled_at - timedelta(minutes=minutes)
+        if run_at < now - timedelta(minutes=1):
+            # Too close to the start for this reminder
+            await scheduler.cancel([job_id])
+            continue
+        await scheduler.schedule(job_id, "live_reminder", run_at, {
+            "session_id": session_id,
+            "minutes": minutes,
+            "scheduled_at": scheduled_at.isoformat()
+        })
+
+
+async def run_session_reminder(job: dict):
+    """Scheduler handler: send one reminder if the session still starts as planned"""
+    payload = job["payload"]
+    session = await db.live_sessions.find_one({"id": payload["session_id"]}, {"_id": 0})
+    if not session or session.get("status") != "scheduled":
+        return
+    scheduled_at = as_utc(session.get("scheduled_at"))
+    if not scheduled_at or scheduled_at.isoformat() != payload["scheduled_at"]:
+        return  # Moved; the rescheduled job sends it
+    if scheduled_at <= datetime.now(timezone.utc):
+        return  # Scheduler was down past the start
+    
+    logger.info(f"Sending {payload['minutes']}-min reminder for session {session['id']}")
+    await send_session_reminder(session, minutes=payload["minutes"])
+
+
+scheduler.register("live_reminder", run_session_reminder)
+
+
+async def schedule_upcoming_reminders():
+    """Schedule reminders for sessions created before the scheduler existed"""
+    async for session in db.live_sessions.find(
+        {"status": "scheduled", "scheduled_at": {"$gte": datetime.now(timezone.utc)}},
+        {"_id": 0, "id": 1, "status": 1, "scheduled_at": 1}
+    ):
+        await schedule_session_reminders(session)
+
+
+# Platform-wide notifications go to every connected user and author
+notification_outbox.register_audience("telegram_connected", telegram_recipients.iter_chat_ids)
 
 
 async def send_session_reminder(session: dict, minutes: int):
-    """Send Telegram reminder for upcoming session"""
-    try:
-        from services.telegram_service import telegram_service
-        
-        bot_token = os.environ.get("TELEGRAM_BOT_TOKEN", "8293451127:AAEVo5vQV_vJqoziVTDKHYJiOYUZQN-2M2E")
-        
-        # Find all users with Telegram connected
-        users = await db.users.find(
-            {"telegram_connected": True, "telegram_chat_id": {"$exists": True, "$ne": None}},
-            {"telegram_chat_id": 1}
-        ).to_list(1000)
-        
-        authors = await db.authors.find(
-            {"telegram_connected": True, "telegram_chat_id": {"$exists": True, "$ne": None}},
-            {"telegram_chat_id": 1}
-        ).to_list(1000)
-        
-        all_chat_ids = set()
-        for u in users:
-            if u.get("telegram_chat_id"):
-                all_chat_ids.add(u["telegram_chat_id"])
-        for a in authors:
-            if a.get("telegram_chat_id"):
-                all_chat_ids.add(a["telegram_chat_id"])
-        
-        if not all_chat_ids:
-            return
-        
-        # Format scheduled time
-        scheduled_at = session.get("scheduled_at")
-        if isinstance(scheduled_at, str):
-            scheduled_at = datetime.fromisoformat(scheduled_at.replace('Z', '+00:00'))
-        
-        time_str = scheduled_at.strftime("%H:%M") if scheduled_at else "скоро"
-        
-        message = f"""
+    """Queue Telegram reminder for upcoming session (errors reach the scheduler, which retries)"""
+    bot_token = os.environ.get("TELEGRAM_BOT_TOKEN", "8293451127:AAEVo5vQV_vJqoziVTDKHYJiOYUZQN-2M2E")
+    
+    # Format scheduled time
+    scheduled_at = session.get("scheduled_at")
+    if isinstance(scheduled_at, str):
+        scheduled_at = datetime.fromisoformat(scheduled_at.replace('Z', '+00:00'))
+    
+    time_str = scheduled_at.strftime("%H:%M") if scheduled_at else "скоро"
+    
+    message = f"""
 ⏰ <b>Напоминание о стриме!</b>
 
-🎙️ <b>{session.get('title', 'Live Session')}</b>
+🎙️ <b>{html.escape(session.get('title') or 'Live Session')}</b>
 
 ⏱️ Начало через <b>{minutes} минут</b> (в {time_str})
 
-{session.get('description', '')[:100] if session.get('description') else ''}
+{html.escape(session['description'][:100]) if session.get('description') else ''}
 
 👉 Не пропустите! Присоединяйтесь в приложении.
 """
-        
-        for chat_id in all_chat_ids:
-            try:
-                await telegram_service.send_message(
-                    bot_token=bot_token,
-                    chat_id=str(chat_id),
-                    text=message.strip()
-                )
-            except Exception as e:
-                logger.error(f"Failed to send reminder to {chat_id}: {e}")
-                
-    except Exception as e:
-        logger.error(f"Send reminder error: {e}")
-
-
-def start_reminder_task():
-    """Start the background reminder task"""
-    global reminder_task
-    if reminder_task is None or reminder_task.done():
-        reminder_task = asyncio.create_task(check_upcoming_sessions())
-        logger.info("Reminder task started")
+    
+    await notification_outbox.enqueue(
+        "telegram_broadcast",
+        {
+            "bot_token": bot_token,
+            "text": message.strip(),
+            "name": f"reminder_{minutes}min",
+            "audience": "telegram_connected"
+        },
+        # Keyed per start time: a moved session is reminded again
+        idempotency_key=f"{reminder_job_id(session.get('id'), minutes)}:{scheduled_at.isoformat() if scheduled_at else ''}"
+    )
 
 
-# Start reminder task when module loads (will be called from server.py)
-from datetime import timedelta
 
 
 @router.post("/sessions")
@@ -544,6 +629,8 @@ async def create_live_session(
     }
     
     await db.live_sessions.insert_one(session)
+    live_session_registry.put(session)
+    await schedule_session_reminders(session)
     
     return {
         "session_id": session_id,
@@ -612,6 +699,12 @@ async def update_live_session(session_id: str, update_data: LiveSessionUpdate):
     
     update_dict = update_data.dict(exclude_unset=True)
     update_dict["updated_at"] = datetime.now(timezone.utc)
+    if update_dict.get("scheduled_at"):
+        # Stored as a datetime, like on create
+        try:
+            update_dict["scheduled_at"] = as_utc(update_dict["scheduled_at"])
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid scheduled_at")
     
     # Handle status changes
     if "status" in update_dict:
@@ -627,6 +720,12 @@ async def update_live_session(session_id: str, update_data: LiveSessionUpdate):
         {"id": session_id},
         {"$set": update_dict}
     )
+    live_session_registry.invalidate(session_id)
+    if update_dict.get("status") == "ended":
+        room_manager.discard_snapshot(session_id)
+        hand_raise_queue.drop(session_id)
+    if "scheduled_at" in update_dict or "status" in update_dict:
+        await schedule_session_reminders({**session, **update_dict})
     
     return {"success": True, "session_id": session_id}
 
@@ -666,56 +765,39 @@ async def start_live_session(session_id: str, request: Request):
             }
         }
     )
+    live_session_registry.invalidate(session_id)
+    await scheduler.cancel([reminder_job_id(session_id, m) for m in REMINDER_MINUTES])
     
     # Send Telegram notifications to all connected users
-    asyncio.create_task(send_live_start_notifications(session))
+    await send_live_start_notifications(session)
     
     return {"success": True, "status": "live", "session_id": session_id}
 
 
 async def send_live_start_notifications(session: dict):
-    """Send Telegram notifications when live session starts"""
+    """Queue Telegram notifications when live session starts"""
     try:
         from services.telegram_service import telegram_service
         
         # Get bot token
         bot_token = os.environ.get("TELEGRAM_BOT_TOKEN", "8293451127:AAEVo5vQV_vJqoziVTDKHYJiOYUZQN-2M2E")
         
-        # Find all users with Telegram connected
-        users = await db.users.find(
-            {"telegram_connected": True, "telegram_chat_id": {"$exists": True, "$ne": None}},
-            {"telegram_chat_id": 1}
-        ).to_list(1000)
-        
-        # Also check authors collection (backward compatibility)
-        authors = await db.authors.find(
-            {"telegram_connected": True, "telegram_chat_id": {"$exists": True, "$ne": None}},
-            {"telegram_chat_id": 1}
-        ).to_list(1000)
-        
-        all_chat_ids = set()
-        for u in users:
-            if u.get("telegram_chat_id"):
-                all_chat_ids.add(u["telegram_chat_id"])
-        for a in authors:
-            if a.get("telegram_chat_id"):
-                all_chat_ids.add(a["telegram_chat_id"])
-        
-        logger.info(f"Sending live start notifications to {len(all_chat_ids)} users")
-        
-        for chat_id in all_chat_ids:
-            try:
-                await telegram_service.send_live_started_notification(
-                    bot_token=bot_token,
-                    chat_id=str(chat_id),
-                    session_data={
-                        "id": session.get("id"),
-                        "title": session.get("title"),
-                        "description": session.get("description")
-                    }
-                )
-            except Exception as e:
-                logger.error(f"Failed to send notification to {chat_id}: {e}")
+        message = telegram_service.format_live_started_message({
+            "id": session.get("id"),
+            "title": session.get("title"),
+            "description": session.get("description")
+        })
+        # Recipients are resolved by the outbox worker, not on the request path
+        await notification_outbox.enqueue(
+            "telegram_broadcast",
+            {
+                "bot_token": bot_token,
+                "text": message,
+                "name": "live_start",
+                "audience": "telegram_connected"
+            },
+            idempotency_key=f"live_start:{session.get('id')}"
+        )
                 
     except Exception as e:
         logger.error(f"Error sending live start notifications: {e}")
@@ -752,9 +834,11 @@ async def end_live_session(session_id: str, request: Request):
     if started_at:
         duration_minutes = int((ended_at - started_at).total_seconds() / 60)
     
-    # Get room stats before closing
+    # Get room stats before closing; the timeline knows the peak,
+    # the room only knows who is still connected
     room = room_manager.get_room(session_id)
-    participants_count = len(room.get("participants", {}))
+    timeline = await room_manager.timeline.finish(session_id)
+    participants_count = max(len(room.get("participants", {})), timeline["peak_participants"])
     
     await db.live_sessions.update_one(
         {"id": session_id},
@@ -764,59 +848,45 @@ async def end_live_session(session_id: str, request: Request):
                 "ended_at": ended_at,
                 "updated_at": ended_at,
                 "duration_minutes": duration_minutes,
-                "participants_count": participants_count
+                "participants_count": participants_count,
+                "peak_participants": timeline["peak_participants"],
+                "peak_at": timeline["peak_at"]
             }
         }
     )
+    live_session_registry.invalidate(session_id)
+    room_manager.discard_snapshot(session_id)
+    hand_raise_queue.drop(session_id)
     
     # Send Telegram notifications
-    asyncio.create_task(send_live_end_notifications(session, duration_minutes, participants_count))
+    await send_live_end_notifications(session, duration_minutes, participants_count)
     
     return {"success": True, "status": "ended", "session_id": session_id}
 
 
 async def send_live_end_notifications(session: dict, duration_minutes: int, participants_count: int):
-    """Send Telegram notifications when live session ends"""
+    """Queue Telegram notifications when live session ends"""
     try:
         from services.telegram_service import telegram_service
         
         bot_token = os.environ.get("TELEGRAM_BOT_TOKEN", "8293451127:AAEVo5vQV_vJqoziVTDKHYJiOYUZQN-2M2E")
         
-        # Find all users with Telegram connected
-        users = await db.users.find(
-            {"telegram_connected": True, "telegram_chat_id": {"$exists": True, "$ne": None}},
-            {"telegram_chat_id": 1}
-        ).to_list(1000)
-        
-        authors = await db.authors.find(
-            {"telegram_connected": True, "telegram_chat_id": {"$exists": True, "$ne": None}},
-            {"telegram_chat_id": 1}
-        ).to_list(1000)
-        
-        all_chat_ids = set()
-        for u in users:
-            if u.get("telegram_chat_id"):
-                all_chat_ids.add(u["telegram_chat_id"])
-        for a in authors:
-            if a.get("telegram_chat_id"):
-                all_chat_ids.add(a["telegram_chat_id"])
-        
-        logger.info(f"Sending live end notifications to {len(all_chat_ids)} users")
-        
-        for chat_id in all_chat_ids:
-            try:
-                await telegram_service.send_live_ended_notification(
-                    bot_token=bot_token,
-                    chat_id=str(chat_id),
-                    session_data={
-                        "id": session.get("id"),
-                        "title": session.get("title"),
-                        "duration_minutes": duration_minutes,
-                        "participants_count": participants_count
-                    }
-                )
-            except Exception as e:
-                logger.error(f"Failed to send end notification to {chat_id}: {e}")
+        message = telegram_service.format_live_ended_message({
+            "id": session.get("id"),
+            "title": session.get("title"),
+            "duration_minutes": duration_minutes,
+            "participants_count": participants_count
+        })
+        await notification_outbox.enqueue(
+            "telegram_broadcast",
+            {
+                "bot_token": bot_token,
+                "text": message,
+                "name": "live_end",
+                "audience": "telegram_connected"
+            },
+            idempotency_key=f"live_end:{session.get('id')}"
+        )
                 
     except Exception as e:
         logger.error(f"Error sending live end notifications: {e}")
@@ -847,6 +917,9 @@ async def delete_live_session(session_id: str, request: Request):
         raise HTTPException(status_code=400, detail="Cannot delete live session")
     
     await db.live_sessions.delete_one({"id": session_id})
+    live_session_registry.invalidate(session_id)
+    room_manager.discard_snapshot(session_id)
+    await scheduler.cancel([reminder_job_id(session_id, m) for m in REMINDER_MINUTES])
     
     return {"success": True, "message": "Session deleted"}
 
@@ -882,6 +955,7 @@ async def save_recording(session_id: str, recording_url: str, request: Request):
             }
         }
     )
+    live_session_registry.invalidate(session_id)
     
     return {"success": True, "status": "recorded"}
 
@@ -956,6 +1030,8 @@ async def live_room_websocket(websocket: WebSocket, session_id: str):
     - user_id: User identifier
     - username: Display name
     - role: 'speaker' or 'listener'
+    - encoding: 'msgpack' for binary frames (or offer subprotocol
+      'fomo.msgpack.v1'); see GET /api/live-sessions/protocol
     
     Message types (client -> server):
     - chat: {type: "chat", message: "text"}
@@ -963,37 +1039,40 @@ async def live_room_websocket(websocket: WebSocket, session_id: str):
     - hand_raise: {type: "hand_raise", action: "raise"|"lower"}
     - promote: {type: "promote", target_user_id: "..."}  (host only)
     - demote: {type: "demote", target_user_id: "..."}  (host only)
+    - ping / pong: heartbeat (any frame counts as activity)
     """
     # Parse query params
     user_id = websocket.query_params.get("user_id", f"anon_{uuid.uuid4().hex[:8]}")
     username = websocket.query_params.get("username", "Anonymous")
     role = websocket.query_params.get("role", "listener")
     
-    # Verify session exists
-    session = await db.live_sessions.find_one({"id": session_id})
-    if not session or session.get("status") not in ["scheduled", "live", "active"]:
+    # Verify session exists (served from memory; no query per connect)
+    if not await live_session_registry.is_joinable(session_id):
         await websocket.close(code=4004)
         return
     
-    await room_manager.connect(websocket, session_id, user_id, username, role)
+    conn = await room_manager.connect(websocket, session_id, user_id, username, role)
     
     # Award XP for joining
-    await award_session_xp(user_id, "session_joined", {"session_id": session_id})
+    award_session_xp(user_id, "session_joined", {"session_id": session_id})
     
     # Track activity for XP limits per session
+    # (time-in-room XP is awarded by room_manager.presence)
     session_activity = {
         "chat_count": 0,
-        "reaction_count": 0,
-        "join_time": datetime.now(timezone.utc),
-        "last_xp_time": datetime.now(timezone.utc)
+        "reaction_count": 0
     }
     
     try:
         while True:
-            data = await websocket.receive_text()
+            message = await conn.receive()
+            room_manager.presence.touch(session_id, user_id)
+            if message is None:
+                continue
             try:
-                message = json.loads(data)
                 msg_type = message.get("type")
+                if not await live_rate_limiter.admit(user_id, msg_type, conn):
+                    continue
                 
                 if msg_type == "chat":
                     await room_manager.handle_chat(
@@ -1002,7 +1081,7 @@ async def live_room_websocket(websocket: WebSocket, session_id: str):
                     )
                     # Award XP for chat (max 20 per session)
                     if session_activity["chat_count"] < 20:
-                        await award_session_xp(user_id, "chat_message", {"session_id": session_id})
+                        award_session_xp(user_id, "chat_message", {"session_id": session_id})
                         session_activity["chat_count"] += 1
                 
                 elif msg_type == "reaction":
@@ -1012,7 +1091,7 @@ async def live_room_websocket(websocket: WebSocket, session_id: str):
                     )
                     # Award XP for reaction (max 10 per session)
                     if session_activity["reaction_count"] < 10:
-                        await award_session_xp(user_id, "reaction_sent", {"session_id": session_id})
+                        award_session_xp(user_id, "reaction_sent", {"session_id": session_id})
                         session_activity["reaction_count"] += 1
                 
                 elif msg_type == "hand_raise":
@@ -1020,14 +1099,14 @@ async def live_room_websocket(websocket: WebSocket, session_id: str):
                     await room_manager.handle_hand_raise(session_id, user_id, action)
                     # Award XP for raising hand
                     if action == "raise":
-                        await award_session_xp(user_id, "hand_raised", {"session_id": session_id})
+                        award_session_xp(user_id, "hand_raised", {"session_id": session_id})
                 
                 elif msg_type == "promote" and role == "speaker":
                     target = message.get("target_user_id")
                     if target:
                         await room_manager.promote_to_speaker(session_id, target)
                         # Award XP to promoted user
-                        await award_session_xp(target, "promoted_speaker", {"session_id": session_id, "promoted_by": user_id})
+                        award_session_xp(target, "promoted_speaker", {"session_id": session_id, "promoted_by": user_id})
                 
                 elif msg_type == "demote" and role == "speaker":
                     target = message.get("target_user_id")
@@ -1036,22 +1115,34 @@ async def live_room_websocket(websocket: WebSocket, session_id: str):
                 
                 elif msg_type == "ping":
                     await room_manager.send_to_user(session_id, user_id, {"type": "pong"})
-                    # Award time-based XP every 5 minutes
-                    now = datetime.now(timezone.utc)
-                    time_diff = (now - session_activity["last_xp_time"]).total_seconds()
-                    if time_diff >= 300:  # 5 minutes
-                        await award_session_xp(user_id, "session_5min", {"session_id": session_id})
-                        session_activity["last_xp_time"] = now
-                    
                     
-            except json.JSONDecodeError:
+            except (AttributeError, TypeError):
+                # Malformed payload fields
                 pass
                 
     except WebSocketDisconnect:
-        await room_manager.disconnect(session_id, user_id)
+        await room_manager.disconnect(session_id, user_id, conn)
     except Exception as e:
         print(f"WebSocket error: {e}")
-        await room_manager.disconnect(session_id, user_id)
+        await room_manager.disconnect(session_id, user_id, conn)
+
+
+@router.get("/protocol")
+async def get_live_protocol():
+    """Wire protocol description (tag tables for binary clients)"""
+    return live_protocol.describe()
+
+
+@router.get("/rate-limits")
+async def get_live_rate_limits():
+    """Inbound frame limits and throttle counters for live-room sockets"""
+    return {
+        "limits": {
+            msg_type: spec._asdict()
+            for msg_type, spec in live_rate_limiter.limits.items()
+        },
+        **live_rate_limiter.get_stats()
+    }
 
 
 # ===========================================
@@ -1118,15 +1209,61 @@ async def get_livekit_token(request: LiveKitTokenRequest):
     }
 
 
+@router.get("/sessions/{session_id}/chat")
+async def get_session_chat(session_id: str, since: Optional[str] = None, limit: int = 50):
+    """
+    Replay live chat for a session (late joiners and post-live archive)
+    
+    Query params:
+    - since: `next_since` of the previous page (or an ISO timestamp;
+      only messages after it)
+    - limit: Page size (max 200)
+    """
+    room = room_manager.rooms.get(session_id)
+    try:
+        page = await chat_log.replay(
+            session_id,
+            since=since,
+            limit=limit,
+            recent=room["chat_messages"] if room else None
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    
+    return {"session_id": session_id, **page}
+
+
+@router.get("/sessions/{session_id}/timeline")
+async def get_session_timeline(session_id: str):
+    """
+    Concurrency and activity over the course of a session
+    
+    Points every few seconds: listeners, speakers, chat_per_min,
+    reactions_per_min. Includes the in-progress part while live.
+    """
+    session = await live_session_registry.get(session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    
+    timeline = await room_manager.timeline.timeline(session_id)
+    return {
+        "session_id": session_id,
+        "interval_seconds": SAMPLE_INTERVAL,
+        "recording": room_manager.timeline.is_recording(session_id),
+        **timeline
+    }
+
+
 @router.get("/room/{session_id}/state")
 async def get_room_state(session_id: str):
     """Get current state of live room"""
-    room = room_manager.get_room(session_id)
+    room = await room_manager.load_room(session_id)
     return {
         "session_id": session_id,
         "participants": list(room["participants"].values()),
         "speakers": room["speakers"],
         "listeners": room["listeners"],
         "hand_raised": room["hand_raised"],
+        "counters": room["counters"],
         "stats": room_manager.get_stats(session_id)
     }
@@ -1,16 +1,26 @@
 """
 Messages Routes - Direct messaging functionality
 """
-from fastapi import APIRouter, HTTPException, UploadFile, File, Form
+from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Request, Response
+from fastapi.responses import StreamingResponse
 from typing import Optional
 from datetime import datetime, timezone
+from urllib.parse import quote
 import uuid
-import base64
 
 from models import Message, Notification
+from services.attachment_store import (
+    INLINE_CONTENT_TYPES, MAX_ATTACHMENT_SIZE, THUMBNAIL_JOB, AttachmentTooLarge, attachment_store, parse_range
+)
+from services.notification_outbox import notification_outbox
+from services.unread_counters import unread_counters
+from services.user_channel import user_channel
+from services.conversation_summaries import conversation_key, conversation_summaries
 
 router = APIRouter(prefix="/messages", tags=["messages"])
 
+notification_outbox.register(THUMBNAIL_JOB, attachment_store.run_thumbnail_job)
+
 
 async def get_db():
     """Get database instance"""
@@ -18,26 +28,184 @@ async def get_db():
     return db
 
 
+@router.get("/attachments/stats")
+async def get_attachment_stats():
+    """Attachment storage, deduplication and thumbnail counters"""
+    return attachment_store.get_stats()
+
+
+@router.get("/attachments/{attachment_id}")
+async def download_attachment(attachment_id: str, request: Request):
+    """Download a message attachment (supports Range requests)"""
+    attachment = await attachment_store.get(attachment_id)
+    if not attachment:
+        raise HTTPException(status_code=404, detail="Attachment not found")
+    
+    return _serve_file(
+        request,
+        attachment["file_id"],
+        attachment["size"],
+        attachment["content_type"],
+        attachment["sha256"],
+        attachment.get("filename")
+    )
+
+
+@router.get("/attachments/{attachment_id}/thumbnail")
+async def download_attachment_thumbnail(attachment_id: str, request: Request):
+    """Image thumbnail (the original until the thumbnail is rendered)"""
+    attachment = await attachment_store.get(attachment_id)
+    if not attachment:
+        raise HTTPException(status_code=404, detail="Attachment not found")
+    
+    if not attachment.get("thumbnail_file_id"):
+        return _serve_file(
+            request, attachment["file_id"], attachment["size"],
+            attachment["content_type"], attachment["sha256"], cache=False
+        )
+    return _serve_file(
+        request,
+        attachment["thumbnail_file_id"],
+        attachment["thumbnail_size"],
+        "image/jpeg",
+        f"{attachment['sha256']}-thumbnail"
+    )
+
+
+def _serve_file(
+    request: Request,
+    file_id: str,
+    size: int,
+    content_type: str,
+    etag: str,
+    filename: Optional[str] = None,
+    cache: bool = True
+) -> Response:
+    """
+    Stream a GridFS file, or the requested byte range of it
+    
+    The content type comes from the uploader: only INLINE_CONTENT_TYPES
+    are rendered, anything else (HTML, SVG, ...) is a download, so an
+    attachment can't run script on the API origin
+    """
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": f'"{etag}"',
+        # Content-addressed: the bytes behind an id never change
+        "Cache-Control": "private, max-age=31536000, immutable" if cache else "private, no-cache",
+        "X-Content-Type-Options": "nosniff"
+    }
+    disposition = "inline"
+    if content_type.split(";")[0].strip().lower() not in INLINE_CONTENT_TYPES:
+        content_type = "application/octet-stream"
+        disposition = "attachment"
+    headers["Content-Disposition"] = f"{disposition}; filename*=UTF-8''{quote(filename)}" if filename else disposition
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    
+    try:
+        byte_range = parse_range(request.headers.get("range"), size)
+    except ValueError:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+    
+    if byte_range is None:
+        start, end, status_code = 0, size - 1, 200
+    else:
+        start, end = byte_range
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    
+    return StreamingResponse(
+        attachment_store.stream(file_id, start, end),
+        status_code=status_code,
+        media_type=content_type,
+        headers=headers
+    )
+
+
+# Page size bounds for message history
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def _message_cursor(message: dict) -> str:
+    """Opaque keyset position of a message: (created_at, id)"""
+    return f"{message.get('created_at')}|{message.get('id')}"
+
+
+def _parse_cursor(cursor: str) -> tuple:
+    created_at, sep, message_id = cursor.rpartition("|")
+    if not sep or not created_at:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return created_at, message_id
+
+
 @router.get("/{user1_id}/{user2_id}")
-async def get_messages(user1_id: str, user2_id: str):
-    """Get messages between two users"""
+async def get_messages(
+    user1_id: str,
+    user2_id: str,
+    limit: int = DEFAULT_PAGE_SIZE,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    since: Optional[str] = None
+):
+    """
+    Get messages between two users, oldest first
+    
+    - no cursor: the latest `limit` messages
+    - before / after: the page before / after a message's `cursor`
+    - since: ISO timestamp; messages sent or read after it (reconnect sync)
+    
+    Each message carries its `cursor`; a page shorter than `limit` is the last one.
+    """
     db = await get_db()
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    conversation_id, _ = conversation_key(user1_id, user2_id)
+    query = {"conversation_id": conversation_id}
     
-    messages = await db.messages.find({
-        "$or": [
-            {"sender_id": user1_id, "recipient_id": user2_id},
-            {"sender_id": user2_id, "recipient_id": user1_id}
+    if before:
+        created_at, message_id = _parse_cursor(before)
+        query["$or"] = [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "id": {"$lt": message_id}}
+        ]
+        direction = -1
+    elif after:
+        created_at, message_id = _parse_cursor(after)
+        query["$or"] = [
+            {"created_at": {"$gt": created_at}},
+            {"created_at": created_at, "id": {"$gt": message_id}}
+        ]
+        direction = 1
+    elif since:
+        query["$or"] = [
+            {"created_at": {"$gt": since}},
+            {"read_at": {"$gt": since}}
         ]
-    }, {"_id": 0}).sort("created_at", 1).to_list(1000)
+        direction = 1
+    else:
+        direction = -1
     
-    # Mark messages as read
-    await db.messages.update_many(
-        {"sender_id": user2_id, "recipient_id": user1_id, "is_read": False},
-        {"$set": {"is_read": True}}
-    )
+    messages = await db.messages.find(query, {"_id": 0}) \
+        .sort([("created_at", direction), ("id", direction)]) \
+        .limit(limit) \
+        .to_list(limit)
+    if direction == -1:
+        messages.reverse()
+    
+    # Mark messages as read (indexed update; not when paging back through history)
+    if not before:
+        result = await db.messages.update_many(
+            {"sender_id": user2_id, "recipient_id": user1_id, "is_read": False},
+            {"$set": {"is_read": True, "read_at": datetime.now(timezone.utc).isoformat()}}
+        )
+        await conversation_summaries.read(user1_id, user2_id, result.modified_count)
+        await unread_counters.messages_read(user1_id, user2_id, result.modified_count)
     
-    # Format time for display
+    # Format time for display (returned page only)
     for msg in messages:
+        msg['cursor'] = _message_cursor(msg)
         if isinstance(msg.get('created_at'), str):
             try:
                 dt = datetime.fromisoformat(msg['created_at'].replace('Z', '+00:00'))
@@ -59,8 +227,10 @@ async def send_message(message: Message):
     
     if not msg_dict.get('id'):
         msg_dict['id'] = str(uuid.uuid4())
+    msg_dict['conversation_id'] = conversation_key(message.sender_id, message.recipient_id)[0]
     
     await db.messages.insert_one(msg_dict)
+    await conversation_summaries.message_sent(msg_dict)
     
     # Create notification for recipient
     notification = Notification(
@@ -73,6 +243,10 @@ async def send_message(message: Message):
     notif_dict = notification.model_dump()
     notif_dict['created_at'] = datetime.now(timezone.utc).isoformat()
     await db.notifications.insert_one(notif_dict)
+    await unread_counters.message_added(message.recipient_id, message.sender_id)
+    await unread_counters.notification_added(message.recipient_id)
+    user_channel.message(msg_dict)
+    user_channel.notification(notif_dict)
     
     return {"message": "Message sent", "id": msg_dict['id']}
 
@@ -87,44 +261,35 @@ async def send_message_with_file(
     """Send a message with optional file attachment"""
     db = await get_db()
     
-    attachment_url = None
-    attachment_type = None
-    attachment_name = None
+    attachment = {}
     
-    if file:
-        # Read file content
-        file_content = await file.read()
-        
-        # Determine file type
-        content_type = file.content_type or ""
-        if content_type.startswith("image/"):
-            attachment_type = "image"
-        elif content_type.startswith("audio/"):
-            attachment_type = "audio"
-        else:
-            attachment_type = "file"
-        
-        # Convert to base64 for storage (for small files)
-        # In production, you'd upload to S3/GCS
-        if len(file_content) <= 5 * 1024 * 1024:  # 5MB limit
-            attachment_url = f"data:{content_type};base64,{base64.b64encode(file_content).decode()}"
-            attachment_name = file.filename
-        else:
-            raise HTTPException(status_code=400, detail="File too large. Maximum size is 5MB.")
+    if file and file.filename:
+        # Streamed into GridFS; the message only keeps a reference
+        try:
+            stored = await attachment_store.save(file, sender_id)
+        except AttachmentTooLarge:
+            raise HTTPException(
+                status_code=400,
+                detail=f"File too large. Maximum size is {MAX_ATTACHMENT_SIZE // (1024 * 1024)}MB."
+            )
+        attachment = attachment_store.reference(stored, file.filename)
     
     msg_dict = {
         "id": str(uuid.uuid4()),
         "sender_id": sender_id,
         "recipient_id": recipient_id,
+        "conversation_id": conversation_key(sender_id, recipient_id)[0],
         "content": content,
-        "attachment_url": attachment_url,
-        "attachment_type": attachment_type,
-        "attachment_name": attachment_name,
+        "attachment_url": None,
+        "attachment_type": None,
+        "attachment_name": None,
+        **attachment,
         "is_read": False,
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     
     await db.messages.insert_one(msg_dict)
+    await conversation_summaries.message_sent(msg_dict)
     
     # Create notification for recipient
     notif_dict = {
@@ -132,18 +297,25 @@ async def send_message_with_file(
         "user_id": recipient_id,
         "type": "message",
         "title": "New Message",
-        "message": "You have a new message" + (" with attachment" if attachment_url else ""),
+        "message": "You have a new message" + (" with attachment" if attachment else ""),
         "link": "/social?tab=messages",
         "is_read": False,
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     await db.notifications.insert_one(notif_dict)
+    await unread_counters.message_added(recipient_id, sender_id)
+    await unread_counters.notification_added(recipient_id)
+    user_channel.message(msg_dict)
+    user_channel.notification(notif_dict)
     
     return {
         "message": "Message sent",
         "id": msg_dict['id'],
-        "attachment_type": attachment_type,
-        "attachment_name": attachment_name
+        "attachment_id": msg_dict.get("attachment_id"),
+        "attachment_url": msg_dict["attachment_url"],
+        "thumbnail_url": msg_dict.get("thumbnail_url"),
+        "attachment_type": msg_dict["attachment_type"],
+        "attachment_name": msg_dict["attachment_name"]
     }
 
 
@@ -158,6 +330,9 @@ async def delete_conversation(user1_id: str, user2_id: str):
             {"sender_id": user2_id, "recipient_id": user1_id}
         ]
     })
+    await conversation_summaries.deleted(user1_id, user2_id)
+    await unread_counters.conversation_cleared(user1_id, user2_id)
+    await unread_counters.conversation_cleared(user2_id, user1_id)
     
     return {"message": "Conversation deleted", "deleted_count": result.deleted_count}
 
@@ -169,91 +344,70 @@ users_router = APIRouter(prefix="/users", tags=["users"])
 
 
 @users_router.get("/{user_id}/conversations")
-async def get_conversations(user_id: str):
-    """Get all conversations for user"""
+async def get_conversations(user_id: str, limit: int = 100, before: Optional[str] = None):
+    """Get conversations for user, most recent first (pass the last `last_at` as `before` for the next page)"""
     db = await get_db()
     
-    # Get all messages involving this user
-    pipeline = [
-        {
-            "$match": {
-                "$or": [
-                    {"sender_id": user_id},
-                    {"recipient_id": user_id}
-                ]
-            }
-        },
-        {
-            "$sort": {"created_at": -1}
-        },
-        {
-            "$group": {
-                "_id": {
-                    "$cond": [
-                        {"$eq": ["$sender_id", user_id]},
-                        "$recipient_id",
-                        "$sender_id"
-                    ]
-                },
-                "last_message": {"$first": "$content"},
-                "last_time": {"$first": "$created_at"},
-                "unread_count": {
-                    "$sum": {
-                        "$cond": [
-                            {"$and": [
-                                {"$eq": ["$recipient_id", user_id]},
-                                {"$eq": ["$is_read", False]}
-                            ]},
-                            1,
-                            0
-                        ]
-                    }
-                }
-            }
-        }
-    ]
-    
-    conversations = await db.messages.aggregate(pipeline).to_list(100)
+    # One indexed query on the per-pair summaries
+    conversations = await conversation_summaries.list_for_user(user_id, min(limit, 100), before)
     
     if not conversations:
         return []
     
     # Get user details for each conversation
-    user_ids = [conv["_id"] for conv in conversations]
+    peer_ids = [
+        next((p for p in conv["participants"] if p != user_id), user_id)
+        for conv in conversations
+    ]
     users = await db.authors.find(
-        {"id": {"$in": user_ids}},
+        {"id": {"$in": peer_ids}},
         {"_id": 0, "id": 1, "name": 1, "username": 1, "avatar": 1}
-    ).to_list(100)
+    ).to_list(len(peer_ids))
     
     users_map = {u["id"]: u for u in users}
     
     # Format conversations
     result = []
-    for conv in conversations:
-        other_user = users_map.get(conv["_id"], {})
+    for conv, peer_id in zip(conversations, peer_ids):
+        other_user = users_map.get(peer_id, {})
+        last_message = conv.get("last_message") or {}
         
         # Format time
         time_str = ""
-        if isinstance(conv.get('last_time'), str):
+        if isinstance(conv.get('last_at'), str):
             try:
-                dt = datetime.fromisoformat(conv['last_time'].replace('Z', '+00:00'))
+                dt = datetime.fromisoformat(conv['last_at'].replace('Z', '+00:00'))
                 time_str = dt.strftime("%H:%M")
             except:
                 pass
         
         result.append({
-            "user_id": conv["_id"],
+            "user_id": peer_id,
             "user_name": other_user.get("name", "Unknown"),
             "username": other_user.get("username", ""),
             "avatar": other_user.get("avatar", ""),
-            "last_message": conv["last_message"],
+            "last_message": last_message.get("preview", ""),
+            "last_sender_id": last_message.get("sender_id"),
+            "attachment_type": last_message.get("attachment_type"),
+            "last_at": conv.get("last_at"),
             "time": time_str,
-            "unread_count": conv["unread_count"]
+            "unread_count": max(0, (conv.get("unread") or {}).get(user_id, 0))
         })
     
     return result
 
 
+@users_router.get("/{user_id}/unread-counts")
+async def get_unread_counts(user_id: str):
+    """Unread notifications, messages and per-conversation counts (badge polling)"""
+    counters = await unread_counters.get(user_id)
+    return {
+        "notifications": counters["notifications"],
+        "messages": counters["messages"],
+        "conversations": counters["conversations"]
+    }
+
+
 @users_router.get("/{user_id}/playlists")
 async def get_user_playlists_alt(user_id: str):
     """Get all playlists for a specific user (alternative route)"""
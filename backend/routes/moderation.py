@@ -4,6 +4,8 @@ Moderation Routes - Content moderation endpoints
 from fastapi import APIRouter, Form, HTTPException
 from typing import Optional
 
+from services.comment_threads import comment_threads
+
 router = APIRouter(prefix="/moderation", tags=["moderation"])
 
 
@@ -152,5 +154,6 @@ async def delete_comment_moderation(comment_id: str):
         {"id": comment["podcast_id"]},
         {"$inc": {"comments_count": -1}}
     )
+    comment_threads.invalidate(comment["podcast_id"])
     
     return {"success": True, "message": "Comment deleted"}
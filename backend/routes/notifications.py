@@ -1,13 +1,23 @@
 """
 Notifications Routes - User notifications management
 """
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect
 from typing import Optional
 from datetime import datetime, timezone
+import logging
 import uuid
 
+from middleware.auth import decode_token
+
+from services import live_protocol
+from services.notification_fanout import notification_fanout
+from services.unread_counters import unread_counters
+from services.user_channel import user_channel
+
 router = APIRouter(prefix="/notifications", tags=["notifications"])
 
+logger = logging.getLogger(__name__)
+
 
 async def get_db():
     """Get database instance"""
@@ -33,20 +43,90 @@ async def get_user_notifications(
         .limit(limit) \
         .to_list(limit)
     
-    return notifications
+    # Announcements keep their text in one shared body
+    return await notification_fanout.hydrate(notifications)
+
+
+async def _authenticate_channel(websocket: WebSocket) -> Optional[str]:
+    """
+    User id a channel socket may subscribe to, or None
+
+    Browsers can't set headers on WebSocket requests, so credentials come
+    as query params: `token` (JWT whose sub is the user id, or whose
+    wallet_address owns it) or `wallet` (same check as X-Wallet-Address)
+    """
+    user_id = websocket.query_params.get("user_id")
+    wallet = websocket.query_params.get("wallet")
+    token = websocket.query_params.get("token")
+    if token:
+        payload = decode_token(token)
+        if not payload:
+            return None
+        if payload.get("sub"):
+            return payload["sub"] if user_id in (None, payload["sub"]) else None
+        wallet = payload.get("wallet_address")
+    if not user_id or not wallet:
+        return None
+    
+    db = await get_db()
+    author = await db.authors.find_one({"id": user_id}, {"_id": 0, "wallet_address": 1})
+    if author and (author.get("wallet_address") or "").lower() == wallet.lower():
+        return user_id
+    return None
+
+
+@router.websocket("/ws")
+async def notifications_websocket(websocket: WebSocket):
+    """
+    Real-time channel for one user (all tabs of a user may connect)
+    
+    Query params: user_id plus token or wallet (see _authenticate_channel);
+    encoding / subprotocols as for live rooms (GET /api/live-sessions/protocol)
+    
+    Server -> client:
+    - counters: {type, notifications, messages, conversations} on connect
+      and whenever an unread count changes
+    - notification: {type, notification} (fan-out announcements carry no id)
+    - message: {type, message} new direct message
+    - pong
+    
+    Client -> server: ping
+    """
+    # Accept first: a close before accept is a bare 403 and the client
+    # never sees the 4401 close code
+    conn = await live_protocol.accept(websocket)
+    user_id = await _authenticate_channel(websocket)
+    if user_id is None:
+        await conn.close(code=4401)
+        return
+    
+    await user_channel.connect(conn, user_id)
+    try:
+        while True:
+            message = await conn.receive()
+            if message and message.get("type") == "ping":
+                await conn.send_json({"type": "pong"})
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logger.warning(f"Notification channel error ({user_id}): {e}")
+    finally:
+        user_channel.disconnect(user_id, conn)
+
+
+@router.get("/channel/stats")
+async def get_channel_stats():
+    """Open user channels and delivery counters on this worker"""
+    return user_channel.get_stats()
 
 
 @router.get("/{user_id}/count")
 async def get_unread_count(user_id: str):
     """Get count of unread notifications"""
-    db = await get_db()
-    
-    count = await db.notifications.count_documents({
-        "user_id": user_id,
-        "is_read": False
-    })
+    # Materialized counter, usually served from memory
+    counters = await unread_counters.get(user_id)
     
-    return {"unread_count": count}
+    return {"unread_count": counters["notifications"]}
 
 
 @router.put("/{notification_id}/read")
@@ -54,13 +134,18 @@ async def mark_notification_read(notification_id: str):
     """Mark a notification as read"""
     db = await get_db()
     
-    result = await db.notifications.update_one(
-        {"id": notification_id},
-        {"$set": {"is_read": True}}
+    notification = await db.notifications.find_one_and_update(
+        {"id": notification_id, "is_read": False},
+        {"$set": {"is_read": True}},
+        projection={"_id": 0, "user_id": 1}
     )
     
-    if result.matched_count == 0:
-        raise HTTPException(status_code=404, detail="Notification not found")
+    if notification is None:
+        # Already read, or no such notification
+        if not await db.notifications.find_one({"id": notification_id}, {"_id": 1}):
+            raise HTTPException(status_code=404, detail="Notification not found")
+    else:
+        await unread_counters.notifications_read(notification["user_id"])
     
     return {"success": True}
 
@@ -74,6 +159,7 @@ async def mark_all_read(user_id: str):
         {"user_id": user_id, "is_read": False},
         {"$set": {"is_read": True}}
     )
+    await unread_counters.notifications_cleared(user_id)
     
     return {"success": True, "updated_count": result.modified_count}
 
@@ -83,10 +169,15 @@ async def delete_notification(notification_id: str):
     """Delete a notification"""
     db = await get_db()
     
-    result = await db.notifications.delete_one({"id": notification_id})
+    notification = await db.notifications.find_one_and_delete(
+        {"id": notification_id},
+        projection={"_id": 0, "user_id": 1, "is_read": 1}
+    )
     
-    if result.deleted_count == 0:
+    if notification is None:
         raise HTTPException(status_code=404, detail="Notification not found")
+    if not notification.get("is_read"):
+        await unread_counters.notifications_read(notification["user_id"])
     
     return {"success": True}
 
@@ -113,4 +204,6 @@ async def create_notification(
     }
     
     await db.notifications.insert_one(notification)
+    await unread_counters.notification_added(user_id)
+    user_channel.notification(notification)
     return notification
@@ -43,19 +43,23 @@ async def create_podcast(podcast: PodcastCreate):
         {"$inc": {"podcasts_count": 1}}
     )
     
-    # Trigger webhook
+    # Trigger webhook (delivered by the notification outbox)
     try:
-        from webhook_service import webhook_service
-        if webhook_service:
-            await webhook_service.trigger_webhooks('podcast.created', {
-                'podcast_id': podcast_obj.id,
-                'title': podcast_obj.title,
-                'author_id': podcast_obj.author_id,
-                'description': podcast_obj.description,
-                'tags': podcast_obj.tags
-            })
+        from services.notification_outbox import notification_outbox
+        from services.webhook_subscriptions import webhook_subscriptions
+        if webhook_subscriptions.has_subscribers('podcast.created'):
+            await notification_outbox.enqueue("webhook", {
+                'event': 'podcast.created',
+                'data': {
+                    'podcast_id': podcast_obj.id,
+                    'title': podcast_obj.title,
+                    'author_id': podcast_obj.author_id,
+                    'description': podcast_obj.description,
+                    'tags': podcast_obj.tags
+                }
+            }, idempotency_key=f"webhook:podcast.created:{podcast_obj.id}")
     except Exception:
-        # Webhook service not available, continue
+        # Webhook delivery is best-effort, continue
         pass
     
     return podcast_obj
@@ -194,13 +198,18 @@ async def delete_podcast(podcast_id: str):
         {"$inc": {"podcasts_count": -1}}
     )
     
-    # Trigger webhook
-    from webhook_service import webhook_service
-    await webhook_service.trigger_webhooks('podcast.deleted', {
-        'podcast_id': podcast_id,
-        'title': podcast.get('title'),
-        'author_id': podcast.get('author_id')
-    })
+    # Trigger webhook (delivered by the notification outbox)
+    from services.notification_outbox import notification_outbox
+    from services.webhook_subscriptions import webhook_subscriptions
+    if webhook_subscriptions.has_subscribers('podcast.deleted'):
+        await notification_outbox.enqueue("webhook", {
+            'event': 'podcast.deleted',
+            'data': {
+                'podcast_id': podcast_id,
+                'title': podcast.get('title'),
+                'author_id': podcast.get('author_id')
+            }
+        }, idempotency_key=f"webhook:podcast.deleted:{podcast_id}")
     
     return {"message": "Podcast deleted"}
 
@@ -363,13 +372,19 @@ async def add_reaction(
             }
         )
         
-        # Trigger webhook
-        from webhook_service import webhook_service
-        await webhook_service.trigger_webhooks('reaction.added', {
-            'podcast_id': podcast_id,
-            'user_id': user_id,
-            'emoji': emoji
-        })
+        # Trigger webhook (delivered by the notification outbox)
+        # Most reactions have no listeners: skip the outbox write entirely
+        from services.notification_outbox import notification_outbox
+        from services.webhook_subscriptions import webhook_subscriptions
+        if webhook_subscriptions.has_subscribers('reaction.added'):
+            await notification_outbox.enqueue("webhook", {
+                'event': 'reaction.added',
+                'data': {
+                    'podcast_id': podcast_id,
+                    'user_id': user_id,
+                    'emoji': emoji
+                }
+            })
         
         return {"message": "Reaction added", "liked": True}
 
@@ -6,11 +6,21 @@ from fastapi import APIRouter, HTTPException, status
 from typing import Optional, List
 from datetime import datetime, timezone
 from uuid import uuid4
-import json
 import os
 
+from services.notification_outbox import notification_outbox
+from services.notification_fanout import notification_fanout
+from services.web_push import web_push
+from services.unread_counters import unread_counters
+from services.user_channel import user_channel
+
 router = APIRouter(prefix="/push", tags=["push-notifications"])
 
+# Follower announcements and push messages run as outbox jobs
+notification_outbox.register("in_app_fanout", notification_fanout.run_outbox_job)
+notification_outbox.register("web_push_batch", web_push.deliver_batch)
+notification_outbox.register("web_push", web_push.deliver_one)
+
 
 async def get_db():
     """Get database instance"""
@@ -29,6 +39,7 @@ VAPID_PRIVATE_KEY = os.environ.get(
     "VAPID_PRIVATE_KEY",
     "UUxI4O8-FbRouADVXc-hK3ltm228GJShRKJpeXtNYkg"
 )
+web_push.set_vapid_keys(VAPID_PUBLIC_KEY, VAPID_PRIVATE_KEY)
 
 
 # ========== Subscription Management ==========
@@ -199,7 +210,7 @@ async def send_push_notification(data: dict):
         return {"message": "No active subscriptions found", "sent": 0}
     
     # Build notification payload
-    payload = json.dumps({
+    message = {
         "title": title,
         "body": body,
         "icon": icon,
@@ -208,7 +219,7 @@ async def send_push_notification(data: dict):
             "type": notification_type,
             "timestamp": datetime.now(timezone.utc).isoformat()
         }
-    })
+    }
     
     # Store notification in database for history
     notification = {
@@ -222,14 +233,15 @@ async def send_push_notification(data: dict):
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     await db.notifications.insert_one(notification)
+    await unread_counters.notification_added(notification["user_id"])
+    user_channel.notification(notification)
     
-    # In production, we would use pywebpush to send actual push notifications
-    # For now, we just store the notification and return success
-    # The frontend will poll notifications endpoint
+    # Encrypted and delivered to each browser by the outbox worker
+    queued = await web_push.enqueue(subscriptions, message, key=f"push:{notification['id']}")
     
     return {
         "message": "Notification queued",
-        "sent": len(subscriptions),
+        "sent": queued,
         "notification_id": notification["id"]
     }
 
@@ -264,96 +276,87 @@ async def broadcast_notification(data: dict):
     if user_ids and user_ids != "all":
         query["user_id"] = {"$in": user_ids}
     
-    # Get all matching subscriptions
-    subscriptions = await db.push_subscriptions.find(
-        query, {"_id": 0, "user_id": 1}
-    ).to_list(length=1000)
+    broadcast_id = str(uuid4())
+    message = {
+        "title": title,
+        "body": body,
+        "icon": data.get("icon", "/logo192.png"),
+        "data": {
+            "url": url,
+            "type": notification_type,
+            "timestamp": datetime.now(timezone.utc).isoformat()
+        }
+    }
     
-    # Get unique user IDs
-    unique_users = list(set(sub["user_id"] for sub in subscriptions))
+    # Stream matching subscriptions into push jobs, collecting their users
+    unique_users = set()
     
-    # Create notifications for all users
-    notifications = []
-    for user_id in unique_users:
-        notifications.append({
-            "id": str(uuid4()),
-            "user_id": user_id,
-            "title": title,
-            "message": body,
-            "type": notification_type,
-            "link": url,
-            "is_read": False,
-            "created_at": datetime.now(timezone.utc).isoformat()
-        })
+    async def subscriptions():
+        async for sub in db.push_subscriptions.find(
+            query, {"_id": 0, "id": 1, "user_id": 1, "subscription": 1}
+        ).batch_size(1000):
+            unique_users.add(sub["user_id"])
+            yield sub
+    
+    pushed = await web_push.enqueue(subscriptions(), message, key=f"push:broadcast:{broadcast_id}")
     
-    if notifications:
-        await db.notifications.insert_many(notifications)
+    # Create notifications for all users
+    await notification_fanout.fan_out(
+        unique_users,
+        {"title": title, "message": body, "type": notification_type, "link": url},
+        key=f"push:broadcast:{broadcast_id}",
+        name="push_broadcast"
+    )
     
     return {
         "message": "Broadcast sent",
-        "recipients": len(unique_users)
+        "recipients": len(unique_users),
+        "pushed": pushed,
+        "broadcast_id": broadcast_id
     }
 
 
+@router.get("/stats")
+async def get_push_stats():
+    """Delivery counters and per push service latency"""
+    return web_push.get_stats()
+
+
+@router.get("/fanouts")
+async def get_fanout_stats():
+    """Progress of recent follower notification fan-outs"""
+    return notification_fanout.get_stats()
+
+
 # ========== Event Triggers ==========
 
 async def notify_new_podcast(podcast: dict, author: dict):
     """Notify followers about new podcast"""
-    db = await get_db()
-    
-    # Get author's followers
-    followers = await db.author_followers.find(
-        {"author_id": author.get("id")},
-        {"_id": 0, "follower_id": 1}
-    ).to_list(length=10000)
-    
-    follower_ids = [f["follower_id"] for f in followers]
-    
-    if not follower_ids:
-        return
-    
-    # Create notifications
-    for user_id in follower_ids:
-        notification = {
-            "id": str(uuid4()),
-            "user_id": user_id,
+    # Followers are streamed and written in batches by the outbox worker
+    return await notification_outbox.enqueue("in_app_fanout", {
+        "name": "new_podcast",
+        "author_id": author.get("id"),
+        "notification": {
             "title": f"New podcast from {author.get('name', 'Author')}",
             "message": podcast.get("title", "New episode available"),
             "type": "new_podcast",
-            "link": f"/podcast/{podcast.get('id')}",
-            "is_read": False,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "link": f"/podcast/{podcast.get('id')}"
         }
-        await db.notifications.insert_one(notification)
+    }, idempotency_key=f"in_app:new_podcast:{podcast.get('id')}")
 
 
 async def notify_live_start(podcast: dict, author: dict):
     """Notify followers about live stream starting"""
-    db = await get_db()
-    
-    # Get author's followers
-    followers = await db.author_followers.find(
-        {"author_id": author.get("id")},
-        {"_id": 0, "follower_id": 1}
-    ).to_list(length=10000)
-    
-    follower_ids = [f["follower_id"] for f in followers]
-    
-    if not follower_ids:
-        return
-    
-    for user_id in follower_ids:
-        notification = {
-            "id": str(uuid4()),
-            "user_id": user_id,
+    return await notification_outbox.enqueue("in_app_fanout", {
+        "name": "live_start",
+        "author_id": author.get("id"),
+        "notification": {
             "title": f"{author.get('name', 'Author')} is LIVE!",
             "message": podcast.get("title", "Join the live stream"),
             "type": "live_start",
-            "link": f"/live/{podcast.get('id')}",
-            "is_read": False,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "link": f"/live/{podcast.get('id')}"
         }
-        await db.notifications.insert_one(notification)
+    }, idempotency_key=f"in_app:live_start:{podcast.get('id')}")
 
 
 async def notify_new_comment(podcast: dict, comment: dict, commenter: dict):
@@ -375,6 +378,8 @@ async def notify_new_comment(podcast: dict, comment: dict, commenter: dict):
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     await db.notifications.insert_one(notification)
+    await unread_counters.notification_added(notification["user_id"])
+    user_channel.notification(notification)
 
 
 async def notify_private_club_invite(podcast: dict, invitee_id: str, inviter: dict):
@@ -392,3 +397,5 @@ async def notify_private_club_invite(podcast: dict, invitee_id: str, inviter: di
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     await db.notifications.insert_one(notification)
+    await unread_counters.notification_added(notification["user_id"])
+    user_channel.notification(notification)
@@ -8,6 +8,7 @@ from datetime import datetime, timezone
 from models import Webhook, WebhookCreate, WebhookUpdate
 from rss_generator import generate_author_rss_feed, generate_podcast_rss_feed, get_base_url_from_env
 from webhook_service import WEBHOOK_EVENTS
+from services.webhook_subscriptions import webhook_subscriptions
 
 router = APIRouter(tags=["rss-webhooks"])
 
@@ -103,6 +104,7 @@ async def create_webhook(webhook: WebhookCreate):
         doc['last_triggered_at'] = doc['last_triggered_at'].isoformat()
     
     await db.webhooks.insert_one(doc)
+    webhook_subscriptions.put(doc)
     return webhook_obj
 
 
@@ -174,6 +176,7 @@ async def update_webhook(webhook_id: str, update: WebhookUpdate):
     
     # Return updated webhook
     updated_webhook = await db.webhooks.find_one({"id": webhook_id}, {"_id": 0})
+    webhook_subscriptions.put(updated_webhook)
     
     # Convert datetime strings
     if isinstance(updated_webhook.get('created_at'), str):
@@ -194,6 +197,7 @@ async def delete_webhook(webhook_id: str):
     result = await db.webhooks.delete_one({"id": webhook_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Webhook not found")
+    webhook_subscriptions.remove(webhook_id)
     
     # Also delete webhook logs
     await db.webhook_logs.delete_many({"webhook_id": webhook_id})
@@ -252,3 +256,13 @@ async def list_webhook_events():
             "live.ended": "Triggered when a live broadcast ends"
         }
     }
+
+
+@router.get("/webhooks/delivery/stats")
+async def get_webhook_delivery_stats():
+    """Get delivery queue, circuit breaker and retry stats"""
+    webhook_service = await get_webhook_service()
+    return {
+        **webhook_service.get_stats(),
+        "subscriptions": webhook_subscriptions.get_stats()
+    }
@@ -7,6 +7,7 @@ from typing import List, Optional
 import os
 import logging
 from models import TelegramConnection
+from services.telegram_recipients import telegram_recipients, SOURCE_AUTHORS
 
 logger = logging.getLogger(__name__)
 
@@ -192,6 +193,9 @@ async def connect_personal_telegram(
     
     # Get updated author
     author = await db.authors.find_one({"id": author_id}, {"_id": 0})
+    await telegram_recipients.connect(
+        author_id, SOURCE_AUTHORS, author.get('telegram_chat_id'), author.get('telegram_username')
+    )
     
     return {
         "success": True,
@@ -230,6 +234,8 @@ async def disconnect_personal_telegram(author_id: str = Form(...)):
     if result.modified_count == 0 and result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Author not found")
     
+    await telegram_recipients.disconnect(author_id, SOURCE_AUTHORS)
+    
     return {
         "success": True,
         "message": "Telegram disconnected successfully!"
@@ -415,6 +421,9 @@ async def telegram_auth_callback(
     
     # Get updated author
     author = await db.authors.find_one({"id": author_id}, {"_id": 0})
+    await telegram_recipients.connect(
+        author_id, SOURCE_AUTHORS, author.get('telegram_chat_id'), author.get('telegram_username')
+    )
     
     logger.info(f"✅ Telegram OAuth connected for author {author_id}: @{username or id}")
     
@@ -509,6 +518,9 @@ async def telegram_auth_callback_json(data: dict):
     
     # Get updated author
     author = await db.authors.find_one({"id": author_id}, {"_id": 0})
+    await telegram_recipients.connect(
+        author_id, SOURCE_AUTHORS, author.get('telegram_chat_id'), author.get('telegram_username')
+    )
     
     logger.info(f"✅ Telegram OAuth connected for author {author_id}")
     
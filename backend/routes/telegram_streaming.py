@@ -8,6 +8,8 @@ import uuid
 from datetime import datetime, timezone
 import logging
 
+from services.live_session_registry import live_session_registry
+
 router = APIRouter(prefix="/telegram-streaming", tags=["telegram-streaming"])
 
 logger = logging.getLogger(__name__)
@@ -211,6 +213,7 @@ async def handle_voice_chat_webhook(
         
         await db.live_sessions.insert_one(live_session)
         live_session.pop('_id', None)
+        live_session_registry.put(live_session)
         
         # Update stats
         await db.telegram_channel_streaming.update_one(
@@ -256,6 +259,7 @@ async def handle_voice_chat_webhook(
                         }
                     }
                 )
+                live_session_registry.invalidate(current_session_id)
                 
                 # Get existing author - don't create new one!
                 author = await db.authors.find_one({"id": author_id}, {"_id": 0})
@@ -360,6 +364,7 @@ async def end_live_from_platform(session_id: str, author_id: str = Form(...)):
             }
         }
     )
+    live_session_registry.invalidate(session_id)
     
     # Get author info
     author = await db.authors.find_one({"id": author_id}, {"_id": 0})
@@ -8,12 +8,25 @@ from fastapi import APIRouter, HTTPException, Form
 from typing import Optional, List
 from datetime import datetime, timezone
 import uuid
+import html
 import logging
 
+from services.notification_outbox import notification_outbox
+from services.telegram_broadcast import telegram_broadcaster
+from services.telegram_recipients import (
+    telegram_recipients, SOURCE_SUBSCRIPTIONS, BATCH_SIZE as RECIPIENT_BATCH_SIZE
+)
+
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/telegram-subscriptions", tags=["telegram-subscriptions"])
 
+# Subscription flag -> connection-level preference that can veto it
+NOTIFY_PREFERENCES = {
+    "notify_episodes": "notify_new_episodes",
+    "notify_live": "notify_live_streams"
+}
+
 
 async def get_db():
     """Get database instance"""
@@ -27,6 +40,36 @@ async def get_telegram_service():
     return telegram_service
 
 
+async def resolve_creator_subscribers(creator_id: str, notify_field: str):
+    """
+    Outbox audience: chat ids of a creator's active subscribers with
+    `notify_field` on
+    
+    Subscriptions are streamed and resolved against telegram_recipients
+    in batches (one $in query each), honouring the connection's own
+    notify_new_episodes / notify_live_streams preference.
+    """
+    db = await get_db()
+    preference = NOTIFY_PREFERENCES.get(notify_field)
+    
+    batch = []
+    async for sub in db.creator_subscriptions.find(
+        {"creator_id": creator_id, "is_active": True, notify_field: True},
+        {"_id": 0, "user_id": 1}
+    ).batch_size(RECIPIENT_BATCH_SIZE):
+        batch.append(sub["user_id"])
+        if len(batch) >= RECIPIENT_BATCH_SIZE:
+            for chat_id in await telegram_recipients.chat_ids_for_users(batch, preference=preference):
+                yield chat_id
+            batch = []
+    if batch:
+        for chat_id in await telegram_recipients.chat_ids_for_users(batch, preference=preference):
+            yield chat_id
+
+
+notification_outbox.register_audience("creator_subscribers", resolve_creator_subscribers)
+
+
 # ============ USER TELEGRAM CONNECTION ============
 
 @router.post("/connect")
@@ -57,6 +100,11 @@ async def connect_telegram(
                 "is_active": True
             }}
         )
+        await telegram_recipients.connect(
+            user_id, SOURCE_SUBSCRIPTIONS, telegram_chat_id, telegram_username,
+            notify_new_episodes=existing.get("notify_new_episodes"),
+            notify_live_streams=existing.get("notify_live_streams")
+        )
         return {"success": True, "message": "Telegram connection updated"}
     
     # Create new connection
@@ -74,6 +122,11 @@ async def connect_telegram(
     
     await db.telegram_user_connections.insert_one(connection)
     connection.pop('_id', None)
+    await telegram_recipients.connect(
+        user_id, SOURCE_SUBSCRIPTIONS, telegram_chat_id, telegram_username,
+        notify_new_episodes=True,
+        notify_live_streams=True
+    )
     
     logger.info(f"📱 User {user_id} connected Telegram: {telegram_chat_id}")
     return {"success": True, "message": "Telegram connected successfully", "connection": connection}
@@ -99,9 +152,10 @@ async def get_user_connection(user_id: str):
 async def update_notification_settings(
     user_id: str,
     notify_new_episodes: Optional[bool] = Form(None),
-    notify_live_streams: Optional[bool] = Form(None)
+    notify_live_streams: Optional[bool] = Form(None),
+    muted: Optional[bool] = Form(None)
 ):
-    """Update notification preferences"""
+    """Update notification preferences (muted pauses all Telegram notifications)"""
     db = await get_db()
     
     update_data = {"updated_at": datetime.now(timezone.utc).isoformat()}
@@ -110,6 +164,8 @@ async def update_notification_settings(
         update_data["notify_new_episodes"] = notify_new_episodes
     if notify_live_streams is not None:
         update_data["notify_live_streams"] = notify_live_streams
+    if muted is not None:
+        update_data["muted"] = muted
     
     result = await db.telegram_user_connections.update_one(
         {"user_id": user_id},
@@ -119,6 +175,13 @@ async def update_notification_settings(
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Connection not found")
     
+    await telegram_recipients.update_preferences(
+        user_id, SOURCE_SUBSCRIPTIONS,
+        notify_new_episodes=notify_new_episodes,
+        notify_live_streams=notify_live_streams,
+        muted=muted
+    )
+    
     return {"success": True, "message": "Settings updated"}
 
 
@@ -135,6 +198,8 @@ async def disconnect_telegram(user_id: str):
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Connection not found")
     
+    await telegram_recipients.disconnect(user_id, SOURCE_SUBSCRIPTIONS)
+    
     return {"success": True, "message": "Telegram disconnected"}
 
 
@@ -265,70 +330,48 @@ async def notify_new_episode(
     """
     Send Telegram notifications to all subscribers about new episode
     Called when a creator publishes a new podcast
+    
+    Delivery runs in the notification outbox; poll /broadcasts/{broadcast_id}
+    for progress
     """
     db = await get_db()
-    telegram_service = await get_telegram_service()
     
     # Get creator info
     creator = await db.authors.find_one({"id": creator_id}, {"_id": 0})
     if not creator:
         raise HTTPException(status_code=404, detail="Creator not found")
     
-    # Get all active subscribers who want episode notifications
-    subscriptions = await db.creator_subscriptions.find({
-        "creator_id": creator_id,
-        "is_active": True,
-        "notify_episodes": True
-    }).to_list(1000)
-    
     # Get bot config (use platform default bot)
     bot_config = await db.telegram_bots.find_one({"is_platform_default": True})
     if not bot_config:
         logger.warning("No platform default Telegram bot configured")
         return {"success": False, "message": "No Telegram bot configured"}
     
-    sent_count = 0
-    failed_count = 0
-    
-    for sub in subscriptions:
-        # Get user's Telegram connection
-        connection = await db.telegram_user_connections.find_one({
-            "user_id": sub["user_id"],
-            "is_active": True
-        })
-        
-        if not connection:
-            continue
-        
-        # Build message
-        message = f"""
+    # Build message
+    message = f"""
 🎙️ <b>Новый выпуск!</b>
 
-<b>{podcast_title}</b>
-от {creator.get('name', 'Creator')}
+<b>{html.escape(podcast_title)}</b>
+от {html.escape(creator.get('name') or 'Creator')}
 
 🎧 Слушать сейчас:
 https://fomo.app/podcast/{podcast_id}
 """
-        
-        result = await telegram_service.send_message(
-            bot_config['bot_token'],
-            connection['telegram_chat_id'],
-            message.strip()
-        )
-        
-        if result.get('success'):
-            sent_count += 1
-        else:
-            failed_count += 1
-            logger.error(f"Failed to notify user {sub['user_id']}: {result.get('error')}")
-    
-    logger.info(f"📢 New episode notifications: {sent_count} sent, {failed_count} failed")
-    return {
-        "success": True,
-        "sent_count": sent_count,
-        "failed_count": failed_count
-    }
+    
+    # Sent to all active subscribers who want episode notifications
+    job_id = await notification_outbox.enqueue(
+        "telegram_broadcast",
+        {
+            "bot_token": bot_config['bot_token'],
+            "text": message.strip(),
+            "name": "new_episode",
+            "audience": "creator_subscribers",
+            "audience_args": {"creator_id": creator_id, "notify_field": "notify_episodes"}
+        },
+        idempotency_key=f"new_episode:{podcast_id}"
+    )
+    logger.info(f"📢 New episode notifications queued ({job_id})")
+    return {"success": True, "broadcast_id": job_id, "status": "queued"}
 
 
 @router.post("/notify/live-stream")
@@ -343,69 +386,67 @@ async def notify_live_stream(
     Called when a creator starts a live stream
     """
     db = await get_db()
-    telegram_service = await get_telegram_service()
     
     # Get creator info
     creator = await db.authors.find_one({"id": creator_id}, {"_id": 0})
     if not creator:
         raise HTTPException(status_code=404, detail="Creator not found")
     
-    # Get all active subscribers who want live notifications
-    subscriptions = await db.creator_subscriptions.find({
-        "creator_id": creator_id,
-        "is_active": True,
-        "notify_live": True
-    }).to_list(1000)
-    
     # Get bot config
     bot_config = await db.telegram_bots.find_one({"is_platform_default": True})
     if not bot_config:
         logger.warning("No platform default Telegram bot configured")
         return {"success": False, "message": "No Telegram bot configured"}
     
-    sent_count = 0
-    failed_count = 0
-    
-    for sub in subscriptions:
-        connection = await db.telegram_user_connections.find_one({
-            "user_id": sub["user_id"],
-            "is_active": True
-        })
-        
-        if not connection:
-            continue
-        
-        message = f"""
+    message = f"""
 🔴 <b>LIVE!</b>
 
-<b>{creator.get('name', 'Creator')}</b> начал трансляцию!
+<b>{html.escape(creator.get('name') or 'Creator')}</b> начал трансляцию!
 
-<b>{stream_title}</b>
-{stream_description or ''}
+<b>{html.escape(stream_title)}</b>
+{html.escape(stream_description or '')}
 
 🎬 Присоединиться:
 https://fomo.app/live/{stream_id}
 """
-        
-        result = await telegram_service.send_message(
-            bot_config['bot_token'],
-            connection['telegram_chat_id'],
-            message.strip()
-        )
-        
-        if result.get('success'):
-            sent_count += 1
-        else:
-            failed_count += 1
     
-    logger.info(f"📢 Live stream notifications: {sent_count} sent, {failed_count} failed")
+    # Sent to all active subscribers who want live notifications
+    job_id = await notification_outbox.enqueue(
+        "telegram_broadcast",
+        {
+            "bot_token": bot_config['bot_token'],
+            "text": message.strip(),
+            "name": "live_stream",
+            "audience": "creator_subscribers",
+            "audience_args": {"creator_id": creator_id, "notify_field": "notify_live"}
+        },
+        idempotency_key=f"live_stream:{stream_id}"
+    )
+    logger.info(f"📢 Live stream notifications queued ({job_id})")
+    return {"success": True, "broadcast_id": job_id, "status": "queued"}
+
+
+# ============ BROADCAST PROGRESS ============
+
+@router.get("/broadcasts")
+async def get_broadcasts():
+    """Outbox queue depth and Telegram rate-limit state"""
     return {
-        "success": True,
-        "sent_count": sent_count,
-        "failed_count": failed_count
+        "outbox": await notification_outbox.get_stats(),
+        "telegram": telegram_broadcaster.get_stats(),
+        "recipients": await telegram_recipients.get_stats()
     }
 
 
+@router.get("/broadcasts/{broadcast_id}")
+async def get_broadcast(broadcast_id: str):
+    """Progress of one broadcast (recipient jobs counted by status)"""
+    job = await notification_outbox.get_job(broadcast_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Broadcast not found")
+    return job
+
+
 # ============ GET SUBSCRIBERS COUNT ============
 
 @router.get("/subscribers/{creator_id}/count")
@@ -5,6 +5,7 @@ Refactored modular architecture
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
+import asyncio
 import os
 import logging
 from pathlib import Path
@@ -30,8 +31,11 @@ db = client[os.environ['DB_NAME']]
 fs = AsyncIOMotorGridFSBucket(db)
 
 # Initialize Webhook Service
+import webhook_service as webhook_service_module
 from webhook_service import WebhookService
 webhook_service = WebhookService(db)
+# Routes and the notification outbox use the module-level instance
+webhook_service_module.webhook_service = webhook_service
 
 # Create FastAPI app
 app = FastAPI(
@@ -162,6 +166,27 @@ users_club_module.set_db(db)
 admin_panel_module.set_db(db)
 live_sessions_module.set_db(db)
 
+# Badge counts read by the notifications and messages routes
+from services.unread_counters import unread_counters
+unread_counters.set_db(db)
+
+# Real-time notifications / DMs / counters (replaces badge polling)
+from services.user_channel import user_channel
+user_channel.set_db(db)
+unread_counters.on_change = user_channel.counters_changed
+
+# Inbox: one summary per conversation, written with every message
+from services.conversation_summaries import conversation_summaries
+conversation_summaries.set_db(db)
+
+# DM attachments live in the `attachments` GridFS bucket
+from services.attachment_store import attachment_store
+attachment_store.set_db(db)
+
+# Threaded podcast comments with a hot-page cache
+from services.comment_threads import comment_threads
+comment_threads.set_db(db)
+
 
 @app.get("/api/")
 async def root():
@@ -197,13 +222,49 @@ async def startup_check():
             if authors_count > 0:
                 logger.warning(f"⚠️  Migration needed: Run python migration_to_private_club.py")
         
-        # Start reminder task for scheduled sessions
+        # Timed jobs (session reminders) run from the scheduler
         try:
-            from routes.live_sessions import start_reminder_task
-            start_reminder_task()
-            logger.info("✅ Session reminder task started")
+            from services.scheduler import scheduler
+            from routes.live_sessions import schedule_upcoming_reminders
+            scheduler.set_db(db)
+            scheduler.start()
+            await schedule_upcoming_reminders()
+            logger.info("✅ Session reminder scheduler started")
         except Exception as e:
-            logger.warning(f"⚠️  Could not start reminder task: {e}")
+            logger.warning(f"⚠️  Could not start reminder scheduler: {e}")
+        
+        # Follow live session changes from other workers (replica sets only)
+        from services.live_session_registry import live_session_registry
+        live_session_registry.start_watch()
+        
+        # Deliver queued notifications (Telegram, in-app, webhooks)
+        from services.notification_outbox import notification_outbox
+        from services.notification_fanout import notification_fanout
+        from services.web_push import web_push
+        notification_outbox.set_db(db)
+        notification_fanout.set_db(db)
+        web_push.set_db(db)
+        notification_outbox.start()
+        
+        # Per-user sockets: events from any worker via the user_events collection
+        await user_channel.start()
+        
+        # Webhook subscribers by event (no query for events nobody listens to)
+        from services.webhook_subscriptions import webhook_subscriptions
+        webhook_subscriptions.start_watch()
+        await webhook_subscriptions.load()
+        
+        # Telegram broadcast recipients (built once from users/authors/connections)
+        from services.telegram_recipients import telegram_recipients
+        telegram_recipients.set_db(db)
+        await telegram_recipients.backfill()
+        
+        # Conversation summaries for messages written before the projection
+        await conversation_summaries.backfill()
+        await conversation_summaries.backfill_message_keys()
+        
+        # Inline (base64) attachments of old messages move to GridFS in the background
+        asyncio.create_task(attachment_store.migrate_inline())
             
     except Exception as e:
         logger.error(f"❌ Database check error: {e}")
@@ -212,6 +273,29 @@ async def startup_check():
 @app.on_event("shutdown")
 async def shutdown_db_client():
     """Cleanup on shutdown"""
+    from services.xp_accrual import xp_accrual
+    from services.live_chat_log import chat_log
+    from services.live_session_registry import live_session_registry
+    from services.hand_raise_queue import hand_raise_queue
+    from services.notification_outbox import notification_outbox
+    from services.scheduler import scheduler
+    await scheduler.close()
+    await notification_outbox.close()
+    await xp_accrual.close()
+    await chat_log.close()
+    await live_session_registry.close()
+    await hand_raise_queue.close()
+    from routes.live_sessions import room_manager
+    await room_manager.snapshots.close()
+    await room_manager.timeline.close()
+    from services.telegram_broadcast import telegram_broadcaster
+    await telegram_broadcaster.close()
+    from services.web_push import web_push
+    await web_push.close()
+    from services.webhook_subscriptions import webhook_subscriptions
+    await webhook_subscriptions.close()
+    await user_channel.close()
+    await attachment_store.close()
     await webhook_service.close()
     client.close()
 
@@ -0,0 +1,382 @@
+"""
+Attachment Store
+Direct message attachments streamed into a GridFS bucket, deduplicated
+by SHA-256, with image thumbnails rendered on a worker pool; messages
+keep only a reference served by a Range-capable download endpoint
+"""
+import asyncio
+import base64
+import hashlib
+import io
+import logging
+import os
+import uuid
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import AsyncIterator, Optional, Tuple
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+from pymongo.errors import DuplicateKeyError
+
+from services.notification_outbox import OutboxPermanentError, notification_outbox
+
+try:
+    from PIL import Image, UnidentifiedImageError
+except ImportError:  # Thumbnails disabled; images are served full size
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+BUCKET_NAME = "attachments"
+# Largest accepted attachment
+MAX_ATTACHMENT_SIZE = int(os.environ.get("DM_ATTACHMENT_MAX_BYTES", str(5 * 1024 * 1024)))
+# Upload / download read size (a multiple of the GridFS chunk size)
+STREAM_CHUNK_SIZE = 4 * 255 * 1024
+# Bounding box and encoding of image thumbnails
+THUMBNAIL_SIZE = (480, 480)
+THUMBNAIL_QUALITY = 80
+# "thread" or "process" (decoding large images holds the GIL in places)
+THUMBNAIL_POOL = os.environ.get("DM_THUMBNAIL_POOL", "thread")
+THUMBNAIL_WORKERS = int(os.environ.get("DM_THUMBNAIL_WORKERS", str(min(2, os.cpu_count() or 1))))
+# Messages converted per batch by migrate_inline()
+MIGRATION_BATCH_SIZE = 100
+# Uploader-declared types that are safe to render on the API origin;
+# anything else is served as an application/octet-stream download
+INLINE_CONTENT_TYPES = frozenset({
+    "image/png", "image/jpeg", "image/gif", "image/webp", "image/avif", "image/bmp",
+    "audio/mpeg", "audio/mp4", "audio/aac", "audio/ogg", "audio/wav", "audio/x-wav",
+    "audio/webm", "audio/flac"
+})
+
+# Outbox job kind rendering a thumbnail
+THUMBNAIL_JOB = "attachment_thumbnail"
+
+
+class AttachmentTooLarge(Exception):
+    pass
+
+
+def attachment_kind(content_type: str) -> str:
+    if content_type.startswith("image/"):
+        return "image"
+    if content_type.startswith("audio/"):
+        return "audio"
+    return "file"
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    First range of a `Range: bytes=...` header
+
+    Returns:
+        (start, end) inclusive, None for no / unsupported header
+
+    Raises:
+        ValueError: Range not satisfiable
+    """
+    if not header or not header.startswith("bytes="):
+        return None
+    spec = header[len("bytes="):].split(",")[0].strip()
+    start_text, _, end_text = spec.partition("-")
+    try:
+        if not start_text:
+            # Suffix range: the last N bytes
+            length = int(end_text)
+            if length <= 0:
+                raise ValueError(spec)
+            return max(0, size - length), size - 1
+        start = int(start_text)
+        end = int(end_text) if end_text else size - 1
+    except ValueError:
+        raise ValueError(spec)
+    if start >= size or end < start:
+        raise ValueError(spec)
+    return start, min(end, size - 1)
+
+
+def render_thumbnail(data: bytes) -> Tuple[bytes, int, int]:
+    """Downscale an image to THUMBNAIL_SIZE (worker pool side)"""
+    with Image.open(io.BytesIO(data)) as image:
+        width, height = image.size
+        image.draft("RGB", THUMBNAIL_SIZE)
+        image.thumbnail(THUMBNAIL_SIZE)
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        out = io.BytesIO()
+        image.save(out, format="JPEG", quality=THUMBNAIL_QUALITY, optimize=True)
+    return out.getvalue(), width, height
+
+
+class AttachmentStore:
+    """
+    GridFS-backed attachment storage
+
+    - save() streams an upload into GridFS while hashing it, then keeps a
+      single copy per content hash (the duplicate upload is deleted)
+    - `attachments` documents hold hash, size, type, GridFS ids and the
+      thumbnail state; messages store only the attachment id
+    - Thumbnails are rendered by the `attachment_thumbnail` outbox job, so
+      a crash or a busy pool never loses one
+    """
+
+    def __init__(self, db=None):
+        self.db = db
+        self.fs: Optional[AsyncIOMotorGridFSBucket] = None
+        self._executor: Optional[Executor] = None
+        self._indexes_ready = False
+
+        # Stats
+        self.stored = 0
+        self.deduplicated = 0
+        self.bytes_stored = 0
+        self.thumbnails = 0
+        self.migrated = 0
+
+    def set_db(self, db):
+        self.db = db
+        self.fs = AsyncIOMotorGridFSBucket(db, bucket_name=BUCKET_NAME)
+
+    async def save(self, upload, owner_id: str) -> dict:
+        """
+        Store an uploaded file
+
+        Args:
+            upload: UploadFile (read in STREAM_CHUNK_SIZE pieces)
+            owner_id: Uploading user
+
+        Returns:
+            The attachment document
+
+        Raises:
+            AttachmentTooLarge: Over MAX_ATTACHMENT_SIZE (nothing is kept)
+        """
+        content_type = upload.content_type or "application/octet-stream"
+
+        async def chunks():
+            while True:
+                chunk = await upload.read(STREAM_CHUNK_SIZE)
+                if not chunk:
+                    return
+                yield chunk
+
+        return await self._store(chunks(), upload.filename, content_type, owner_id)
+
+    async def save_bytes(self, data: bytes, filename: Optional[str], content_type: str, owner_id: str) -> dict:
+        async def chunks():
+            for start in range(0, len(data), STREAM_CHUNK_SIZE):
+                yield data[start:start + STREAM_CHUNK_SIZE]
+
+        return await self._store(chunks(), filename, content_type, owner_id)
+
+    async def get(self, attachment_id: str) -> Optional[dict]:
+        return await self.db.attachments.find_one({"id": attachment_id}, {"_id": 0})
+
+    async def stream(self, file_id: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        """
+        Bytes start..end (inclusive) of a GridFS file
+
+        Only the chunks covering the range are read.
+        """
+        grid_out = await self.fs.open_download_stream(ObjectId(file_id))
+        end = grid_out.length - 1 if end is None else end
+        grid_out.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = await grid_out.read(min(STREAM_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+    def reference(self, attachment: dict, filename: Optional[str] = None) -> dict:
+        """Message fields pointing at an attachment"""
+        base = f"/api/messages/attachments/{attachment['id']}"
+        has_thumbnail = attachment["kind"] == "image" and Image is not None
+        return {
+            "attachment_id": attachment["id"],
+            "attachment_url": base,
+            "thumbnail_url": f"{base}/thumbnail" if has_thumbnail else None,
+            "attachment_type": attachment["kind"],
+            "attachment_name": filename or attachment.get("filename"),
+            "attachment_size": attachment["size"]
+        }
+
+    async def run_thumbnail_job(self, job: dict) -> Optional[dict]:
+        """`attachment_thumbnail` outbox handler (payload: attachment_id)"""
+        if Image is None:
+            raise OutboxPermanentError("Pillow is not installed")
+        attachment = await self.get(job["payload"]["attachment_id"])
+        if attachment is None:
+            raise OutboxPermanentError("attachment deleted")
+        if attachment.get("thumbnail_file_id"):
+            return {"thumbnail_file_id": attachment["thumbnail_file_id"]}
+
+        data = b"".join([chunk async for chunk in self.stream(attachment["file_id"])])
+        loop = asyncio.get_running_loop()
+        try:
+            thumbnail, width, height = await loop.run_in_executor(self._pool(), render_thumbnail, data)
+        except (UnidentifiedImageError, OSError, ValueError) as e:
+            # Not a decodable image: serve the original instead
+            await self.db.attachments.update_one(
+                {"id": attachment["id"]}, {"$set": {"thumbnail_status": "failed"}}
+            )
+            raise OutboxPermanentError(f"thumbnail failed: {e}")
+
+        thumbnail_id = await self.fs.upload_from_stream(
+            f"{attachment['id']}-thumbnail.jpg",
+            io.BytesIO(thumbnail),
+            metadata={"attachment_id": attachment["id"], "content_type": "image/jpeg"}
+        )
+        await self.db.attachments.update_one(
+            {"id": attachment["id"]},
+            {"$set": {
+                "thumbnail_file_id": str(thumbnail_id),
+                "thumbnail_size": len(thumbnail),
+                "thumbnail_status": "ready",
+                "width": width,
+                "height": height
+            }}
+        )
+        self.thumbnails += 1
+        return {"thumbnail_file_id": str(thumbnail_id), "bytes": len(thumbnail)}
+
+    async def migrate_inline(self) -> int:
+        """
+        Move base64 data-URL attachments out of existing messages
+
+        A message that fails keeps its inline data (the only copy) and is
+        marked with attachment_migration_failed_at; unset it to retry.
+
+        Returns:
+            Number of messages converted
+        """
+        if self.db is None:
+            return 0
+        converted = 0
+        while True:
+            batch = await self.db.messages.find(
+                {
+                    "attachment_url": {"$regex": "^data:"},
+                    "attachment_migration_failed_at": {"$exists": False}
+                },
+                {"_id": 0, "id": 1, "sender_id": 1, "attachment_url": 1, "attachment_name": 1}
+            ).limit(MIGRATION_BATCH_SIZE).to_list(MIGRATION_BATCH_SIZE)
+            if not batch:
+                break
+            for message in batch:
+                header, _, payload = message["attachment_url"].partition(",")
+                content_type = header[len("data:"):].split(";")[0] or "application/octet-stream"
+                try:
+                    data = base64.b64decode(payload)
+                    attachment = await self.save_bytes(
+                        data, message.get("attachment_name"), content_type, message.get("sender_id")
+                    )
+                    fields = self.reference(attachment, message.get("attachment_name"))
+                except Exception as e:
+                    logger.error(f"Attachment migration failed for message {message.get('id')}: {e}")
+                    await self.db.messages.update_one(
+                        {"id": message["id"]},
+                        {"$set": {"attachment_migration_failed_at": datetime.now(timezone.utc)}}
+                    )
+                    continue
+                await self.db.messages.update_one({"id": message["id"]}, {"$set": fields})
+                converted += 1
+        if converted:
+            self.migrated += converted
+            logger.info(f"📎 Moved {converted} inline message attachments to GridFS")
+        return converted
+
+    def get_stats(self) -> dict:
+        return {
+            "stored": self.stored,
+            "deduplicated": self.deduplicated,
+            "bytes_stored": self.bytes_stored,
+            "thumbnails": self.thumbnails,
+            "thumbnails_enabled": Image is not None,
+            "thumbnail_pool": THUMBNAIL_POOL,
+            "migrated": self.migrated
+        }
+
+    async def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def _store(self, chunks: AsyncIterator[bytes], filename: Optional[str], content_type: str, owner_id: str) -> dict:
+        await self._ensure_indexes()
+        digest = hashlib.sha256()
+        size = 0
+        grid_in = self.fs.open_upload_stream(
+            filename or "attachment",
+            metadata={"content_type": content_type, "owner_id": owner_id}
+        )
+        try:
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > MAX_ATTACHMENT_SIZE:
+                    raise AttachmentTooLarge(f"{size} > {MAX_ATTACHMENT_SIZE}")
+                digest.update(chunk)
+                await grid_in.write(chunk)
+        except BaseException:
+            await grid_in.abort()
+            raise
+        await grid_in.close()
+        file_id = grid_in._id
+        sha256 = digest.hexdigest()
+
+        existing = await self.db.attachments.find_one({"sha256": sha256}, {"_id": 0})
+        if existing is None:
+            attachment = {
+                "id": str(uuid.uuid4()),
+                "sha256": sha256,
+                "file_id": str(file_id),
+                "size": size,
+                "content_type": content_type,
+                "kind": attachment_kind(content_type),
+                "filename": filename,
+                "owner_id": owner_id,
+                "thumbnail_file_id": None,
+                "thumbnail_status": None,
+                "created_at": datetime.now(timezone.utc)
+            }
+            if attachment["kind"] == "image" and Image is not None:
+                attachment["thumbnail_status"] = "pending"
+            try:
+                await self.db.attachments.insert_one(attachment)
+                attachment.pop("_id", None)
+                self.stored += 1
+                self.bytes_stored += size
+                if attachment["thumbnail_status"] == "pending":
+                    await notification_outbox.enqueue(
+                        THUMBNAIL_JOB,
+                        {"attachment_id": attachment["id"]},
+                        idempotency_key=f"{THUMBNAIL_JOB}:{attachment['id']}"
+                    )
+                return attachment
+            except DuplicateKeyError:
+                # Same content stored concurrently
+                existing = await self.db.attachments.find_one({"sha256": sha256}, {"_id": 0})
+
+        await self.fs.delete(file_id)
+        self.deduplicated += 1
+        return existing
+
+    def _pool(self) -> Executor:
+        if self._executor is None:
+            if THUMBNAIL_POOL == "process":
+                self._executor = ProcessPoolExecutor(max_workers=THUMBNAIL_WORKERS)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=THUMBNAIL_WORKERS, thread_name_prefix="thumbnail")
+        return self._executor
+
+    async def _ensure_indexes(self):
+        if self._indexes_ready:
+            return
+        await self.db.attachments.create_index("id", unique=True)
+        await self.db.attachments.create_index("sha256", unique=True)
+        self._indexes_ready = True
+
+
+# Global instance (database is set on startup)
+attachment_store = AttachmentStore()
@@ -0,0 +1,258 @@
+"""
+Comment Threads
+Threaded podcast comments: keyset-paginated top-level comments carrying
+reply counts and the first replies, with further replies loaded on
+demand; pages of hot podcasts are kept in a small LRU that every
+comment write for the podcast invalidates
+"""
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Top-level comments per page (default / upper bound)
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+# Replies per lazy-loaded page (default / upper bound)
+REPLY_PAGE_SIZE = 20
+MAX_REPLY_PAGE_SIZE = 100
+# Replies embedded under each top-level comment
+REPLY_PREVIEW = 3
+# Bound on cached pages (least recently used are evicted first)
+MAX_CACHED_PAGES = 256
+# Writes on this worker invalidate immediately, writes on other workers
+# show up within this
+CACHE_TTL = 15.0
+
+# liked_by grows with every like; clients get liked_by_user instead
+COMMENT_PROJECTION = {"_id": 0, "liked_by": 0}
+
+
+def comment_cursor(comment: dict) -> str:
+    """Opaque keyset position of a comment: (created_at, id)"""
+    return f"{comment.get('created_at')}|{comment.get('id')}"
+
+
+def _keyset(cursor: str, op: str) -> dict:
+    created_at, sep, comment_id = cursor.rpartition("|")
+    if not sep or not created_at:
+        raise ValueError(f"invalid cursor: {cursor}")
+    return {"$or": [
+        {"created_at": {op: created_at}},
+        {"created_at": created_at, "id": {op: comment_id}}
+    ]}
+
+
+class CommentThreads:
+    """
+    Comment thread reader with a per-podcast page cache
+
+    - page(): newest top-level comments first, each with reply_count and
+      the REPLY_PREVIEW oldest replies; at most three queries per page
+    - replies(): oldest first, after a reply's cursor
+    - Cached pages are shared by all visitors; per-user fields
+      (liked_by_user) are added to copies by annotate()
+    - invalidate() is called by every route that writes a comment
+    """
+
+    def __init__(self, db=None):
+        self.db = db
+        # (kind, podcast_id, ...) -> (comments, expires_at)
+        self._pages: "OrderedDict[tuple, Tuple[List[dict], float]]" = OrderedDict()
+        self._keys_by_podcast: Dict[str, Set[tuple]] = {}
+        self._indexes_ready = False
+
+        # Stats
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def set_db(self, db):
+        self.db = db
+
+    async def page(self, podcast_id: str, limit: int = PAGE_SIZE, before: Optional[str] = None) -> List[dict]:
+        """
+        Top-level comments of a podcast, newest first
+
+        Args:
+            podcast_id: Podcast
+            limit: Page size (at most MAX_PAGE_SIZE)
+            before: `cursor` of the last comment of the previous page
+
+        Returns:
+            Comments with cursor, reply_count and replies (preview)
+
+        Raises:
+            ValueError: Malformed cursor
+        """
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        key = ("page", podcast_id, before, limit)
+        cached = self._cached(key)
+        if cached is not None:
+            return cached
+
+        await self._ensure_indexes()
+        query = {"podcast_id": podcast_id, "parent_id": None}
+        if before:
+            query.update(_keyset(before, "$lt"))
+        comments = await self.db.comments.find(query, COMMENT_PROJECTION) \
+            .sort([("created_at", -1), ("id", -1)]) \
+            .limit(limit) \
+            .to_list(limit)
+
+        counts: Dict[str, int] = {}
+        previews: Dict[str, List[dict]] = {}
+        if comments:
+            # Reply counts for the whole page (index-only, no documents loaded)
+            async for thread in self.db.comments.aggregate([
+                {"$match": {"parent_id": {"$in": [c["id"] for c in comments]}}},
+                {"$group": {"_id": "$parent_id", "count": {"$sum": 1}}}
+            ]):
+                counts[thread["_id"]] = thread["count"]
+
+        if counts:
+            # First REPLY_PREVIEW replies of each thread, limited per thread
+            # so a hot thread's replies are never all loaded
+            async for thread in self.db.comments.aggregate([
+                {"$match": {"id": {"$in": list(counts)}}},
+                {"$project": {"_id": 0, "id": 1}},
+                {"$lookup": {
+                    "from": "comments",
+                    "let": {"parent_id": "$id"},
+                    "pipeline": [
+                        {"$match": {"$expr": {"$eq": ["$parent_id", "$$parent_id"]}}},
+                        {"$sort": {"created_at": 1, "id": 1}},
+                        {"$limit": REPLY_PREVIEW},
+                        {"$project": COMMENT_PROJECTION}
+                    ],
+                    "as": "replies"
+                }}
+            ]):
+                previews[thread["id"]] = thread["replies"]
+
+        for comment in comments:
+            comment["cursor"] = comment_cursor(comment)
+            comment["reply_count"] = counts.get(comment["id"], 0)
+            comment["replies"] = [self._reply(r) for r in previews.get(comment["id"], [])]
+
+        self._store(key, podcast_id, comments)
+        return comments
+
+    async def replies(
+        self,
+        podcast_id: str,
+        parent_id: str,
+        limit: int = REPLY_PAGE_SIZE,
+        after: Optional[str] = None
+    ) -> List[dict]:
+        """
+        Replies to a comment, oldest first
+
+        Args:
+            podcast_id: Podcast of the thread (cache invalidation scope)
+            parent_id: Top-level comment id
+            limit: Page size (at most MAX_REPLY_PAGE_SIZE)
+            after: `cursor` of the last reply already shown
+
+        Raises:
+            ValueError: Malformed cursor
+        """
+        limit = max(1, min(limit, MAX_REPLY_PAGE_SIZE))
+        key = ("replies", podcast_id, parent_id, after, limit)
+        cached = self._cached(key)
+        if cached is not None:
+            return cached
+
+        await self._ensure_indexes()
+        query = {"parent_id": parent_id}
+        if after:
+            query.update(_keyset(after, "$gt"))
+        replies = await self.db.comments.find(query, COMMENT_PROJECTION) \
+            .sort([("created_at", 1), ("id", 1)]) \
+            .limit(limit) \
+            .to_list(limit)
+        replies = [self._reply(r) for r in replies]
+
+        self._store(key, podcast_id, replies)
+        return replies
+
+    async def annotate(self, comments: List[dict], user_id: Optional[str]) -> List[dict]:
+        """
+        Copies of (cached) comments with liked_by_user set for a viewer
+
+        One query for the page and its embedded replies.
+        """
+        comments = [{**c, "replies": [dict(r) for r in c.get("replies", [])]} for c in comments]
+        every = comments + [r for c in comments for r in c["replies"]]
+        liked: Set[str] = set()
+        if user_id and every:
+            liked = {
+                doc["id"] async for doc in self.db.comments.find(
+                    {"id": {"$in": [c["id"] for c in every]}, "liked_by": user_id},
+                    {"_id": 0, "id": 1}
+                )
+            }
+        for comment in every:
+            comment["liked_by_user"] = comment["id"] in liked
+        return comments
+
+    def invalidate(self, podcast_id: Optional[str]):
+        """Drop every cached page of a podcast"""
+        keys = self._keys_by_podcast.pop(podcast_id, None)
+        if not keys:
+            return
+        self.invalidations += 1
+        for key in keys:
+            self._pages.pop(key, None)
+
+    def get_stats(self) -> dict:
+        return {
+            "cached_pages": len(self._pages),
+            "cached_podcasts": len(self._keys_by_podcast),
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations
+        }
+
+    def _reply(self, reply: dict) -> dict:
+        reply.pop("replies", None)
+        reply["cursor"] = comment_cursor(reply)
+        return reply
+
+    def _cached(self, key: tuple) -> Optional[List[dict]]:
+        entry = self._pages.get(key)
+        if entry and entry[1] > time.monotonic():
+            self._pages.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+        self.misses += 1
+        return None
+
+    def _store(self, key: tuple, podcast_id: str, comments: List[dict]):
+        self._pages.pop(key, None)
+        self._pages[key] = (comments, time.monotonic() + CACHE_TTL)
+        self._keys_by_podcast.setdefault(podcast_id, set()).add(key)
+        while len(self._pages) > MAX_CACHED_PAGES:
+            old_key, _ = self._pages.popitem(last=False)
+            self._forget(old_key)
+
+    def _forget(self, key: tuple):
+        keys = self._keys_by_podcast.get(key[1])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_podcast[key[1]]
+
+    async def _ensure_indexes(self):
+        if self._indexes_ready:
+            return
+        await self.db.comments.create_index([("podcast_id", 1), ("parent_id", 1), ("created_at", -1), ("id", -1)])
+        await self.db.comments.create_index([("parent_id", 1), ("created_at", 1), ("id", 1)])
+        await self.db.comments.create_index("id")
+        self._indexes_ready = True
+
+
+# Global instance (database is set on startup)
+comment_threads = CommentThreads()
@@ -0,0 +1,253 @@
+"""
+Conversation Summaries Projection
+One `conversations` document per user pair holding the last message
+preview and each side's unread count, updated atomically with every
+sent message, so the inbox is one indexed query however long the
+message histories get
+"""
+import logging
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+# Characters of the last message kept for the inbox preview
+PREVIEW_LENGTH = 120
+# Cursor batch size / summaries per bulk_write during backfill
+BATCH_SIZE = 500
+
+
+def conversation_key(user1_id: str, user2_id: str) -> Tuple[str, List[str]]:
+    """Id and participants of a user pair (same for both directions)"""
+    participants = sorted([user1_id, user2_id])
+    return ":".join(participants), participants
+
+
+def _last_message(message: dict) -> dict:
+    # created_at comes first: $max compares embedded documents field by field
+    return {
+        "created_at": message.get("created_at"),
+        "id": message.get("id"),
+        "sender_id": message.get("sender_id"),
+        "preview": (message.get("content") or "")[:PREVIEW_LENGTH],
+        "attachment_type": message.get("attachment_type")
+    }
+
+
+class ConversationSummaries:
+    """
+    Maintained inbox projection
+
+    - message_sent() / read() / deleted() are called next to every write
+      that changes a conversation; backfill() builds the collection once
+      from messages
+    - The last message is written with $max, so concurrent sends can't
+      leave an older message as the preview
+    - Unread counts live under `unread.<user_id>` for both participants
+    """
+
+    def __init__(self, db=None):
+        self.db = db
+        self._indexes_ready = False
+
+    def set_db(self, db):
+        self.db = db
+
+    async def message_sent(self, message: dict):
+        """
+        Record a new message in its conversation (upserted)
+
+        Args:
+            message: Stored message (sender_id, recipient_id, content, created_at)
+        """
+        if self.db is None:
+            return
+        await self._ensure_indexes()
+        sender_id, recipient_id = message["sender_id"], message["recipient_id"]
+        conversation_id, participants = conversation_key(sender_id, recipient_id)
+        update = {
+            "$max": {"last_message": _last_message(message), "last_at": message.get("created_at")},
+            "$set": {"updated_at": datetime.now(timezone.utc)},
+            "$setOnInsert": {"participants": participants}
+        }
+        if sender_id != recipient_id:
+            update["$inc"] = {f"unread.{recipient_id}": 1}
+            update["$setOnInsert"][f"unread.{sender_id}"] = 0
+        await self.db.conversations.update_one({"id": conversation_id}, update, upsert=True)
+
+    async def read(self, user_id: str, peer_id: str, count: int):
+        """
+        user_id read `count` messages from peer_id
+
+        Decrements by the number of messages actually marked read, so a
+        message arriving meanwhile stays unread
+        """
+        if self.db is None or not count:
+            return
+        conversation_id, _ = conversation_key(user_id, peer_id)
+        await self.db.conversations.update_one(
+            {"id": conversation_id},
+            {"$inc": {f"unread.{user_id}": -count}, "$set": {"updated_at": datetime.now(timezone.utc)}}
+        )
+
+    async def deleted(self, user1_id: str, user2_id: str):
+        """All messages between the pair were deleted"""
+        if self.db is None:
+            return
+        conversation_id, _ = conversation_key(user1_id, user2_id)
+        await self.db.conversations.delete_one({"id": conversation_id})
+
+    async def list_for_user(self, user_id: str, limit: int = 100, before: Optional[str] = None) -> List[dict]:
+        """
+        A user's conversations, most recent first
+
+        Args:
+            user_id: Inbox owner
+            limit: Page size
+            before: Only conversations whose last message is older (last_at of the previous page)
+
+        Returns:
+            Summary documents (participants, last_message, last_at, unread)
+        """
+        await self._ensure_indexes()
+        query = {"participants": user_id}
+        if before:
+            query["last_at"] = {"$lt": before}
+        return await self.db.conversations.find(query, {"_id": 0}) \
+            .sort("last_at", -1) \
+            .limit(limit) \
+            .to_list(limit)
+
+    async def unread_counts(self, user_id: str) -> Dict[str, int]:
+        """
+        A user's unread message count per peer (conversations with unread only)
+
+        This is the one source of unread message counts; unread_counters
+        serves it (cached) with the notification count.
+        """
+        if self.db is None:
+            return {}
+        await self._ensure_indexes()
+        field = f"unread.{user_id}"
+        unread = {}
+        async for conversation in self.db.conversations.find(
+            {"participants": user_id, field: {"$gt": 0}},
+            {"_id": 0, "participants": 1, field: 1}
+        ):
+            peer_id = next((p for p in conversation["participants"] if p != user_id), user_id)
+            unread[peer_id] = conversation["unread"][user_id]
+        return unread
+
+    async def backfill(self, force: bool = False) -> int:
+        """
+        Build the projection from messages
+
+        Runs only while the collection is empty unless `force` is set.
+
+        Returns:
+            Number of conversations written
+        """
+        if self.db is None:
+            return 0
+        await self._ensure_indexes()
+        if not force and await self.db.conversations.estimated_document_count():
+            return 0
+
+        def unread_for(index: int) -> dict:
+            return {"$sum": {"$cond": [
+                {"$and": [
+                    {"$eq": ["$is_read", False]},
+                    {"$eq": ["$recipient_id", {"$arrayElemAt": ["$pair", index]}]},
+                    {"$ne": ["$sender_id", "$recipient_id"]}
+                ]},
+                1, 0
+            ]}}
+
+        pipeline = [
+            {"$match": {"sender_id": {"$type": "string"}, "recipient_id": {"$type": "string"}}},
+            {"$sort": {"created_at": -1}},
+            {"$set": {"pair": {"$cond": [
+                {"$lt": ["$sender_id", "$recipient_id"]},
+                ["$sender_id", "$recipient_id"],
+                ["$recipient_id", "$sender_id"]
+            ]}}},
+            {"$group": {
+                "_id": "$pair",
+                "id": {"$first": "$id"},
+                "sender_id": {"$first": "$sender_id"},
+                "content": {"$first": "$content"},
+                "attachment_type": {"$first": "$attachment_type"},
+                "created_at": {"$first": "$created_at"},
+                "unread_0": unread_for(0),
+                "unread_1": unread_for(1)
+            }}
+        ]
+
+        now = datetime.now(timezone.utc)
+        written = 0
+        ops = []
+        async for group in self.db.messages.aggregate(pipeline, allowDiskUse=True, batchSize=BATCH_SIZE):
+            participants = group["_id"]
+            ops.append(UpdateOne(
+                {"id": ":".join(participants)},
+                {"$set": {
+                    "participants": participants,
+                    "last_message": _last_message(group),
+                    "last_at": group.get("created_at"),
+                    "unread": {participants[0]: group["unread_0"], participants[1]: group["unread_1"]},
+                    "updated_at": now
+                }},
+                upsert=True
+            ))
+            if len(ops) >= BATCH_SIZE:
+                await self.db.conversations.bulk_write(ops, ordered=False)
+                written += len(ops)
+                ops = []
+        if ops:
+            await self.db.conversations.bulk_write(ops, ordered=False)
+            written += len(ops)
+
+        logger.info(f"💬 Conversation summaries backfilled: {written}")
+        return written
+
+    async def backfill_message_keys(self) -> int:
+        """
+        Set conversation_id on messages written before it existed
+
+        Returns:
+            Number of messages updated
+        """
+        if self.db is None:
+            return 0
+        await self._ensure_indexes()
+        result = await self.db.messages.update_many(
+            {
+                "conversation_id": {"$exists": False},
+                "sender_id": {"$type": "string"},
+                "recipient_id": {"$type": "string"}
+            },
+            [{"$set": {"conversation_id": {"$cond": [
+                {"$lt": ["$sender_id", "$recipient_id"]},
+                {"$concat": ["$sender_id", ":", "$recipient_id"]},
+                {"$concat": ["$recipient_id", ":", "$sender_id"]}
+            ]}}}]
+        )
+        if result.modified_count:
+            logger.info(f"💬 conversation_id set on {result.modified_count} messages")
+        return result.modified_count
+
+    async def _ensure_indexes(self):
+        if self._indexes_ready:
+            return
+        await self.db.conversations.create_index("id", unique=True)
+        await self.db.conversations.create_index([("participants", 1), ("last_at", -1)])
+        # Message history pages and incremental sync
+        await self.db.messages.create_index([("conversation_id", 1), ("created_at", 1), ("id", 1)])
+        await self.db.messages.create_index([("conversation_id", 1), ("read_at", 1)])
+        self._indexes_ready = True
+
+
+# Global instance (database is set on startup)
+conversation_summaries = ConversationSummaries()
@@ -0,0 +1,330 @@
+"""
+Hand Raise Queue Service
+Per-session in-memory priority queues for hand raises, persisted to
+hand_raise_events in the background and pushed to live-room sockets
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+# Flush pending writes at least this often (seconds)
+FLUSH_INTERVAL = 0.5
+# Flushes in a row without progress before the write blocking the queue
+# is dropped
+MAX_FLUSH_RETRIES = 10
+# How long the club's hand_raise_queue_limit is cached (seconds)
+SETTINGS_TTL = 60.0
+DEFAULT_QUEUE_LIMIT = 10
+
+# User fields copied onto queue entries (no per-entry user lookups)
+USER_FIELDS = {"_id": 0, "id": 1, "username": 1, "name": 1, "avatar": 1, "role": 1, "level": 1, "priority_score": 1}
+
+
+def queue_entry(hand_raise: dict, user: dict) -> dict:
+    """Public queue entry for a pending hand raise"""
+    raised_at = hand_raise["raised_at"]
+    return {
+        "hand_raise_id": hand_raise["id"],
+        "user_id": user["id"],
+        "username": user.get("username"),
+        "name": user.get("name"),
+        "avatar": user.get("avatar"),
+        "role": user.get("role", "listener"),
+        "level": user.get("level", 1),
+        "priority_score": hand_raise["priority_score"],
+        "raised_at": raised_at.isoformat() if hasattr(raised_at, "isoformat") else raised_at
+    }
+
+
+class SessionHandQueue:
+    """
+    Priority queue for one session: highest priority_score first, then
+    earliest raise
+
+    push is O(log n); remove is O(1) with lazy deletion from the heap.
+    The sorted view is rebuilt only after the queue changed.
+    """
+
+    def __init__(self):
+        # [-priority_score, raised_at, seq, hand_raise_id]
+        self._heap: List[list] = []
+        self._seq = itertools.count()
+        self.entries: Dict[str, dict] = {}
+        self.by_user: Dict[str, str] = {}
+        self._snapshot: Optional[List[dict]] = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def push(self, entry: dict):
+        heapq.heappush(self._heap, [
+            -entry["priority_score"], entry["raised_at"], next(self._seq), entry["hand_raise_id"]
+        ])
+        self.entries[entry["hand_raise_id"]] = entry
+        self.by_user[entry["user_id"]] = entry["hand_raise_id"]
+        self._snapshot = None
+
+    def remove(self, hand_raise_id: str) -> Optional[dict]:
+        entry = self.entries.pop(hand_raise_id, None)
+        if entry is None:
+            return None
+        self.by_user.pop(entry["user_id"], None)
+        self._snapshot = None
+
+        # Drop stale heap tops; rebuild if dead entries dominate
+        while self._heap and self._heap[0][3] not in self.entries:
+            heapq.heappop(self._heap)
+        if len(self._heap) > 2 * len(self.entries) + 16:
+            self._heap = [item for item in self._heap if item[3] in self.entries]
+            heapq.heapify(self._heap)
+        return entry
+
+    def snapshot(self) -> List[dict]:
+        """Queue in priority order with 1-based queue_position"""
+        if self._snapshot is None:
+            ordered = sorted(item for item in self._heap if item[3] in self.entries)
+            self._snapshot = [
+                {**self.entries[item[3]], "queue_position": idx + 1}
+                for idx, item in enumerate(ordered)
+            ]
+        return self._snapshot
+
+
+class HandRaiseQueueService:
+    """
+    Hand raise queues for all sessions of this worker
+
+    - A session's queue is loaded from hand_raise_events on first use
+    - Changes are applied in memory and written with bulk_write later
+    - Every change schedules one "hand_raise_queue" push for the session
+    """
+
+    def __init__(self, db=None):
+        self.db = db
+        self._queues: Dict[str, SessionHandQueue] = {}
+        self._loading: Dict[str, asyncio.Future] = {}
+        self._ops: list = []
+        # Background and on-demand flushes must not reorder an event's writes
+        self._flush_lock = asyncio.Lock()
+        self._flush_retries = 0
+        self._flush_task: Optional[asyncio.Task] = None
+        self._on_change: Optional[Callable[[str, dict], Awaitable[None]]] = None
+        self._dirty: set = set()
+        self._push_task: Optional[asyncio.Task] = None
+        self._queue_limit = (DEFAULT_QUEUE_LIMIT, 0.0)
+
+        # Stats
+        self.written = 0
+        self.failed = 0
+        self.pushes = 0
+
+    def set_db(self, db):
+        self.db = db
+
+    def set_on_change(self, callback: Callable[[str, dict], Awaitable[None]]):
+        """Set the coroutine that pushes a queue update to a session's sockets"""
+        self._on_change = callback
+
+    async def get(self, session_id: str) -> SessionHandQueue:
+        """Get a session's queue, loading pending hand raises on first use"""
+        queue = self._queues.get(session_id)
+        if queue is not None:
+            return queue
+
+        pending = self._loading.get(session_id)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._loading[session_id] = future
+        try:
+            queue = await self._load(session_id)
+            self._queues[session_id] = queue
+            future.set_result(queue)
+            return queue
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()
+            raise
+        finally:
+            del self._loading[session_id]
+
+    async def queue_limit(self) -> int:
+        """Club hand_raise_queue_limit (cached)"""
+        limit, expires_at = self._queue_limit
+        if expires_at > time.monotonic():
+            return limit
+        settings = await self.db.club_settings.find_one({}, {"_id": 0, "hand_raise_queue_limit": 1})
+        limit = settings.get("hand_raise_queue_limit", DEFAULT_QUEUE_LIMIT) if settings else DEFAULT_QUEUE_LIMIT
+        self._queue_limit = (limit, time.monotonic() + SETTINGS_TTL)
+        return limit
+
+    def add(self, session_id: str, queue: SessionHandQueue, hand_raise: dict, user: dict) -> dict:
+        """Queue a new hand raise and persist the event"""
+        entry = queue_entry(hand_raise, user)
+        queue.push(entry)
+        self._write(InsertOne(hand_raise))
+        self._changed(session_id)
+        return entry
+
+    def resolve(self, session_id: str, queue: SessionHandQueue, hand_raise_id: str, fields: dict) -> Optional[dict]:
+        """
+        Take a hand raise out of the queue and persist its new state
+
+        Args:
+            fields: $set applied to the event (e.g. {"status": "approved", ...})
+
+        Returns:
+            The removed queue entry, or None if it wasn't pending
+        """
+        entry = queue.remove(hand_raise_id)
+        if entry is None:
+            return None
+        self._write(UpdateOne({"id": hand_raise_id, "status": "pending"}, {"$set": fields}))
+        self._changed(session_id)
+        return entry
+
+    def payload(self, session_id: str) -> dict:
+        queue = self._queues.get(session_id)
+        snapshot = queue.snapshot() if queue else []
+        return {
+            "live_session_id": session_id,
+            "queue": snapshot,
+            "total": len(snapshot)
+        }
+
+    async def flush(self):
+        """
+        Write buffered hand raise changes
+
+        Routes that read hand_raise_events right after a change (approved
+        speakers) await this instead of waiting for the next interval.
+
+        Writes that did not land go back in front of the buffer, so the
+        collection converges on the in-memory queues; replaying one is
+        harmless (an insert that landed is a duplicate key, updates only
+        match pending events).
+        """
+        if self.db is None or not self._ops:
+            return
+        async with self._flush_lock:
+            ops, self._ops = self._ops, []
+            if not ops:
+                return
+            try:
+                # Ordered: an insert must land before updates to the same event
+                await self.db.hand_raise_events.bulk_write(ops, ordered=True)
+                self.written += len(ops)
+                self._flush_retries = 0
+                return
+            except BulkWriteError as e:
+                # Ordered: ops before the first error landed, none after it ran
+                error = (e.details.get("writeErrors") or [{"index": 0}])[0]
+                applied = error["index"]
+                if error.get("code") == 11000:
+                    # Insert that landed in an earlier flush
+                    applied += 1
+                self.written += applied
+                unapplied = ops[applied:]
+                reason = error.get("errmsg", str(e))
+            except Exception as e:
+                # Outcome unknown: replay the whole batch
+                unapplied = ops
+                reason = str(e)
+
+            if not unapplied:
+                self._flush_retries = 0
+                return
+            if len(unapplied) < len(ops):
+                self._flush_retries = 0
+            else:
+                self._flush_retries += 1
+            if self._flush_retries > MAX_FLUSH_RETRIES:
+                logger.error(f"Hand raise write dropped after {MAX_FLUSH_RETRIES} retries: {reason}")
+                self.failed += 1
+                unapplied = unapplied[1:]
+                self._flush_retries = 0
+            else:
+                logger.warning(f"Hand raise flush error ({len(unapplied)} ops retried): {reason}")
+            self._ops = unapplied + self._ops
+
+    def drop(self, session_id: str):
+        """Forget an ended session's queue (pending writes are still flushed)"""
+        self._queues.pop(session_id, None)
+        self._dirty.discard(session_id)
+
+    async def close(self):
+        if self._flush_task and not self._flush_task.done():
+            self._flush_task.cancel()
+        await self.flush()
+
+    def get_stats(self) -> dict:
+        return {
+            "sessions": len(self._queues),
+            "pending_hand_raises": sum(len(q) for q in self._queues.values()),
+            "pending_writes": len(self._ops),
+            "written": self.written,
+            "failed": self.failed,
+            "pushes": self.pushes
+        }
+
+    async def _load(self, session_id: str) -> SessionHandQueue:
+        queue = SessionHandQueue()
+        hand_raises = await self.db.hand_raise_events.find(
+            {"live_session_id": session_id, "status": "pending"},
+            {"_id": 0}
+        ).to_list(length=None)
+        if not hand_raises:
+            return queue
+
+        users = await self.db.users.find(
+            {"id": {"$in": list({hr["user_id"] for hr in hand_raises})}},
+            USER_FIELDS
+        ).to_list(length=None)
+        users_by_id = {u["id"]: u for u in users}
+
+        for hr in hand_raises:
+            user = users_by_id.get(hr["user_id"])
+            if user:
+                queue.push(queue_entry(hr, user))
+        return queue
+
+    def _write(self, op):
+        self._ops.append(op)
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._run_flush())
+
+    async def _run_flush(self):
+        while self._ops:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            await self.flush()
+
+    def _changed(self, session_id: str):
+        if self._on_change is None:
+            return
+        self._dirty.add(session_id)
+        if self._push_task is None or self._push_task.done():
+            self._push_task = asyncio.create_task(self._push())
+
+    async def _push(self):
+        """Send one update per changed session (several changes in a row coalesce)"""
+        await asyncio.sleep(0)
+        while self._dirty:
+            session_id = self._dirty.pop()
+            self.pushes += 1
+            try:
+                await self._on_change(session_id, {"type": "hand_raise_queue", **self.payload(session_id)})
+            except Exception as e:
+                logger.error(f"Hand raise queue push error for {session_id}: {e}")
+
+
+# Global instance (database is set from routes.hand_raise.set_db)
+hand_raise_queue = HandRaiseQueueService()
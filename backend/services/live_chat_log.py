@@ -0,0 +1,260 @@
+"""
+Live Chat Log Service
+Persists live-room chat in the background and serves paginated replay
+for late joiners and the post-live archive
+"""
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Deque, List, Optional, Tuple
+
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+# Messages kept in memory per room
+RING_BUFFER_SIZE = 100
+# Flush buffered messages at least this often (seconds)
+FLUSH_INTERVAL = 1.0
+# ...or as soon as this many are buffered
+MAX_PENDING_MESSAGES = 200
+# Failed flushes in a row before the messages they retried are dropped
+MAX_FLUSH_RETRIES = 10
+# Max page size for replay
+MAX_REPLAY_LIMIT = 200
+
+
+def new_ring_buffer() -> Deque[dict]:
+    """Capped per-room chat buffer (oldest messages fall off for free)"""
+    return deque(maxlen=RING_BUFFER_SIZE)
+
+
+def recent_messages(buffer: Deque[dict], count: int) -> List[dict]:
+    """Last `count` messages of a ring buffer as a list"""
+    if count >= len(buffer):
+        return list(buffer)
+    return list(buffer)[-count:]
+
+
+def parse_timestamp(value: str) -> datetime:
+    """Parse an ISO timestamp, treating naive values as UTC"""
+    dt = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt
+
+
+def _position(created_at: datetime, message_id: str = "") -> Tuple[datetime, str]:
+    """Sort key (created_at, id) at Mongo's millisecond precision"""
+    return created_at.replace(microsecond=created_at.microsecond // 1000 * 1000), message_id
+
+
+def chat_cursor(message: dict) -> str:
+    """Opaque keyset position of a chat message: (timestamp, id)"""
+    return f"{message['timestamp']}|{message['id']}"
+
+
+def parse_cursor(cursor: str) -> Tuple[datetime, str]:
+    """
+    Position of a replay cursor; replay returns messages strictly after it
+
+    A bare ISO timestamp (no id) is positioned after every message of
+    that millisecond.
+
+    Raises:
+        ValueError: Malformed cursor or timestamp
+    """
+    timestamp, sep, message_id = cursor.rpartition("|")
+    if not sep:
+        created_at, _ = _position(parse_timestamp(cursor))
+        return created_at + timedelta(milliseconds=1), ""
+    if not timestamp or not message_id:
+        raise ValueError(f"invalid cursor: {cursor}")
+    return _position(parse_timestamp(timestamp), message_id)
+
+
+class ChatLogWriter:
+    """
+    Batched writer for the `live_chat_messages` collection
+
+    append() is synchronous and never touches the database; a background
+    task writes buffered messages with insert_many.
+    """
+
+    def __init__(self, db=None):
+        self.db = db
+        self._pending: List[dict] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+        self._indexes_ready = False
+        self._flush_retries = 0
+
+        # Stats
+        self.written = 0
+        self.failed = 0
+
+    def set_db(self, db):
+        self.db = db
+
+    def append(self, room_id: str, message: dict, room_type: str = "live_session"):
+        """
+        Queue a chat message for persistence
+
+        Args:
+            room_id: Live session / room id
+            message: Chat message as broadcast to clients (must have "timestamp")
+            room_type: "live_session" or "live_room"
+        """
+        doc = dict(message)
+        doc["room_id"] = room_id
+        doc["room_type"] = room_type
+        doc["created_at"] = parse_timestamp(message["timestamp"])
+        self._pending.append(doc)
+
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._run())
+        if len(self._pending) >= MAX_PENDING_MESSAGES:
+            self._wakeup.set()
+
+    async def flush(self):
+        """
+        Write all buffered messages
+
+        Messages that did not land go back in front of the buffer; they
+        keep the _id insert_many gave them, so one that landed after all
+        is a duplicate key and skipped
+        """
+        if self.db is None or not self._pending:
+            return
+
+        batch, self._pending = self._pending, []
+        try:
+            if not self._indexes_ready:
+                await self.db.live_chat_messages.create_index(
+                    [("room_id", 1), ("created_at", 1), ("id", 1)]
+                )
+                self._indexes_ready = True
+            await self.db.live_chat_messages.insert_many(batch, ordered=False)
+            self.written += len(batch)
+            self._flush_retries = 0
+            return
+        except BulkWriteError as e:
+            # Unordered: only the listed inserts failed
+            errors = [err for err in e.details.get("writeErrors", []) if err.get("code") != 11000]
+            retry = [batch[err["index"]] for err in errors]
+            error = errors[0].get("errmsg") if errors else str(e)
+            self.written += len(batch) - len(retry)
+            if not retry:
+                self._flush_retries = 0
+                return
+        except Exception as e:
+            retry = batch
+            error = str(e)
+
+        self._flush_retries += 1
+        if self._flush_retries > MAX_FLUSH_RETRIES:
+            self.failed += len(retry)
+            self._flush_retries = 0
+            logger.error(f"Chat log flush error, dropped {len(retry)} messages after {MAX_FLUSH_RETRIES} retries: {error}")
+            return
+        logger.warning(f"Chat log flush error ({len(retry)} messages retried): {error}")
+        self._pending = retry + self._pending
+
+    async def close(self):
+        """Stop the flush loop and write whatever is still buffered"""
+        if self._flush_task and not self._flush_task.done():
+            self._flush_task.cancel()
+        await self.flush()
+
+    async def replay(
+        self,
+        room_id: str,
+        since: Optional[str] = None,
+        limit: int = 50,
+        recent: Optional[Deque[dict]] = None
+    ) -> dict:
+        """
+        Page through a room's chat in ascending time order
+
+        Args:
+            room_id: Live session / room id
+            since: `next_since` of the previous page (or an ISO timestamp:
+                only messages strictly after it)
+            limit: Page size
+            recent: The room's in-memory ring buffer, if the room is open
+
+        Returns:
+            {"messages": [...], "next_since": str | None, "has_more": bool}
+
+        Raises:
+            ValueError: Malformed cursor
+        """
+        limit = max(1, min(limit, MAX_REPLAY_LIMIT))
+        after = parse_cursor(since) if since else None
+
+        # Late joiner inside the ring buffer window: no database query
+        if recent and after is not None and after > self._key(recent[0]):
+            newer = [m for m in recent if self._key(m) > after]
+            return self._page(newer, limit, since)
+
+        messages = []
+        if self.db is not None:
+            query = {"room_id": room_id}
+            if after is not None:
+                query["$or"] = [
+                    {"created_at": {"$gt": after[0]}},
+                    {"created_at": after[0], "id": {"$gt": after[1]}}
+                ]
+            messages = await self.db.live_chat_messages.find(
+                query,
+                {"_id": 0, "room_id": 0, "room_type": 0, "created_at": 0}
+            ).sort([("created_at", 1), ("id", 1)]).limit(limit + 1).to_list(limit + 1)
+
+        # Include messages that are still waiting to be written
+        seen = {m["id"] for m in messages}
+        for doc in self._pending:
+            if doc["room_id"] != room_id or doc["id"] in seen:
+                continue
+            if after is not None and _position(doc["created_at"], doc["id"]) <= after:
+                continue
+            messages.append({
+                k: v for k, v in doc.items()
+                if k not in ("room_id", "room_type", "created_at")
+            })
+        messages.sort(key=self._key)
+
+        return self._page(messages, limit, since)
+
+    def get_stats(self) -> dict:
+        return {
+            "written": self.written,
+            "failed": self.failed,
+            "pending": len(self._pending)
+        }
+
+    @staticmethod
+    def _key(message: dict) -> Tuple[datetime, str]:
+        return _position(parse_timestamp(message["timestamp"]), message["id"])
+
+    @staticmethod
+    def _page(messages: List[dict], limit: int, since: Optional[str]) -> dict:
+        page = messages[:limit]
+        return {
+            "messages": page,
+            "next_since": chat_cursor(page[-1]) if page else since,
+            "has_more": len(messages) > limit
+        }
+
+    async def _run(self):
+        while self._pending:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+
+# Global instance (database is set from routes.live_sessions.set_db)
+chat_log = ChatLogWriter()
@@ -0,0 +1,145 @@
+"""
+Live Room Event Coalescer
+Merges high-frequency room events (reactions, speaking status) into
+one combined frame per room per tick
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def _parse_tick_tiers(raw: str) -> List[Tuple[int, float]]:
+    """
+    Parse "max_size:seconds" pairs, e.g. "50:0.1,500:0.15,0:0.25"
+    A max_size of 0 means "any size" and should come last
+    """
+    tiers = []
+    for part in raw.split(","):
+        if not part.strip():
+            continue
+        size, interval = part.split(":")
+        tiers.append((int(size), float(interval)))
+    return tiers
+
+
+# (max room size, tick interval in seconds); 0 = no upper bound
+DEFAULT_TICK_TIERS = [
+    (50, 0.10),
+    (500, 0.15),
+    (0, 0.25),
+]
+
+TICK_TIERS = _parse_tick_tiers(os.environ.get("LIVE_ROOM_TICK_TIERS", "")) or DEFAULT_TICK_TIERS
+
+
+class RoomEventCoalescer:
+    """
+    Buffers reactions and speaking-status flips per room and emits a
+    single "room_tick" frame every tick instead of one frame per event.
+
+    - Reactions are merged into per-emoji counts
+    - Only the latest speaking state per user is kept
+    - A room's tick task only runs while it has pending events
+    """
+
+    def __init__(
+        self,
+        broadcast: Callable[[str, dict], Awaitable[None]],
+        room_size: Callable[[str], int],
+        tiers: Optional[List[Tuple[int, float]]] = None
+    ):
+        """
+        Args:
+            broadcast: Coroutine used to send a frame to every room member
+            room_size: Returns current number of connections in a room
+            tiers: (max room size, interval) pairs, smallest rooms first
+        """
+        self._broadcast = broadcast
+        self._room_size = room_size
+        self.tiers = tiers or TICK_TIERS
+        # room_id -> {"reactions": {emoji: count}, "speaking": {user_id: bool}}
+        self._pending: Dict[str, dict] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+        # Stats
+        self.events_in = 0
+        self.frames_out = 0
+
+    def tick_interval(self, room_size: int) -> float:
+        """Pick the tick interval for a room of the given size"""
+        for max_size, interval in self.tiers:
+            if max_size == 0 or room_size <= max_size:
+                return interval
+        return self.tiers[-1][1]
+
+    def add_reaction(self, room_id: str, emoji: str, count: int = 1):
+        """Queue a reaction for the next tick"""
+        pending = self._get_pending(room_id)
+        pending["reactions"][emoji] = pending["reactions"].get(emoji, 0) + count
+        self.events_in += 1
+        self._ensure_task(room_id)
+
+    def set_speaking(self, room_id: str, user_id: str, is_speaking: bool):
+        """Queue a speaking-status change; later flips overwrite earlier ones"""
+        pending = self._get_pending(room_id)
+        pending["speaking"][user_id] = is_speaking
+        self.events_in += 1
+        self._ensure_task(room_id)
+
+    def discard(self, room_id: str):
+        """Drop pending events and stop the tick task for a closed room"""
+        self._pending.pop(room_id, None)
+        task = self._tasks.pop(room_id, None)
+        if task and not task.done():
+            task.cancel()
+
+    def get_stats(self) -> dict:
+        """Coalescing counters (events received vs frames emitted)"""
+        return {
+            "events_in": self.events_in,
+            "frames_out": self.frames_out,
+            "active_rooms": len(self._tasks)
+        }
+
+    async def flush(self, room_id: str):
+        """Emit pending events for a room as one frame"""
+        pending = self._pending.pop(room_id, None)
+        if not pending or not (pending["reactions"] or pending["speaking"]):
+            return
+
+        self.frames_out += 1
+        await self._broadcast(room_id, {
+            "type": "room_tick",
+            "reactions": pending["reactions"],
+            "speaking": pending["speaking"],
+            "timestamp": datetime.now(timezone.utc).isoformat()
+        })
+
+    def _get_pending(self, room_id: str) -> dict:
+        if room_id not in self._pending:
+            self._pending[room_id] = {"reactions": {}, "speaking": {}}
+        return self._pending[room_id]
+
+    def _ensure_task(self, room_id: str):
+        task = self._tasks.get(room_id)
+        if task is None or task.done():
+            self._tasks[room_id] = asyncio.create_task(self._run(room_id))
+
+    async def _run(self, room_id: str):
+        """Tick loop for one room; exits once a tick finds nothing to send"""
+        try:
+            while True:
+                await asyncio.sleep(self.tick_interval(self._room_size(room_id)))
+                if room_id not in self._pending:
+                    break
+                try:
+                    await self.flush(room_id)
+                except Exception as e:
+                    logger.error(f"Room tick error for {room_id}: {e}")
+        finally:
+            if self._tasks.get(room_id) is asyncio.current_task():
+                del self._tasks[room_id]
@@ -0,0 +1,245 @@
+"""
+Live Room Presence Service
+Tracks last-seen per connection in a hashed timer wheel: sends
+server-side pings, reaps idle sockets, batches join/leave events and
+measures time-in-room, all from a single background task
+"""
+import asyncio
+import logging
+import math
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Seconds per wheel tick
+TICK_SECONDS = 1.0
+# Number of wheel slots (timers further out than this wrap around)
+WHEEL_SLOTS = 512
+# Ping a connection after this many seconds without inbound frames
+PING_INTERVAL = float(os.environ.get("LIVE_PING_INTERVAL", "25"))
+# Reap a connection after this many seconds without inbound frames
+IDLE_TIMEOUT = float(os.environ.get("LIVE_IDLE_TIMEOUT", "75"))
+# Time-in-room reward period (the 5-minute XP reward)
+REWARD_INTERVAL = 300.0
+
+
+class TimerWheel:
+    """
+    Hashed timer wheel
+
+    schedule/cancel are O(1); advance() only looks at one slot. Keys
+    whose deadline is more than one revolution away stay in their slot
+    until their deadline tick comes round.
+    """
+
+    def __init__(self, slots: int = WHEEL_SLOTS, tick: float = TICK_SECONDS):
+        self.tick = tick
+        self.slots: List[Dict[Hashable, int]] = [{} for _ in range(slots)]
+        self.current = 0  # ticks elapsed
+        self._slot_of: Dict[Hashable, int] = {}
+
+    def __len__(self):
+        return len(self._slot_of)
+
+    def schedule(self, key: Hashable, delay: float):
+        """(Re)schedule key to fire after delay seconds"""
+        self.cancel(key)
+        deadline = self.current + max(1, math.ceil(delay / self.tick))
+        slot = deadline % len(self.slots)
+        self.slots[slot][key] = deadline
+        self._slot_of[key] = slot
+
+    def cancel(self, key: Hashable):
+        slot = self._slot_of.pop(key, None)
+        if slot is not None:
+            self.slots[slot].pop(key, None)
+
+    def advance(self) -> List[Hashable]:
+        """Move one tick forward and return keys that expired"""
+        self.current += 1
+        slot = self.slots[self.current % len(self.slots)]
+        expired = [key for key, deadline in slot.items() if deadline <= self.current]
+        for key in expired:
+            del slot[key]
+            del self._slot_of[key]
+        return expired
+
+
+class PresenceService:
+    """
+    Presence tracking for one room manager
+
+    Each connection gets one wheel entry. touch() only records a
+    timestamp; the entry is re-armed lazily when its slot fires:
+    - idle >= IDLE_TIMEOUT  -> reap (close socket, remove participant)
+    - idle >= PING_INTERVAL -> send one server-side ping
+    - reward period elapsed -> on_reward (time-in-room XP)
+
+    Join/leave events are netted per room and handed to
+    broadcast_presence once per tick.
+    """
+
+    def __init__(
+        self,
+        reap: Callable[[str, Hashable, Any], Awaitable[None]],
+        broadcast_presence: Callable[[str, List[dict], List[str]], Awaitable[None]],
+        on_reward: Optional[Callable[[str, str], None]] = None,
+        wheel: Optional[TimerWheel] = None
+    ):
+        """
+        Args:
+            reap: Called with (room_id, conn_id, websocket) for idle connections
+            broadcast_presence: Called with (room_id, joined, left) once per tick
+            on_reward: Called with (room_id, user_id) every REWARD_INTERVAL in room
+            wheel: Timer wheel (a new one by default)
+        """
+        self._reap = reap
+        self._broadcast_presence = broadcast_presence
+        self._on_reward = on_reward
+        self.wheel = wheel or TimerWheel()
+        # (room_id, conn_id) -> connection state
+        self.entries: Dict[Tuple[str, Hashable], dict] = {}
+        # room_id -> {"joined": {user_id: info}, "left": set(user_id)}
+        self._changes: Dict[str, dict] = {}
+        self._task: Optional[asyncio.Task] = None
+
+        # Stats
+        self.pings_sent = 0
+        self.reaped = 0
+
+    def register(self, room_id: str, conn_id: Hashable, user_id: str, websocket, info: dict = None):
+        """Start tracking a connection and queue a join event"""
+        now = time.monotonic()
+        key = (room_id, conn_id)
+        self.entries[key] = {
+            "user_id": user_id,
+            "websocket": websocket,
+            "joined_at": now,
+            "last_seen": now,
+            "pinged": False,
+            "next_reward_at": now + REWARD_INTERVAL
+        }
+        self.wheel.schedule(key, PING_INTERVAL)
+        self._queue_change(room_id, user_id, joined=info or {"user_id": user_id})
+        self._ensure_task()
+
+    def unregister(self, room_id: str, conn_id: Hashable, websocket=None) -> bool:
+        """
+        Stop tracking a connection and queue a leave event
+        Returns False if it was not tracked (or was replaced by a newer socket)
+        """
+        key = (room_id, conn_id)
+        entry = self.entries.get(key)
+        if entry is None or (websocket is not None and entry["websocket"] is not websocket):
+            return False
+        del self.entries[key]
+        self.wheel.cancel(key)
+        self._queue_change(room_id, entry["user_id"], left=True)
+        return True
+
+    def touch(self, room_id: str, conn_id: Hashable):
+        """Record inbound activity (O(1), no rescheduling)"""
+        entry = self.entries.get((room_id, conn_id))
+        if entry is not None:
+            entry["last_seen"] = time.monotonic()
+            entry["pinged"] = False
+
+    def time_in_room(self, room_id: str, conn_id: Hashable) -> float:
+        """Seconds since the connection joined the room"""
+        entry = self.entries.get((room_id, conn_id))
+        if entry is None:
+            return 0.0
+        return time.monotonic() - entry["joined_at"]
+
+    def room_count(self, room_id: str) -> int:
+        return sum(1 for (r, _) in self.entries if r == room_id)
+
+    def get_stats(self) -> dict:
+        return {
+            "connections": len(self.entries),
+            "timers": len(self.wheel),
+            "pings_sent": self.pings_sent,
+            "reaped": self.reaped
+        }
+
+    def _queue_change(self, room_id: str, user_id: str, joined: dict = None, left: bool = False):
+        changes = self._changes.setdefault(room_id, {"joined": {}, "left": set()})
+        if joined is not None:
+            changes["left"].discard(user_id)
+            changes["joined"][user_id] = joined
+        elif left:
+            # Joined and left within the same tick: nobody needs to hear about it
+            if changes["joined"].pop(user_id, None) is None:
+                changes["left"].add(user_id)
+
+    def _ensure_task(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        """Single driver task for all connections of this manager"""
+        started = time.monotonic()
+        ticks_done = 0
+        while self.entries or self._changes:
+            ticks_done += 1
+            delay = started + ticks_done * self.wheel.tick - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            try:
+                for key in self.wheel.advance():
+                    await self._on_timer(key)
+                await self._flush_changes()
+            except Exception as e:
+                logger.error(f"Presence tick error: {e}")
+
+    async def _on_timer(self, key: Tuple[str, Hashable]):
+        entry = self.entries.get(key)
+        if entry is None:
+            return
+        room_id, conn_id = key
+        now = time.monotonic()
+        idle = now - entry["last_seen"]
+
+        if idle >= IDLE_TIMEOUT:
+            self.reaped += 1
+            logger.info(f"Reaping idle connection {conn_id} in room {room_id} ({idle:.0f}s idle)")
+            await self._reap(room_id, conn_id, entry["websocket"])
+            self.unregister(room_id, conn_id, entry["websocket"])
+            return
+
+        if idle >= PING_INTERVAL and not entry["pinged"]:
+            entry["pinged"] = True
+            self.pings_sent += 1
+            try:
+                await entry["websocket"].send_json({"type": "ping"})
+            except Exception:
+                await self._reap(room_id, conn_id, entry["websocket"])
+                self.unregister(room_id, conn_id, entry["websocket"])
+                return
+
+        if now >= entry["next_reward_at"]:
+            entry["next_reward_at"] += REWARD_INTERVAL
+            if self._on_reward:
+                self._on_reward(room_id, entry["user_id"])
+
+        # Re-arm at the earliest of: next ping, reap deadline, next reward
+        if entry["pinged"]:
+            next_check = entry["last_seen"] + IDLE_TIMEOUT
+        else:
+            next_check = entry["last_seen"] + PING_INTERVAL
+        next_check = min(next_check, entry["next_reward_at"])
+        self.wheel.schedule(key, next_check - now)
+
+    async def _flush_changes(self):
+        changes, self._changes = self._changes, {}
+        for room_id, change in changes.items():
+            if not change["joined"] and not change["left"]:
+                continue
+            await self._broadcast_presence(
+                room_id,
+                list(change["joined"].values()),
+                list(change["left"])
+            )
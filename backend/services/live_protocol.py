@@ -0,0 +1,238 @@
+"""
+Live Room Wire Protocol
+Per-connection frame encoding for live-room WebSockets: JSON text
+frames (default) or compact MessagePack binary frames with integer
+field tags for high-frequency events
+"""
+import json
+import logging
+from typing import Any, Dict, Optional, Union
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+try:
+    import msgpack
+except ImportError:  # Binary protocol disabled; every client gets JSON
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+JSON = "json"
+MSGPACK = "msgpack"
+
+# Sec-WebSocket-Protocol values clients may offer
+SUBPROTOCOLS = {
+    "fomo.msgpack.v1": MSGPACK,
+    "fomo.json.v1": JSON,
+}
+
+# Binary frames replace these "type" values with integers...
+TYPE_TAGS = {
+    "ping": 1,
+    "pong": 2,
+    "room_tick": 3,
+    "presence": 4,
+    "chat_message": 5,
+    "hand_raised_update": 6,
+    "reaction": 7,
+    "chat": 8,
+    "hand_raise": 9,
+    "speaking_status": 10,
+    "room_state": 11,
+    "room_data": 12,
+    "rate_limited": 13,
+    "hand_raise_queue": 14,
+}
+
+# ...and these field names with integers (top level and inside TAGGED_CONTAINERS)
+FIELD_TAGS = {
+    "type": 0,
+    "timestamp": 1,
+    "reactions": 2,
+    "speaking": 3,
+    "joined": 4,
+    "left": 5,
+    "stats": 6,
+    "total_participants": 7,
+    "speakers_count": 8,
+    "listeners_count": 9,
+    "hand_raised_count": 10,
+    "user_id": 11,
+    "username": 12,
+    "role": 13,
+    "message": 14,
+    "emoji": 15,
+    "action": 16,
+    "is_speaking": 17,
+    "hand_raised": 18,
+    "id": 19,
+}
+
+# Fields whose nested dict keys are schema names (not user data) and get tagged too
+TAGGED_CONTAINERS = {"stats", "joined", "message"}
+
+_TYPE_NAMES = {v: k for k, v in TYPE_TAGS.items()}
+_FIELD_NAMES = {v: k for k, v in FIELD_TAGS.items()}
+
+
+def msgpack_available() -> bool:
+    return msgpack is not None
+
+
+def _tag_keys(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {FIELD_TAGS.get(k, k): v for k, v in value.items()}
+    if isinstance(value, list):
+        return [_tag_keys(v) for v in value]
+    return value
+
+
+def _untag_keys(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {_FIELD_NAMES.get(k, k): v for k, v in value.items()}
+    if isinstance(value, list):
+        return [_untag_keys(v) for v in value]
+    return value
+
+
+def compact(message: dict) -> dict:
+    """Replace known field names / type values with integer tags"""
+    out = {}
+    for key, value in message.items():
+        if key == "type":
+            value = TYPE_TAGS.get(value, value)
+        elif key in TAGGED_CONTAINERS:
+            value = _tag_keys(value)
+        out[FIELD_TAGS.get(key, key)] = value
+    return out
+
+
+def expand(message: dict) -> dict:
+    """Inverse of compact(); untagged keys pass through unchanged"""
+    out = {}
+    for key, value in message.items():
+        name = _FIELD_NAMES.get(key, key)
+        if name == "type":
+            value = _TYPE_NAMES.get(value, value)
+        elif name in TAGGED_CONTAINERS:
+            value = _untag_keys(value)
+        out[name] = value
+    return out
+
+
+def encode_frame(message: dict, encoding: str) -> Union[str, bytes]:
+    """Encode a message for the wire (str = text frame, bytes = binary frame)"""
+    if encoding == MSGPACK:
+        return msgpack.packb(compact(message), use_bin_type=True)
+    # Same format as Starlette's send_json
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+
+def decode_frame(frame: Union[str, bytes]) -> Optional[dict]:
+    """Decode an inbound frame; returns None for malformed input"""
+    try:
+        if isinstance(frame, bytes):
+            if msgpack is None:
+                return None
+            message = msgpack.unpackb(frame, raw=False, strict_map_key=False)
+            return expand(message) if isinstance(message, dict) else None
+        message = json.loads(frame)
+        return message if isinstance(message, dict) else None
+    except Exception:
+        return None
+
+
+class LiveSocket:
+    """
+    WebSocket plus its negotiated encoding
+
+    Room managers store these instead of raw WebSockets so a broadcast
+    can encode each message once per encoding and reuse the frame.
+    """
+
+    __slots__ = ("websocket", "encoding")
+
+    def __init__(self, websocket: WebSocket, encoding: str = JSON):
+        self.websocket = websocket
+        self.encoding = encoding
+
+    async def send_frame(self, frame: Union[str, bytes]):
+        if isinstance(frame, bytes):
+            await self.websocket.send_bytes(frame)
+        else:
+            await self.websocket.send_text(frame)
+
+    async def send_json(self, message: dict):
+        """Send a message in this connection's encoding"""
+        await self.send_frame(encode_frame(message, self.encoding))
+
+    async def receive(self) -> Optional[dict]:
+        """
+        Receive one message (text or binary)
+        Returns None for frames that can't be decoded
+        """
+        event = await self.websocket.receive()
+        if event["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(event.get("code", 1000))
+        if event.get("bytes") is not None:
+            return decode_frame(event["bytes"])
+        return decode_frame(event.get("text") or "")
+
+    async def close(self, code: int = 1000):
+        await self.websocket.close(code=code)
+
+
+class FrameCache:
+    """Encodes one broadcast message at most once per encoding"""
+
+    __slots__ = ("message", "frames")
+
+    def __init__(self, message: dict):
+        self.message = message
+        self.frames: Dict[str, Union[str, bytes]] = {}
+
+    def get(self, encoding: str) -> Union[str, bytes]:
+        frame = self.frames.get(encoding)
+        if frame is None:
+            frame = self.frames[encoding] = encode_frame(self.message, encoding)
+        return frame
+
+
+def negotiate(websocket: WebSocket) -> tuple:
+    """
+    Pick an encoding from the `encoding` query param or offered subprotocols
+
+    Returns:
+        (encoding, subprotocol to echo back or None)
+    """
+    offered = websocket.scope.get("subprotocols") or []
+    # Prefer binary whenever it is offered and available
+    for preferred in (MSGPACK, JSON):
+        if preferred == MSGPACK and msgpack is None:
+            continue
+        for name in offered:
+            if SUBPROTOCOLS.get(name) == preferred:
+                return preferred, name
+
+    if websocket.query_params.get("encoding") == MSGPACK and msgpack is not None:
+        return MSGPACK, None
+    return JSON, None
+
+
+async def accept(websocket: WebSocket) -> LiveSocket:
+    """Accept a live-room WebSocket with the negotiated encoding"""
+    encoding, subprotocol = negotiate(websocket)
+    await websocket.accept(subprotocol=subprotocol)
+    return LiveSocket(websocket, encoding)
+
+
+def describe() -> dict:
+    """Tag tables for clients building a binary decoder"""
+    return {
+        "encodings": [JSON, MSGPACK] if msgpack is not None else [JSON],
+        "subprotocols": list(SUBPROTOCOLS.keys()),
+        "query_param": "encoding=msgpack",
+        "type_tags": TYPE_TAGS,
+        "field_tags": FIELD_TAGS,
+        "tagged_containers": sorted(TAGGED_CONTAINERS)
+    }
@@ -0,0 +1,207 @@
+"""
+Live Room Rate Limiter
+Per-user, per-message-type token buckets for inbound live-room frames,
+with reject / drop / delay policies and throttle counters
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+REJECT = "reject"  # skip the frame and tell the client (rate_limited frame)
+DROP = "drop"      # skip the frame silently
+DELAY = "delay"    # hold the connection's read loop until a token is available
+POLICIES = (REJECT, DROP, DELAY)
+
+# Never hold a connection longer than this under the delay policy;
+# frames that would need a longer wait are dropped instead
+MAX_DELAY = 2.0
+# Sweep refilled buckets once the table grows past this many entries...
+SWEEP_THRESHOLD = 10000
+# ...but not more often than this (seconds)
+SWEEP_INTERVAL = 30.0
+
+
+class BucketSpec(NamedTuple):
+    rate: float   # tokens per second
+    burst: int    # bucket capacity
+    policy: str
+
+
+def _parse_rate_limits(raw: str) -> Dict[str, BucketSpec]:
+    """
+    Parse "type:rate:burst:policy" entries, e.g. "chat:1:5:reject,reaction:5:20:drop"
+    Type "*" sets the default for message types without their own entry
+    """
+    limits = {}
+    for part in raw.split(","):
+        if not part.strip():
+            continue
+        msg_type, rate, burst, policy = part.strip().split(":")
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown rate limit policy: {policy}")
+        limits[msg_type] = BucketSpec(float(rate), int(burst), policy)
+    return limits
+
+
+# Both live-room sockets share these (their message names differ slightly)
+DEFAULT_RATE_LIMITS = {
+    "chat": BucketSpec(1.0, 5, REJECT),
+    "chat_message": BucketSpec(1.0, 5, REJECT),
+    "reaction": BucketSpec(5.0, 20, DROP),
+    "hand_raise": BucketSpec(0.5, 3, DROP),
+    "speaking_status": BucketSpec(10.0, 20, DELAY),
+    "promote": BucketSpec(1.0, 5, REJECT),
+    "promote_user": BucketSpec(1.0, 5, REJECT),
+    "demote": BucketSpec(1.0, 5, REJECT),
+    "demote_user": BucketSpec(1.0, 5, REJECT),
+    "ping": BucketSpec(1.0, 5, DROP),
+    "pong": BucketSpec(1.0, 5, DROP),
+    "*": BucketSpec(10.0, 20, DROP),
+}
+
+RATE_LIMITS = {
+    **DEFAULT_RATE_LIMITS,
+    **_parse_rate_limits(os.environ.get("LIVE_RATE_LIMITS", ""))
+}
+
+
+class TokenBucketStore:
+    """
+    In-process bucket table: (user_id, message_type) -> (tokens, updated_at)
+
+    take() is the only operation the limiter needs, so a shared store
+    (e.g. a Redis script with the same arithmetic) can be swapped in via
+    LiveRateLimiter(store=...) when running several workers.
+    """
+
+    def __init__(self):
+        self._buckets: Dict[Tuple[str, str], Tuple[float, float]] = {}
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def take(self, key: Tuple[str, str], spec: BucketSpec, now: float, max_debt: float = 0.0) -> float:
+        """
+        Take one token from a bucket
+
+        Args:
+            key: (user_id, message_type)
+            spec: Bucket rate / capacity
+            now: Monotonic time
+            max_debt: Seconds of future refill the caller may borrow (delay policy)
+
+        Returns:
+            0 if a token was available, otherwise seconds until it will be
+            (the token is only taken when that wait is within max_debt)
+        """
+        tokens, updated_at = self._buckets.get(key, (spec.burst, now))
+        tokens = min(spec.burst, tokens + (now - updated_at) * spec.rate)
+
+        if tokens >= 1:
+            self._buckets[key] = (tokens - 1, now)
+            return 0.0
+
+        wait = (1 - tokens) / spec.rate
+        if wait <= max_debt:
+            # Borrow: later frames queue up behind this one
+            tokens -= 1
+        self._buckets[key] = (tokens, now)
+        return wait
+
+    def sweep(self, now: float, limits: Dict[str, BucketSpec]):
+        """Forget buckets that have refilled completely (same as a fresh bucket)"""
+        default = limits["*"]
+        self._buckets = {
+            key: (tokens, updated_at)
+            for key, (tokens, updated_at) in self._buckets.items()
+            if tokens + (now - updated_at) * limits.get(key[1], default).rate
+            < limits.get(key[1], default).burst
+        }
+
+
+class LiveRateLimiter:
+    """
+    Gate for inbound live-room frames
+
+    admit() is awaited by the socket loop before a frame is handled.
+    Buckets are keyed by user, not connection, so reconnecting or
+    opening several sockets doesn't reset a user's budget.
+    """
+
+    def __init__(self, limits: Optional[Dict[str, BucketSpec]] = None, store: Optional[TokenBucketStore] = None):
+        self.limits = limits or RATE_LIMITS
+        self.store = store or TokenBucketStore()
+        # message_type -> {"allowed", "rejected", "dropped", "delayed"}
+        self.counters: Dict[str, Dict[str, int]] = {}
+        self._last_sweep = 0.0
+
+    async def admit(self, user_id: str, msg_type: str, conn=None) -> bool:
+        """
+        Check (and apply) the rate limit for one inbound frame
+
+        Args:
+            user_id: Sender
+            msg_type: Frame "type"
+            conn: Sender's socket, used to send the rate_limited notice
+
+        Returns:
+            True if the frame should be handled
+        """
+        if not isinstance(msg_type, str) or msg_type not in self.limits:
+            # Unknown / client-chosen types share one bucket per user
+            msg_type = "*"
+        spec = self.limits[msg_type]
+        now = time.monotonic()
+        max_debt = MAX_DELAY if spec.policy == DELAY else 0.0
+        wait = self.store.take((user_id, msg_type), spec, now, max_debt)
+
+        if len(self.store) > SWEEP_THRESHOLD and now - self._last_sweep >= SWEEP_INTERVAL:
+            self._last_sweep = now
+            self.store.sweep(now, self.limits)
+
+        if wait == 0:
+            self._count(msg_type, "allowed")
+            return True
+
+        if spec.policy == DELAY and wait <= MAX_DELAY:
+            self._count(msg_type, "delayed")
+            await asyncio.sleep(wait)
+            return True
+
+        if spec.policy == REJECT:
+            self._count(msg_type, "rejected")
+            if conn is not None:
+                try:
+                    await conn.send_json({
+                        "type": "rate_limited",
+                        "message_type": msg_type,
+                        "retry_after": round(wait, 2)
+                    })
+                except Exception:
+                    pass
+            return False
+
+        self._count(msg_type, "dropped")
+        return False
+
+    def get_stats(self) -> dict:
+        return {
+            "buckets": len(self.store),
+            "by_type": self.counters
+        }
+
+    def _count(self, msg_type: str, outcome: str):
+        counters = self.counters.get(msg_type)
+        if counters is None:
+            counters = self.counters[msg_type] = {
+                "allowed": 0, "rejected": 0, "dropped": 0, "delayed": 0
+            }
+        counters[outcome] += 1
+
+
+# Global instance shared by both live-room sockets
+live_rate_limiter = LiveRateLimiter()
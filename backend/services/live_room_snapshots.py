@@ -0,0 +1,158 @@
+"""
+Live Room Snapshot Service
+Periodically writes the recoverable part of each live room (roles,
+hand-raise order, recent chat, counters) so rooms survive an API
+restart, and loads it back when the first client reconnects
+"""
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+from pymongo import DeleteOne, UpdateOne
+
+from services.live_chat_log import RING_BUFFER_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Seconds between snapshot writes
+SNAPSHOT_INTERVAL = 5.0
+# Snapshots of rooms nobody reconnects to are removed by a TTL index
+SNAPSHOT_TTL_SECONDS = 24 * 3600
+
+
+class RoomSnapshotService:
+    """
+    Incremental snapshots in the `live_room_snapshots` collection
+
+    - mark() only flags a room dirty; nothing is written on the caller's path
+    - Every SNAPSHOT_INTERVAL, dirty rooms are written with one bulk_write:
+      $set for roles / hand-raise order / counters, and $push with $slice
+      for chat messages added since the previous snapshot
+    - load() is single-flight, so a reconnect storm costs one query per room
+    """
+
+    def __init__(self, get_state: Callable[[str], Optional[dict]], db=None):
+        """
+        Args:
+            get_state: Returns {"roles", "hand_raised", "counters"} for a
+                room, or None if the room no longer exists
+        """
+        self.db = db
+        self._get_state = get_state
+        self._dirty: set = set()
+        # session_id -> chat messages not yet snapshotted
+        self._new_chat: Dict[str, List[dict]] = {}
+        self._discarded: set = set()
+        self._loading: Dict[str, asyncio.Future] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._indexes_ready = False
+
+        # Stats
+        self.writes = 0
+        self.restored = 0
+
+    def set_db(self, db):
+        self.db = db
+
+    def mark(self, session_id: str):
+        """Flag a room's roles / hand-raise order / counters as changed"""
+        self._dirty.add(session_id)
+        self._discarded.discard(session_id)
+        self._ensure_task()
+
+    def add_chat(self, session_id: str, message: dict):
+        """Queue a chat message for the next snapshot"""
+        self._new_chat.setdefault(session_id, []).append(message)
+        self.mark(session_id)
+
+    def discard(self, session_id: str):
+        """Delete a room's snapshot (session ended; nothing to recover)"""
+        self._dirty.discard(session_id)
+        self._new_chat.pop(session_id, None)
+        self._discarded.add(session_id)
+        self._ensure_task()
+
+    async def load(self, session_id: str) -> Optional[dict]:
+        """Latest snapshot of a room, or None"""
+        if self.db is None:
+            return None
+
+        pending = self._loading.get(session_id)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._loading[session_id] = future
+        try:
+            snapshot = await self.db.live_room_snapshots.find_one(
+                {"session_id": session_id}, {"_id": 0}
+            )
+            if snapshot:
+                self.restored += 1
+            future.set_result(snapshot)
+            return snapshot
+        except Exception as e:
+            logger.error(f"Snapshot load error for {session_id}: {e}")
+            future.set_result(None)
+            return None
+        finally:
+            del self._loading[session_id]
+
+    async def flush(self):
+        """Write snapshots for every dirty room"""
+        if self.db is None or not (self._dirty or self._discarded):
+            return
+
+        dirty, self._dirty = self._dirty, set()
+        new_chat, self._new_chat = self._new_chat, {}
+        discarded, self._discarded = self._discarded, set()
+        now = datetime.now(timezone.utc)
+
+        ops = [DeleteOne({"session_id": session_id}) for session_id in discarded]
+        for session_id in dirty:
+            state = self._get_state(session_id)
+            if state is None:
+                continue
+            update = {"$set": {**state, "updated_at": now}}
+            messages = new_chat.get(session_id)
+            if messages:
+                update["$push"] = {
+                    "chat_messages": {"$each": messages, "$slice": -RING_BUFFER_SIZE}
+                }
+            ops.append(UpdateOne({"session_id": session_id}, update, upsert=True))
+
+        if not ops:
+            return
+        try:
+            if not self._indexes_ready:
+                await self.db.live_room_snapshots.create_index("session_id", unique=True)
+                await self.db.live_room_snapshots.create_index(
+                    "updated_at", expireAfterSeconds=SNAPSHOT_TTL_SECONDS
+                )
+                self._indexes_ready = True
+            await self.db.live_room_snapshots.bulk_write(ops, ordered=False)
+            self.writes += len(ops)
+        except Exception as e:
+            logger.error(f"Room snapshot flush error ({len(ops)} rooms): {e}")
+
+    async def close(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+        await self.flush()
+
+    def get_stats(self) -> dict:
+        return {
+            "dirty_rooms": len(self._dirty),
+            "writes": self.writes,
+            "restored": self.restored
+        }
+
+    def _ensure_task(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while self._dirty or self._discarded:
+            await asyncio.sleep(SNAPSHOT_INTERVAL)
+            await self.flush()
@@ -0,0 +1,165 @@
+"""
+Live Session Registry
+In-memory cache of live session status/config so WebSocket connects
+don't query MongoDB; kept fresh by explicit invalidation from the
+session routes and, on replica sets, a change stream
+"""
+import asyncio
+import logging
+import time
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Safety net for writers that bypass invalidation (e.g. the recording bot
+# process) when change streams are unavailable
+POSITIVE_TTL = 30.0
+# How long an unknown session id is remembered as missing
+NEGATIVE_TTL = 10.0
+# Bound on cached entries (oldest are evicted first)
+MAX_ENTRIES = 5000
+
+# Only what connect-time checks and room setup need
+SESSION_PROJECTION = {
+    "_id": 0,
+    "id": 1,
+    "title": 1,
+    "status": 1,
+    "is_live": 1,
+    "author_id": 1,
+    "telegram_channel_id": 1,
+    "scheduled_at": 1,
+    "started_at": 1,
+    "ended_at": 1,
+}
+
+# Statuses that accept WebSocket connections
+JOINABLE_STATUSES = ("scheduled", "live", "active")
+
+
+class LiveSessionRegistry:
+    """
+    Cache of live_sessions documents (projected)
+
+    - get() serves hits from memory; misses for the same id share one query
+    - Unknown ids are cached as None for NEGATIVE_TTL
+    - invalidate()/put() are called by every route that writes a session
+    """
+
+    def __init__(self, db=None):
+        self.db = db
+        # session_id -> (session or None, expires_at)
+        self._entries: Dict[str, Tuple[Optional[dict], float]] = {}
+        self._loading: Dict[str, asyncio.Future] = {}
+        self._watch_task: Optional[asyncio.Task] = None
+
+        # Stats
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def set_db(self, db):
+        self.db = db
+
+    async def get(self, session_id: str) -> Optional[dict]:
+        """
+        Get a session (projected with SESSION_PROJECTION)
+
+        Returns:
+            The cached session, or None if it does not exist
+        """
+        entry = self._entries.get(session_id)
+        if entry is not None and entry[1] > time.monotonic():
+            if entry[0] is None:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+            return entry[0]
+
+        # Connect storm: one query per id, everyone else awaits it
+        pending = self._loading.get(session_id)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._loading[session_id] = future
+        try:
+            session = await self.db.live_sessions.find_one({"id": session_id}, SESSION_PROJECTION)
+            # An invalidation that raced the query wins; don't cache stale data
+            if self._loading.get(session_id) is future:
+                self._store(session_id, session)
+            future.set_result(session)
+            return session
+        except Exception as e:
+            future.set_exception(e)
+            # Waiters re-raise it; mark it retrieved in case there are none
+            future.exception()
+            raise
+        finally:
+            if self._loading.get(session_id) is future:
+                del self._loading[session_id]
+
+    async def is_joinable(self, session_id: str) -> bool:
+        session = await self.get(session_id)
+        return bool(session) and session.get("status") in JOINABLE_STATUSES
+
+    def put(self, session: dict):
+        """Cache a session document that was just written"""
+        self._store(session["id"], {k: session.get(k) for k in SESSION_PROJECTION if k != "_id"})
+
+    def invalidate(self, session_id: str):
+        """Forget a session; the next get() reloads it"""
+        self.invalidations += 1
+        self._entries.pop(session_id, None)
+        # A query already in flight may return pre-write data
+        self._loading.pop(session_id, None)
+
+    def start_watch(self):
+        """Follow live_sessions changes from other workers (replica sets only)"""
+        if self._watch_task is None or self._watch_task.done():
+            self._watch_task = asyncio.create_task(self._watch())
+
+    async def close(self):
+        if self._watch_task and not self._watch_task.done():
+            self._watch_task.cancel()
+
+    def get_stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "watching": self._watch_task is not None and not self._watch_task.done()
+        }
+
+    def _store(self, session_id: str, session: Optional[dict]):
+        ttl = POSITIVE_TTL if session is not None else NEGATIVE_TTL
+        self._entries.pop(session_id, None)
+        self._entries[session_id] = (session, time.monotonic() + ttl)
+        while len(self._entries) > MAX_ENTRIES:
+            del self._entries[next(iter(self._entries))]
+
+    async def _watch(self):
+        try:
+            async with self.db.live_sessions.watch(full_document="updateLookup") as stream:
+                logger.info("Live session registry following change stream")
+                async for change in stream:
+                    doc = change.get("fullDocument")
+                    if doc and doc.get("id"):
+                        self.put(doc)
+                    else:
+                        # Deletes only carry _id; entries are keyed by "id"
+                        self._entries.clear()
+                        self.invalidations += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Standalone mongod: no change streams, TTLs keep entries bounded
+            logger.info(f"Live session change stream unavailable ({e}); using TTL expiry")
+
+
+# Global instance (database is set from routes.live_sessions.set_db)
+live_session_registry = LiveSessionRegistry()
@@ -0,0 +1,222 @@
+"""
+Live Session Timeline Recorder
+Samples concurrency and activity of every live room every few seconds
+into compact arrays and stores one timeline document per session
+"""
+import asyncio
+import logging
+import time
+from array import array
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Seconds between samples
+SAMPLE_INTERVAL = 5.0
+# Stop recording a room that has been empty this long without being ended
+IDLE_STOP_SECONDS = 600.0
+
+SERIES = ("listeners", "speakers", "chat_messages", "reactions")
+
+
+class TimelineSegment:
+    """
+    One uninterrupted recording (a restart starts a new segment)
+
+    Each series is an array('I'): 4 bytes per sample, so a 3-hour show
+    at 5s resolution is ~8.6 KB for all four series.
+    """
+
+    __slots__ = ("started_at", "series", "last_totals", "empty_since")
+
+    def __init__(self, chat_total: int, reaction_total: int):
+        self.started_at = datetime.now(timezone.utc)
+        self.series = {name: array("I") for name in SERIES}
+        # Counters are cumulative; samples store per-interval deltas
+        self.last_totals = (chat_total, reaction_total)
+        self.empty_since: Optional[float] = None
+
+    def __len__(self):
+        return len(self.series["listeners"])
+
+    def add(self, listeners: int, speakers: int, chat_total: int, reaction_total: int):
+        last_chat, last_reactions = self.last_totals
+        self.series["listeners"].append(listeners)
+        self.series["speakers"].append(speakers)
+        self.series["chat_messages"].append(max(0, chat_total - last_chat))
+        self.series["reactions"].append(max(0, reaction_total - last_reactions))
+        self.last_totals = (chat_total, reaction_total)
+
+    def to_doc(self) -> dict:
+        return {
+            "started_at": self.started_at,
+            "interval": SAMPLE_INTERVAL,
+            **{name: values.tolist() for name, values in self.series.items()}
+        }
+
+
+def summarize(segments: List[dict]) -> dict:
+    """
+    Flatten timeline segments into points plus peak / drop-off figures
+
+    Rates are per minute; "t" is the sample time (ISO).
+    """
+    points = []
+    for segment in segments:
+        started_at = segment["started_at"]
+        if started_at.tzinfo is None:
+            started_at = started_at.replace(tzinfo=timezone.utc)
+        interval = segment.get("interval", SAMPLE_INTERVAL)
+        per_minute = 60.0 / interval
+        for idx in range(len(segment["listeners"])):
+            points.append({
+                "t": (started_at + timedelta(seconds=interval * (idx + 1))).isoformat(),
+                "listeners": segment["listeners"][idx],
+                "speakers": segment["speakers"][idx],
+                "chat_per_min": round(segment["chat_messages"][idx] * per_minute, 1),
+                "reactions_per_min": round(segment["reactions"][idx] * per_minute, 1)
+            })
+
+    if not points:
+        return {
+            "points": [],
+            "peak_participants": 0,
+            "peak_listeners": 0,
+            "peak_at": None,
+            "average_listeners": 0,
+            "final_listeners": 0
+        }
+
+    peak = max(points, key=lambda p: p["listeners"] + p["speakers"])
+    return {
+        "points": points,
+        "peak_participants": peak["listeners"] + peak["speakers"],
+        "peak_listeners": max(p["listeners"] for p in points),
+        "peak_at": peak["t"],
+        "average_listeners": round(sum(p["listeners"] for p in points) / len(points), 1),
+        "final_listeners": points[-1]["listeners"]
+    }
+
+
+class TimelineRecorder:
+    """
+    Samples all tracked rooms from one background task
+
+    - track() is called on every room join (cheap after the first)
+    - Nothing is written while a session runs; finish() (session end) or
+      close() (shutdown) appends the segment to `live_session_timelines`
+    """
+
+    def __init__(self, get_sample: Callable[[str], Optional[Tuple[int, int, int, int]]], db=None):
+        """
+        Args:
+            get_sample: Returns (listeners, speakers, chat total, reaction total)
+                for a room, or None if the room is gone
+        """
+        self.db = db
+        self._get_sample = get_sample
+        self._segments: Dict[str, TimelineSegment] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def set_db(self, db):
+        self.db = db
+
+    def track(self, session_id: str):
+        """Start recording a room (no-op if it is already recorded)"""
+        if session_id in self._segments:
+            return
+        sample = self._get_sample(session_id)
+        if sample is None:
+            return
+        self._segments[session_id] = TimelineSegment(sample[2], sample[3])
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def finish(self, session_id: str) -> dict:
+        """
+        Stop recording a session, store its segment and return the summary
+        of the whole timeline
+        """
+        segment = self._segments.pop(session_id, None)
+        if segment is not None:
+            await self._store(session_id, [segment])
+        return summarize(await self._stored_segments(session_id))
+
+    async def timeline(self, session_id: str) -> dict:
+        """Stored segments plus the one being recorded"""
+        segments = await self._stored_segments(session_id)
+        segment = self._segments.get(session_id)
+        if segment is not None and len(segment):
+            segments.append(segment.to_doc())
+        return summarize(segments)
+
+    def is_recording(self, session_id: str) -> bool:
+        return session_id in self._segments
+
+    async def close(self):
+        """Store in-progress segments (a restart continues in a new segment)"""
+        if self._task and not self._task.done():
+            self._task.cancel()
+        segments, self._segments = self._segments, {}
+        for session_id, segment in segments.items():
+            await self._store(session_id, [segment])
+
+    async def _store(self, session_id: str, segments: List[TimelineSegment]):
+        segments = [s for s in segments if len(s)]
+        if self.db is None or not segments:
+            return
+        peak = max(
+            max(a + b for a, b in zip(s.series["listeners"], s.series["speakers"]))
+            for s in segments
+        )
+        try:
+            await self.db.live_session_timelines.update_one(
+                {"session_id": session_id},
+                {
+                    "$push": {"segments": {"$each": [s.to_doc() for s in segments]}},
+                    "$max": {"peak_participants": peak},
+                    "$set": {"updated_at": datetime.now(timezone.utc)}
+                },
+                upsert=True
+            )
+        except Exception as e:
+            logger.error(f"Timeline store error for {session_id}: {e}")
+
+    async def _stored_segments(self, session_id: str) -> List[dict]:
+        if self.db is None:
+            return []
+        doc = await self.db.live_session_timelines.find_one(
+            {"session_id": session_id}, {"_id": 0, "segments": 1}
+        )
+        return list(doc.get("segments", [])) if doc else []
+
+    async def _run(self):
+        started = time.monotonic()
+        ticks = 0
+        while self._segments:
+            ticks += 1
+            delay = started + ticks * SAMPLE_INTERVAL - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            now = time.monotonic()
+            stale = []
+            for session_id, segment in list(self._segments.items()):
+                sample = self._get_sample(session_id)
+                if sample is None:
+                    stale.append(session_id)
+                    continue
+                segment.add(*sample)
+
+                if sample[0] + sample[1] == 0:
+                    segment.empty_since = segment.empty_since or now
+                    if now - segment.empty_since >= IDLE_STOP_SECONDS:
+                        stale.append(session_id)
+                else:
+                    segment.empty_since = None
+
+            for session_id in stale:
+                segment = self._segments.pop(session_id, None)
+                if segment is not None:
+                    await self._store(session_id, [segment])
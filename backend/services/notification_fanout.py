@@ -0,0 +1,274 @@
+"""
+Notification Fan-out
+Writes one in-app notification per recipient for announcements to many
+users (new episode, live start): recipients are streamed from a cursor
+and notifications inserted in unordered batches, optionally pointing at
+one shared body instead of repeating the text N times
+"""
+import logging
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import AsyncIterator, Iterable, List, Optional, Union
+
+from pymongo.errors import BulkWriteError
+
+from services.notification_outbox import _iterate
+from services.unread_counters import unread_counters
+from services.user_channel import user_channel
+
+logger = logging.getLogger(__name__)
+
+# Follower ids fetched per cursor batch
+CURSOR_BATCH_SIZE = 1000
+# Notifications written per insert_many
+INSERT_BATCH_SIZE = 1000
+# Finished fan-outs kept for the stats endpoint
+MAX_FINISHED_JOBS = 50
+
+# Fields moved to `notification_bodies` when the body is shared
+SHARED_FIELDS = ("title", "message", "link")
+
+
+class FanoutJob:
+    """Progress of one fan-out"""
+
+    def __init__(self, name: str, key: str, body_id: Optional[str] = None, notification: Optional[dict] = None):
+        self.id = str(uuid.uuid4())
+        self.name = name
+        self.key = key
+        self.body_id = body_id
+        # What recipients see (pushed to open user channels)
+        self.notification = notification or {}
+        self.written = 0
+        self.duplicates = 0
+        self.batches = 0
+        self.error: Optional[str] = None
+        self.created_at = datetime.now(timezone.utc)
+        self.finished_at: Optional[datetime] = None
+
+    @property
+    def status(self) -> str:
+        if self.finished_at is None:
+            return "running"
+        return "failed" if self.error else "completed"
+
+    def to_dict(self) -> dict:
+        elapsed = ((self.finished_at or datetime.now(timezone.utc)) - self.created_at).total_seconds()
+        return {
+            "id": self.id,
+            "name": self.name,
+            "key": self.key,
+            "status": self.status,
+            "written": self.written,
+            "duplicates": self.duplicates,
+            "batches": self.batches,
+            "body_id": self.body_id,
+            "per_second": round(self.written / elapsed) if elapsed > 0 else None,
+            "elapsed_seconds": round(elapsed, 1),
+            "error": self.error,
+            "created_at": self.created_at.isoformat(),
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None
+        }
+
+
+class NotificationFanout:
+    """
+    Fan-out-on-write for in-app notifications
+
+    - fan_out() never holds more than INSERT_BATCH_SIZE notifications
+    - Notification ids are derived from the fan-out key and the user, so
+      re-running a fan-out (outbox retry after a crash) skips users that
+      already got it instead of notifying them twice
+    - Runs as the `in_app_fanout` outbox job, off the request path
+    """
+
+    def __init__(self, db=None):
+        self.db = db
+        self.jobs: "OrderedDict[str, FanoutJob]" = OrderedDict()
+        self._indexes_ready = False
+
+    def set_db(self, db):
+        self.db = db
+
+    async def iter_followers(self, author_id: str) -> AsyncIterator[str]:
+        """Follower ids of an author, streamed in CURSOR_BATCH_SIZE batches"""
+        cursor = self.db.subscriptions.find(
+            {"author_id": author_id},
+            {"_id": 0, "follower_id": 1}
+        ).batch_size(CURSOR_BATCH_SIZE)
+        async for doc in cursor:
+            if doc.get("follower_id"):
+                yield doc["follower_id"]
+
+    async def fan_out(
+        self,
+        user_ids: Union[Iterable[str], AsyncIterator[str]],
+        notification: dict,
+        key: Optional[str] = None,
+        name: str = "fanout",
+        shared: bool = True
+    ) -> FanoutJob:
+        """
+        Write a notification for every recipient
+
+        Args:
+            user_ids: Recipient user ids (iterable or async iterator)
+            notification: title, message, type, link
+            key: Stable fan-out key (makes re-runs idempotent)
+            name: Label shown in stats
+            shared: Store title/message/link once in notification_bodies
+
+        Returns:
+            FanoutJob with the final counts
+        """
+        await self._ensure_indexes()
+        key = key or str(uuid.uuid4())
+        now = datetime.now(timezone.utc).isoformat()
+
+        template = {
+            "type": notification.get("type", "general"),
+            "is_read": False,
+            "created_at": now
+        }
+        body_id = None
+        if shared:
+            body_id = str(uuid.uuid5(uuid.NAMESPACE_URL, f"notification_body:{key}"))
+            await self.db.notification_bodies.update_one(
+                {"id": body_id},
+                {"$setOnInsert": {
+                    "id": body_id,
+                    **{f: notification.get(f) for f in SHARED_FIELDS},
+                    "type": template["type"],
+                    "created_at": now
+                }},
+                upsert=True
+            )
+            template["body_id"] = body_id
+        else:
+            template.update({f: notification.get(f) for f in SHARED_FIELDS})
+
+        job = FanoutJob(name, key, body_id, {
+            "type": template["type"],
+            **{f: notification.get(f) for f in SHARED_FIELDS}
+        })
+        self._remember(job)
+        batch: List[dict] = []
+        seen = set()
+        try:
+            async for user_id in _iterate(user_ids):
+                if not user_id or user_id in seen:
+                    continue
+                seen.add(user_id)
+                batch.append({
+                    "id": str(uuid.uuid5(uuid.NAMESPACE_URL, f"{key}:{user_id}")),
+                    "user_id": user_id,
+                    **template
+                })
+                if len(batch) >= INSERT_BATCH_SIZE:
+                    await self._insert(job, batch)
+                    batch = []
+            await self._insert(job, batch)
+        except Exception as e:
+            job.error = str(e)
+            raise
+        finally:
+            job.finished_at = datetime.now(timezone.utc)
+
+        logger.info(
+            f"🔔 Fan-out '{name}' wrote {job.written} notifications "
+            f"in {job.batches} batches ({job.to_dict()['elapsed_seconds']}s)"
+        )
+        return job
+
+    async def hydrate(self, notifications: List[dict]) -> List[dict]:
+        """Fill title/message/link of notifications that point at a shared body"""
+        body_ids = {n["body_id"] for n in notifications if n.get("body_id")}
+        if not body_ids:
+            return notifications
+        bodies = {
+            body["id"]: body
+            async for body in self.db.notification_bodies.find(
+                {"id": {"$in": list(body_ids)}},
+                {"_id": 0, "id": 1, **{f: 1 for f in SHARED_FIELDS}}
+            )
+        }
+        for notification in notifications:
+            body = bodies.get(notification.get("body_id"))
+            if body:
+                for field in SHARED_FIELDS:
+                    notification.setdefault(field, body.get(field))
+        return notifications
+
+    def get_job(self, job_id: str) -> Optional[FanoutJob]:
+        return self.jobs.get(job_id)
+
+    def get_stats(self) -> dict:
+        return {"jobs": [job.to_dict() for job in reversed(self.jobs.values())]}
+
+    async def run_outbox_job(self, job: dict) -> dict:
+        """
+        `in_app_fanout` outbox handler
+
+        payload: notification, name, shared and either user_ids or
+        author_id (all followers of the author)
+        """
+        payload = job["payload"]
+        if payload.get("user_ids") is not None:
+            recipients = payload["user_ids"]
+        else:
+            recipients = self.iter_followers(payload["author_id"])
+        result = await self.fan_out(
+            recipients,
+            payload["notification"],
+            key=job.get("idempotency_key") or job["id"],
+            name=payload.get("name", "fanout"),
+            shared=payload.get("shared", True)
+        )
+        return {"recipients": result.written + result.duplicates, "written": result.written}
+
+    async def _insert(self, job: FanoutJob, batch: List[dict]):
+        if not batch:
+            return
+        inserted = batch
+        try:
+            await self.db.notifications.insert_many(batch, ordered=False)
+        except BulkWriteError as e:
+            # Duplicates are users notified by an earlier run of this fan-out
+            errors = e.details.get("writeErrors", [])
+            if any(err.get("code") != 11000 for err in errors):
+                raise
+            failed = {err["index"] for err in errors}
+            inserted = [doc for i, doc in enumerate(batch) if i not in failed]
+            job.duplicates += len(errors)
+        job.written += len(inserted)
+        job.batches += 1
+        await unread_counters.notifications_added(doc["user_id"] for doc in inserted)
+        # One event for the whole batch (per-user ids differ, the content does not)
+        if inserted:
+            user_channel.publish([doc["user_id"] for doc in inserted], {
+                "type": "notification",
+                "notification": {**job.notification, "created_at": inserted[0]["created_at"]}
+            })
+
+    def _remember(self, job: FanoutJob):
+        self.jobs[job.id] = job
+        finished = [j for j in self.jobs.values() if j.status != "running"]
+        for old in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[old.id]
+
+    async def _ensure_indexes(self):
+        if self._indexes_ready:
+            return
+        try:
+            await self.db.notifications.create_index("id", unique=True)
+        except Exception as e:
+            # Legacy duplicate ids: re-runs may then notify a user twice
+            logger.warning(f"Could not create unique notifications.id index: {e}")
+        await self.db.notifications.create_index([("user_id", 1), ("created_at", -1)])
+        await self.db.notification_bodies.create_index("id", unique=True)
+        self._indexes_ready = True
+
+
+# Global instance
+notification_fanout = NotificationFanout()
@@ -0,0 +1,519 @@
+"""
+Notification Outbox
+Durable job queue in MongoDB for everything sent outside the request:
+Telegram messages and broadcasts, in-app notifications, web push and
+webhooks. Producers insert a job and return; a worker pool delivers it
+with leases, retries and exponential backoff, so a deploy or crash
+never drops half-sent fan-outs
+"""
+import asyncio
+import logging
+import os
+import random
+import socket
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional, Union
+
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+# Concurrent jobs per API process
+OUTBOX_WORKERS = int(os.environ.get("OUTBOX_WORKERS", "8"))
+# A job whose worker stopped renewing its lease is picked up again after this
+LEASE_SECONDS = 60
+# Idle workers poll this often (enqueue() on the same process wakes them at once)
+POLL_INTERVAL = 2.0
+# Default attempts before a job is marked failed
+MAX_ATTEMPTS = 5
+# Backoff: BACKOFF_BASE * 2^(attempt-1), capped, with jitter
+BACKOFF_BASE = 5.0
+MAX_BACKOFF = 600.0
+# Finished jobs (and their idempotency keys) are kept this long
+DONE_TTL_DAYS = 7
+# Fan-out children inserted per insert_many
+FANOUT_BATCH_SIZE = 1000
+
+
+class OutboxRetry(Exception):
+    """Delivery failed but may succeed later (optionally after retry_after seconds)"""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class OutboxPermanentError(Exception):
+    """Delivery can never succeed (blocked bot, gone endpoint); do not retry"""
+
+
+class NotificationOutbox:
+    """
+    Jobs live in the `notification_outbox` collection
+
+    - enqueue() is one insert; an idempotency key makes it safe to call twice
+    - Workers claim jobs with find_one_and_update (pending and due, or
+      processing with an expired lease) and renew the lease while running
+    - Failures are rescheduled with backoff until max_attempts
+    - Handlers are registered per job kind; Telegram, in-app and webhook
+      handlers are built in
+    """
+
+    def __init__(self, db=None, workers: int = OUTBOX_WORKERS):
+        self.db = db
+        self.workers = workers
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._handlers: Dict[str, Callable[[dict], Awaitable[Optional[dict]]]] = {
+            "telegram": self._deliver_telegram,
+            "telegram_broadcast": self._expand_telegram_broadcast,
+            "in_app": self._deliver_in_app,
+            "webhook": self._deliver_webhook,
+        }
+        # Named recipient lists for broadcasts, resolved at delivery time
+        self._audiences: Dict[str, Callable[..., Union[Awaitable[Iterable], AsyncIterator]]] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._indexes_ready = False
+
+        # Stats
+        self.enqueued = 0
+        self.duplicates = 0
+        self.delivered = 0
+        self.retried = 0
+        self.failed = 0
+
+    def set_db(self, db):
+        self.db = db
+
+    def register(self, kind: str, handler: Callable[[dict], Awaitable[Optional[dict]]]):
+        """
+        Register the delivery handler for a job kind
+
+        The handler receives the job document; raise OutboxRetry or any
+        exception to retry, OutboxPermanentError to fail immediately.
+        A returned dict is stored as the job's result.
+        """
+        self._handlers[kind] = handler
+
+    def register_audience(
+        self,
+        name: str,
+        resolver: Callable[..., Union[Awaitable[Iterable], AsyncIterator]]
+    ):
+        """
+        Register a recipient list usable as a telegram_broadcast audience
+
+        The resolver is either a coroutine returning chat ids or an async
+        generator yielding them.
+        """
+        self._audiences[name] = resolver
+
+    async def enqueue(
+        self,
+        kind: str,
+        payload: dict,
+        idempotency_key: Optional[str] = None,
+        delay: float = 0,
+        max_attempts: int = MAX_ATTEMPTS,
+        parent_id: Optional[str] = None
+    ) -> str:
+        """
+        Add a job to the outbox
+
+        Args:
+            kind: Job kind (selects the handler)
+            payload: Handler input
+            idempotency_key: Jobs with the same key are only enqueued once
+            delay: Seconds before the job becomes due
+            max_attempts: Attempts before the job is marked failed
+            parent_id: Fan-out job this job belongs to
+
+        Returns:
+            Job id (the existing job's id for a duplicate key)
+        """
+        job = self._new_job(kind, payload, idempotency_key, delay, max_attempts, parent_id)
+        await self._ensure_indexes()
+        try:
+            await self.db.notification_outbox.insert_one(job)
+        except DuplicateKeyError:
+            self.duplicates += 1
+            existing = await self.db.notification_outbox.find_one(
+                {"idempotency_key": idempotency_key}, {"_id": 0, "id": 1}
+            )
+            return existing["id"] if existing else job["id"]
+
+        self.enqueued += 1
+        self._wake()
+        return job["id"]
+
+    async def enqueue_many(self, jobs: List[dict]) -> int:
+        """
+        Insert jobs built with new_job() in one unordered batch
+
+        Returns:
+            Number of jobs inserted (duplicate idempotency keys are skipped)
+        """
+        if not jobs:
+            return 0
+        await self._ensure_indexes()
+        try:
+            result = await self.db.notification_outbox.insert_many(jobs, ordered=False)
+            inserted = len(result.inserted_ids)
+        except BulkWriteError as e:
+            other = [err for err in e.details.get("writeErrors", []) if err.get("code") != 11000]
+            if other:
+                raise
+            inserted = e.details.get("nInserted", 0)
+            self.duplicates += len(jobs) - inserted
+
+        self.enqueued += inserted
+        self._wake()
+        return inserted
+
+    def new_job(
+        self,
+        kind: str,
+        payload: dict,
+        idempotency_key: Optional[str] = None,
+        parent_id: Optional[str] = None,
+        max_attempts: int = MAX_ATTEMPTS,
+        delay: float = 0
+    ) -> dict:
+        """Job document for enqueue_many()"""
+        return self._new_job(kind, payload, idempotency_key, delay, max_attempts, parent_id)
+
+    async def get_job(self, job_id: str) -> Optional[dict]:
+        """Job document plus per-status counts of its fan-out children"""
+        job = await self.db.notification_outbox.find_one(
+            {"id": job_id}, {"_id": 0, "payload": 0}
+        )
+        if not job:
+            return None
+        children = await self.db.notification_outbox.aggregate([
+            {"$match": {"parent_id": job_id}},
+            {"$group": {"_id": "$status", "count": {"$sum": 1}}}
+        ]).to_list(None)
+        if children:
+            job["children"] = {c["_id"]: c["count"] for c in children}
+        return job
+
+    def start(self):
+        """Start the worker pool (called once on startup)"""
+        if self._tasks:
+            return
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logger.info(f"📮 Notification outbox started with {self.workers} workers")
+
+    async def close(self):
+        """Stop workers and hand their in-flight jobs back to the queue"""
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        if self.db is None:
+            return
+        try:
+            await self.db.notification_outbox.update_many(
+                {"status": "processing", "lease_owner": self.worker_id},
+                {
+                    "$set": {"status": "pending", "run_at": datetime.now(timezone.utc)},
+                    "$unset": {"lease_owner": "", "lease_until": ""}
+                }
+            )
+        except Exception as e:
+            logger.error(f"Outbox release error: {e}")
+
+    async def get_stats(self) -> dict:
+        counts = {}
+        if self.db is not None:
+            grouped = await self.db.notification_outbox.aggregate([
+                {"$match": {"status": {"$in": ["pending", "processing", "failed"]}}},
+                {"$group": {"_id": "$status", "count": {"$sum": 1}}}
+            ]).to_list(None)
+            counts = {g["_id"]: g["count"] for g in grouped}
+        return {
+            "worker_id": self.worker_id,
+            "workers": len([t for t in self._tasks if not t.done()]),
+            "pending": counts.get("pending", 0),
+            "processing": counts.get("processing", 0),
+            "failed_total": counts.get("failed", 0),
+            "enqueued": self.enqueued,
+            "duplicates": self.duplicates,
+            "delivered": self.delivered,
+            "retried": self.retried,
+            "failed": self.failed
+        }
+
+    # ----- worker -----
+
+    def _new_job(self, kind, payload, idempotency_key, delay, max_attempts, parent_id) -> dict:
+        now = datetime.now(timezone.utc)
+        job = {
+            "id": str(uuid.uuid4()),
+            "kind": kind,
+            "payload": payload,
+            "status": "pending",
+            "attempts": 0,
+            "max_attempts": max_attempts,
+            "run_at": now + timedelta(seconds=delay),
+            "created_at": now,
+            "updated_at": now
+        }
+        if idempotency_key:
+            job["idempotency_key"] = idempotency_key
+        if parent_id:
+            job["parent_id"] = parent_id
+        return job
+
+    def _wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _ensure_indexes(self):
+        if self._indexes_ready:
+            return
+        coll = self.db.notification_outbox
+        await coll.create_index("id", unique=True)
+        await coll.create_index(
+            "idempotency_key", unique=True,
+            partialFilterExpression={"idempotency_key": {"$type": "string"}}
+        )
+        await coll.create_index([("status", 1), ("run_at", 1)])
+        await coll.create_index([("status", 1), ("lease_until", 1)])
+        await coll.create_index("parent_id", sparse=True)
+        await coll.create_index("expires_at", expireAfterSeconds=0)
+        self._indexes_ready = True
+
+    async def _claim(self) -> Optional[dict]:
+        now = datetime.now(timezone.utc)
+        return await self.db.notification_outbox.find_one_and_update(
+            {"$or": [
+                {"status": "pending", "run_at": {"$lte": now}},
+                {"status": "processing", "lease_until": {"$lt": now}}
+            ]},
+            {
+                "$set": {
+                    "status": "processing",
+                    "lease_owner": self.worker_id,
+                    "lease_until": now + timedelta(seconds=LEASE_SECONDS),
+                    "updated_at": now
+                },
+                "$inc": {"attempts": 1}
+            },
+            sort=[("run_at", 1)],
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def _worker(self):
+        while True:
+            try:
+                if self.db is None:
+                    await asyncio.sleep(POLL_INTERVAL)
+                    continue
+                await self._ensure_indexes()
+                job = await self._claim()
+                if job is None:
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), POLL_INTERVAL)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                await self._run(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Outbox worker error: {e}")
+                await asyncio.sleep(POLL_INTERVAL)
+
+    async def _run(self, job: dict):
+        handler = self._handlers.get(job["kind"])
+        heartbeat = asyncio.create_task(self._renew_lease(job["id"]))
+        try:
+            if handler is None:
+                raise OutboxPermanentError(f"No handler for job kind '{job['kind']}'")
+            result = await handler(job)
+        except OutboxPermanentError as e:
+            await self._fail(job, str(e))
+        except Exception as e:
+            await self._retry(job, str(e), getattr(e, "retry_after", None))
+        else:
+            await self._complete(job, result)
+        finally:
+            heartbeat.cancel()
+
+    async def _renew_lease(self, job_id: str):
+        while True:
+            await asyncio.sleep(LEASE_SECONDS / 3)
+            try:
+                await self.db.notification_outbox.update_one(
+                    {"id": job_id, "lease_owner": self.worker_id},
+                    {"$set": {"lease_until": datetime.now(timezone.utc) + timedelta(seconds=LEASE_SECONDS)}}
+                )
+            except Exception as e:
+                logger.error(f"Outbox lease renewal error for {job_id}: {e}")
+
+    async def _finish(self, job: dict, update: dict):
+        # Guarded by lease_owner: a job reclaimed after a lost lease is left alone
+        await self.db.notification_outbox.update_one(
+            {"id": job["id"], "lease_owner": self.worker_id},
+            {**update, "$unset": {"lease_owner": "", "lease_until": ""}}
+        )
+
+    async def _complete(self, job: dict, result: Optional[dict]):
+        now = datetime.now(timezone.utc)
+        fields = {
+            "status": "done",
+            "completed_at": now,
+            "updated_at": now,
+            "expires_at": now + timedelta(days=DONE_TTL_DAYS)
+        }
+        if result:
+            fields["result"] = result
+        await self._finish(job, {"$set": fields})
+        self.delivered += 1
+
+    async def _fail(self, job: dict, error: str):
+        now = datetime.now(timezone.utc)
+        await self._finish(job, {"$set": {
+            "status": "failed",
+            "last_error": error[:500],
+            "updated_at": now,
+            "expires_at": now + timedelta(days=DONE_TTL_DAYS)
+        }})
+        self.failed += 1
+        logger.warning(f"Outbox job {job['kind']}:{job['id']} failed: {error}")
+
+    async def _retry(self, job: dict, error: str, retry_after: Optional[float] = None):
+        attempts = job.get("attempts", 1)
+        if attempts >= job.get("max_attempts", MAX_ATTEMPTS):
+            await self._fail(job, error)
+            return
+        delay = min(MAX_BACKOFF, BACKOFF_BASE * 2 ** (attempts - 1)) * random.uniform(0.5, 1.0)
+        if retry_after:
+            delay = max(delay, float(retry_after))
+        now = datetime.now(timezone.utc)
+        await self._finish(job, {"$set": {
+            "status": "pending",
+            "run_at": now + timedelta(seconds=delay),
+            "last_error": error[:500],
+            "updated_at": now
+        }})
+        self.retried += 1
+
+    # ----- built-in handlers -----
+
+    async def _deliver_telegram(self, job: dict):
+        """payload: bot_token, chat_id, text, optional send_message kwargs"""
+        from services.telegram_broadcast import telegram_broadcaster
+
+        payload = dict(job["payload"])
+        result = await telegram_broadcaster.send(
+            payload.pop("bot_token"), payload.pop("chat_id"), payload.pop("text"), **payload
+        )
+        if result.get("success"):
+            return None
+        error = result.get("error", "Telegram rejected the message")
+        status_code = result.get("status_code")
+        if status_code == 403 or (status_code == 400 and "chat not found" in error.lower()):
+            # Blocked bot / deleted chat: leave it out of future broadcasts
+            from services.telegram_recipients import telegram_recipients
+            await telegram_recipients.mark_blocked(job["payload"]["chat_id"])
+            raise OutboxPermanentError(error)
+        if status_code == 400:
+            # Bad request (e.g. unparsable HTML): fails this message only
+            raise OutboxPermanentError(error)
+        raise OutboxRetry(result.get("error", "Telegram send failed"), result.get("retry_after"))
+
+    async def _expand_telegram_broadcast(self, job: dict):
+        """
+        payload: bot_token, text, name and either chat_ids or
+        audience (+ audience_args) registered with register_audience()
+
+        Fans out into one `telegram` job per chat; children are keyed by
+        this job so a re-run after a crash never duplicates a recipient.
+        Audiences may be async generators, so recipients are streamed.
+        """
+        payload = job["payload"]
+        chat_ids = payload.get("chat_ids")
+        if chat_ids is None:
+            resolver = self._audiences.get(payload.get("audience"))
+            if resolver is None:
+                raise OutboxPermanentError(f"Unknown audience '{payload.get('audience')}'")
+            chat_ids = resolver(**payload.get("audience_args", {}))
+            if not hasattr(chat_ids, "__aiter__"):
+                chat_ids = await chat_ids
+
+        key = job.get("idempotency_key") or job["id"]
+        send_kwargs = payload.get("send_kwargs", {})
+        recipients = 0
+        batch = []
+        seen = set()
+        async for chat_id in _iterate(chat_ids):
+            chat_id = str(chat_id) if chat_id else None
+            if not chat_id or chat_id in seen:
+                continue
+            seen.add(chat_id)
+            batch.append(self.new_job(
+                "telegram",
+                {"bot_token": payload["bot_token"], "chat_id": chat_id, "text": payload["text"], **send_kwargs},
+                idempotency_key=f"{key}:{chat_id}",
+                parent_id=job["id"],
+                max_attempts=3
+            ))
+            recipients += 1
+            if len(batch) >= FANOUT_BATCH_SIZE:
+                await self.enqueue_many(batch)
+                batch = []
+        await self.enqueue_many(batch)
+
+        logger.info(f"📢 Broadcast '{payload.get('name', key)}' fanned out to {recipients} chats")
+        return {"recipients": recipients}
+
+    async def _deliver_in_app(self, job: dict):
+        """payload: notification document (its id makes the insert idempotent)"""
+        notification = job["payload"]
+        result = await self.db.notifications.update_one(
+            {"id": notification["id"]},
+            {"$setOnInsert": notification},
+            upsert=True
+        )
+        if result.upserted_id is not None and not notification.get("is_read"):
+            from services.unread_counters import unread_counters
+            from services.user_channel import user_channel
+            await unread_counters.notification_added(notification.get("user_id"))
+            user_channel.notification(notification)
+
+    async def _deliver_webhook(self, job: dict):
+        """
+        payload: event, data
+
+        Fans out into one `webhook_delivery` job per subscribed webhook,
+        keyed by this job
+        """
+        from webhook_service import webhook_service
+
+        if webhook_service is None:
+            raise OutboxRetry("Webhook service not initialized")
+        webhooks = await webhook_service.trigger_webhooks(
+            job["payload"]["event"], job["payload"]["data"],
+            parent_id=job["id"], key=job.get("idempotency_key") or job["id"]
+        )
+        return {"webhooks": webhooks}
+
+
+async def _iterate(items) -> AsyncIterator:
+    """Iterate a plain or async iterable"""
+    if hasattr(items, "__aiter__"):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
+
+
+# Global instance
+notification_outbox = NotificationOutbox()
@@ -0,0 +1,302 @@
+"""
+Job Scheduler
+Persistent `scheduled_jobs` table plus an in-memory min-heap of due
+times: the loop sleeps exactly until the next job is due, and jobs are
+claimed with a lease so several API workers never run the same one.
+Used for session reminders; any timed job can register a handler
+"""
+import asyncio
+import heapq
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+# Jobs due within this window are held in the heap
+HORIZON_SECONDS = 3600
+# Reload the heap from the table this often (jobs scheduled by other
+# workers, jobs whose worker died mid-run)
+REFILL_INTERVAL = 120.0
+# A running job whose lease expired is claimed again
+LEASE_SECONDS = 120
+# Attempts before a job is marked failed; retries back off linearly
+MAX_ATTEMPTS = 3
+RETRY_DELAY = 60
+# Finished jobs are removed by a TTL index after this long
+DONE_TTL_DAYS = 7
+
+
+def as_utc(value) -> Optional[datetime]:
+    """Parse an ISO string / naive datetime into an aware UTC datetime"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+
+class Scheduler:
+    """
+    Timer heap over the `scheduled_jobs` collection
+
+    - schedule() upserts by job id, so re-scheduling moves the job and
+      scheduling the same time twice is a no-op
+    - The heap may hold stale entries (moved or cancelled jobs); the
+      claim query only matches a job that is still due, so they are
+      dropped harmlessly
+    - Handlers run outside the loop; a failing job is retried up to
+      MAX_ATTEMPTS times
+    """
+
+    def __init__(self, db=None):
+        self.db = db
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._handlers: Dict[str, Callable[[dict], Awaitable[None]]] = {}
+        self._heap: List[Tuple[float, str]] = []
+        self._running: set = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._indexes_ready = False
+
+        # Stats
+        self.completed = 0
+        self.failed = 0
+        self.lost_claims = 0
+
+    def set_db(self, db):
+        self.db = db
+
+    def register(self, kind: str, handler: Callable[[dict], Awaitable[None]]):
+        """Register the handler for a job kind (receives the job document)"""
+        self._handlers[kind] = handler
+
+    async def schedule(self, job_id: str, kind: str, run_at: datetime, payload: Optional[dict] = None):
+        """
+        Schedule (or move) a job
+
+        Args:
+            job_id: Stable id, e.g. "live_reminder_15min:<session_id>"
+            kind: Handler name
+            run_at: When the job is due
+            payload: Handler input
+        """
+        if self.db is None:
+            return
+        await self._ensure_indexes()
+        run_at = as_utc(run_at)
+        now = datetime.now(timezone.utc)
+        try:
+            await self.db.scheduled_jobs.update_one(
+                # Matches nothing when the job is already armed (or ran) at
+                # this time, so the upsert hits the unique id instead of
+                # re-arming it; a cancelled job is always re-armed
+                {"id": job_id, "$or": [{"run_at": {"$ne": run_at}}, {"status": "cancelled"}]},
+                {
+                    "$set": {
+                        "kind": kind,
+                        "run_at": run_at,
+                        "payload": payload or {},
+                        "status": "scheduled",
+                        "attempts": 0,
+                        "updated_at": now
+                    },
+                    "$unset": {"lease_owner": "", "lease_until": "", "expires_at": ""},
+                    "$setOnInsert": {"created_at": now}
+                },
+                upsert=True
+            )
+        except DuplicateKeyError:
+            return
+        self._push(run_at, job_id)
+
+    async def cancel(self, job_ids: List[str]):
+        """Cancel jobs that have not run yet"""
+        if self.db is None or not job_ids:
+            return
+        now = datetime.now(timezone.utc)
+        await self.db.scheduled_jobs.update_many(
+            {"id": {"$in": job_ids}, "status": "scheduled"},
+            {"$set": {
+                "status": "cancelled",
+                "updated_at": now,
+                "expires_at": now + timedelta(days=DONE_TTL_DAYS)
+            }}
+        )
+
+    def start(self):
+        """Start the scheduler loop (called once on startup)"""
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+            logger.info("⏰ Scheduler started")
+
+    async def close(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+
+    def get_stats(self) -> dict:
+        return {
+            "heap_size": len(self._heap),
+            "next_due_in": round(self._heap[0][0] - _timestamp(), 1) if self._heap else None,
+            "running": len(self._running),
+            "completed": self.completed,
+            "failed": self.failed,
+            "lost_claims": self.lost_claims
+        }
+
+    def _push(self, run_at: datetime, job_id: str):
+        due = run_at.timestamp()
+        if due > _timestamp() + HORIZON_SECONDS:
+            return  # picked up by a later refill
+        wake = not self._heap or due < self._heap[0][0]
+        heapq.heappush(self._heap, (due, job_id))
+        if wake and self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _ensure_indexes(self):
+        if self._indexes_ready:
+            return
+        await self.db.scheduled_jobs.create_index("id", unique=True)
+        await self.db.scheduled_jobs.create_index([("status", 1), ("run_at", 1)])
+        await self.db.scheduled_jobs.create_index("expires_at", expireAfterSeconds=0)
+        self._indexes_ready = True
+
+    async def _refill(self):
+        """Reload jobs due within the horizon, plus running jobs with expired leases"""
+        now = datetime.now(timezone.utc)
+        horizon = now + timedelta(seconds=HORIZON_SECONDS)
+        self._heap = []
+        async for job in self.db.scheduled_jobs.find(
+            {"$or": [
+                {"status": "scheduled", "run_at": {"$lte": horizon}},
+                {"status": "running", "lease_until": {"$lt": now}}
+            ]},
+            {"_id": 0, "id": 1, "run_at": 1, "status": 1}
+        ):
+            run_at = now if job["status"] == "running" else as_utc(job["run_at"])
+            self._heap.append((run_at.timestamp(), job["id"]))
+        heapq.heapify(self._heap)
+
+    async def _run(self):
+        next_refill = 0.0
+        while True:
+            try:
+                if self.db is None:
+                    await asyncio.sleep(REFILL_INTERVAL)
+                    continue
+                now = _timestamp()
+                if now >= next_refill:
+                    await self._ensure_indexes()
+                    await self._refill()
+                    next_refill = now + REFILL_INTERVAL
+
+                while self._heap and self._heap[0][0] <= _timestamp():
+                    _, job_id = heapq.heappop(self._heap)
+                    if job_id not in self._running:
+                        asyncio.create_task(self._claim_and_run(job_id))
+
+                # Sleep until the next job, the next refill or an earlier job
+                timeout = next_refill - _timestamp()
+                if self._heap:
+                    timeout = min(timeout, self._heap[0][0] - _timestamp())
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), max(0.0, timeout))
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Scheduler loop error: {e}")
+                await asyncio.sleep(5)
+
+    async def _claim_and_run(self, job_id: str):
+        self._running.add(job_id)
+        try:
+            now = datetime.now(timezone.utc)
+            job = await self.db.scheduled_jobs.find_one_and_update(
+                {"id": job_id, "$or": [
+                    {"status": "scheduled", "run_at": {"$lte": now}},
+                    {"status": "running", "lease_until": {"$lt": now}}
+                ]},
+                {
+                    "$set": {
+                        "status": "running",
+                        "lease_owner": self.worker_id,
+                        "lease_until": now + timedelta(seconds=LEASE_SECONDS),
+                        "updated_at": now
+                    },
+                    "$inc": {"attempts": 1}
+                },
+                projection={"_id": 0},
+                return_document=ReturnDocument.AFTER
+            )
+            if job is None:
+                # Moved, cancelled or claimed by another worker
+                self.lost_claims += 1
+                return
+
+            handler = self._handlers.get(job["kind"])
+            try:
+                if handler is None:
+                    raise RuntimeError(f"No handler for scheduled job kind '{job['kind']}'")
+                await handler(job)
+            except Exception as e:
+                await self._reschedule_failed(job, str(e))
+                return
+
+            now = datetime.now(timezone.utc)
+            await self.db.scheduled_jobs.update_one(
+                {"id": job_id, "lease_owner": self.worker_id},
+                {
+                    "$set": {
+                        "status": "done",
+                        "completed_at": now,
+                        "updated_at": now,
+                        "expires_at": now + timedelta(days=DONE_TTL_DAYS)
+                    },
+                    "$unset": {"lease_owner": "", "lease_until": ""}
+                }
+            )
+            self.completed += 1
+        except Exception as e:
+            logger.error(f"Scheduled job {job_id} error: {e}")
+        finally:
+            self._running.discard(job_id)
+
+    async def _reschedule_failed(self, job: dict, error: str):
+        now = datetime.now(timezone.utc)
+        if job.get("attempts", 1) >= MAX_ATTEMPTS:
+            update = {
+                "status": "failed",
+                "last_error": error[:500],
+                "updated_at": now,
+                "expires_at": now + timedelta(days=DONE_TTL_DAYS)
+            }
+            self.failed += 1
+            logger.warning(f"Scheduled job {job['id']} failed: {error}")
+        else:
+            run_at = now + timedelta(seconds=RETRY_DELAY * job.get("attempts", 1))
+            update = {"status": "scheduled", "run_at": run_at, "last_error": error[:500], "updated_at": now}
+            self._push(run_at, job["id"])
+        await self.db.scheduled_jobs.update_one(
+            {"id": job["id"], "lease_owner": self.worker_id},
+            {"$set": update, "$unset": {"lease_owner": "", "lease_until": ""}}
+        )
+
+
+def _timestamp() -> float:
+    return datetime.now(timezone.utc).timestamp()
+
+
+# Global instance
+scheduler = Scheduler()
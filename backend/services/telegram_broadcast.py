@@ -0,0 +1,116 @@
+"""
+Telegram Broadcast Engine
+Sends Telegram messages under the bot's global and per-chat rate limits,
+pausing a bot for retry_after when Telegram answers 429
+"""
+import asyncio
+import logging
+import time
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+# Telegram allows ~30 messages/second per bot across all chats...
+GLOBAL_RATE = 30.0
+# ...and ~1 message/second to the same chat
+PER_CHAT_INTERVAL = 1.0
+# Prune expired per-chat throttles beyond this many entries
+CHAT_THROTTLE_PRUNE_AT = 10000
+
+
+class TelegramBroadcaster:
+    """
+    Shared Telegram rate limiter for all sends of this worker
+
+    - Each bot token has a token bucket (GLOBAL_RATE); a 429 pauses that
+      bot for retry_after seconds
+    - A chat is never sent to more than once per PER_CHAT_INTERVAL
+    - Requests go through telegram_service's pooled HTTP client
+    - Fan-out, retries and progress are handled by the notification outbox
+    """
+
+    def __init__(self, telegram_service=None):
+        self._telegram = telegram_service
+        # bot_token -> [tokens, updated_at, paused_until]
+        self._buckets: Dict[str, list] = {}
+        # chat_id -> monotonic time the chat may be messaged again
+        self._chat_next_at: Dict[str, float] = {}
+
+    @property
+    def telegram(self):
+        if self._telegram is None:
+            from services.telegram_service import telegram_service
+            self._telegram = telegram_service
+        return self._telegram
+
+    def get_stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            "bots": len(self._buckets),
+            "paused_bots": sum(1 for bucket in self._buckets.values() if bucket[2] > now),
+            "throttled_chats": sum(1 for t in self._chat_next_at.values() if t > now)
+        }
+
+    async def close(self):
+        self._buckets = {}
+        self._chat_next_at = {}
+
+    async def _acquire(self, bot_token: str, chat_id: str):
+        """Wait until both the bot's bucket and the chat allow a send"""
+        while True:
+            now = time.monotonic()
+            bucket = self._buckets.setdefault(bot_token, [GLOBAL_RATE, now, 0.0])
+            bucket[0] = min(GLOBAL_RATE, bucket[0] + (now - bucket[1]) * GLOBAL_RATE)
+            bucket[1] = now
+
+            wait = max(bucket[2] - now, self._chat_next_at.get(chat_id, 0.0) - now)
+            if wait <= 0 and bucket[0] >= 1:
+                bucket[0] -= 1
+                if len(self._chat_next_at) >= CHAT_THROTTLE_PRUNE_AT:
+                    self._prune_chat_throttles(now)
+                self._chat_next_at[chat_id] = now + PER_CHAT_INTERVAL
+                return
+            if wait <= 0:
+                wait = (1 - bucket[0]) / GLOBAL_RATE
+            await asyncio.sleep(wait)
+
+    def _prune_chat_throttles(self, now: float):
+        """Drop per-chat throttles that have expired"""
+        self._chat_next_at = {
+            chat_id: t for chat_id, t in self._chat_next_at.items() if t > now
+        }
+
+    async def send(self, bot_token: str, chat_id, text: str, **send_kwargs) -> dict:
+        """
+        Send one message under the bot and chat rate limits
+
+        Args:
+            bot_token: Telegram bot token
+            chat_id: Recipient chat id
+            text: Message text
+            send_kwargs: Extra TelegramService.send_message arguments
+
+        Returns:
+            TelegramService.send_message result; on 429 the bot is paused
+            for retry_after before any further sends
+        """
+        chat_id = str(chat_id)
+        await self._acquire(bot_token, chat_id)
+        result = await self.telegram.send_message(
+            bot_token=bot_token,
+            chat_id=chat_id,
+            text=text,
+            **send_kwargs
+        )
+
+        retry_after = result.get("retry_after")
+        if not result.get("success") and retry_after:
+            # Flood control applies to the whole bot: pause every sender
+            bucket = self._buckets[bot_token]
+            bucket[2] = max(bucket[2], time.monotonic() + float(retry_after))
+            logger.warning(f"Telegram 429, pausing bot for {retry_after}s")
+        return result
+
+
+# Global instance
+telegram_broadcaster = TelegramBroadcaster()
@@ -0,0 +1,246 @@
+"""
+Telegram Recipients Projection
+One `telegram_recipients` document per connected account and source,
+kept up to date on connect / disconnect / settings changes, so
+broadcasts stream a single indexed collection instead of scanning
+users and authors on every run
+"""
+import logging
+from datetime import datetime, timezone
+from typing import AsyncIterator, Iterable, List, Optional
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+# Where a chat id came from
+SOURCE_USERS = "users"                   # users.telegram_chat_id
+SOURCE_AUTHORS = "authors"               # authors.telegram_chat_id (personal alerts)
+SOURCE_SUBSCRIPTIONS = "subscriptions"   # telegram_user_connections (creator subscriptions)
+
+# Sources that receive platform-wide live notifications
+PLATFORM_SOURCES = (SOURCE_USERS, SOURCE_AUTHORS)
+
+# Cursor batch size / user ids per $in query
+BATCH_SIZE = 500
+
+# Preference flags copied from telegram_user_connections
+PREFERENCE_FIELDS = ("notify_new_episodes", "notify_live_streams")
+
+
+class TelegramRecipients:
+    """
+    Maintained projection for broadcast fan-out
+
+    - connect() / disconnect() are called next to every write that changes
+      a Telegram connection; backfill() builds the collection once from
+      users, authors and telegram_user_connections
+    - Recipients are streamed in BATCH_SIZE batches, never capped
+    - A chat that blocked the bot is flagged and skipped until it reconnects
+    """
+
+    def __init__(self, db=None):
+        self.db = db
+        self._indexes_ready = False
+
+    def set_db(self, db):
+        self.db = db
+
+    async def connect(
+        self,
+        user_id: str,
+        source: str,
+        chat_id,
+        username: Optional[str] = None,
+        **preferences
+    ):
+        """
+        Record (or refresh) a connected chat
+
+        Args:
+            user_id: Account id (user or author)
+            source: SOURCE_USERS, SOURCE_AUTHORS or SOURCE_SUBSCRIPTIONS
+            chat_id: Telegram chat id
+            username: Telegram username
+            preferences: notify_new_episodes / notify_live_streams / muted
+        """
+        if self.db is None or not chat_id:
+            return
+        await self._ensure_indexes()
+        fields = {
+            "chat_id": str(chat_id),
+            "username": username,
+            "connected": True,
+            "blocked": False,
+            "updated_at": datetime.now(timezone.utc)
+        }
+        fields.update({k: v for k, v in preferences.items() if v is not None})
+        await self.db.telegram_recipients.update_one(
+            {"user_id": user_id, "source": source},
+            {"$set": fields},
+            upsert=True
+        )
+
+    async def disconnect(self, user_id: str, source: str):
+        """Stop sending to an account's chat from this source"""
+        if self.db is None:
+            return
+        await self.db.telegram_recipients.update_one(
+            {"user_id": user_id, "source": source},
+            {"$set": {"connected": False, "updated_at": datetime.now(timezone.utc)}}
+        )
+
+    async def update_preferences(self, user_id: str, source: str, **preferences):
+        """Copy changed notification preferences / mute flag"""
+        fields = {k: v for k, v in preferences.items() if v is not None}
+        if self.db is None or not fields:
+            return
+        fields["updated_at"] = datetime.now(timezone.utc)
+        await self.db.telegram_recipients.update_one(
+            {"user_id": user_id, "source": source},
+            {"$set": fields}
+        )
+
+    async def mark_blocked(self, chat_id):
+        """The bot was blocked or the chat is gone (Telegram 403 / 400)"""
+        if self.db is None:
+            return
+        await self.db.telegram_recipients.update_many(
+            {"chat_id": str(chat_id)},
+            {"$set": {"blocked": True, "updated_at": datetime.now(timezone.utc)}}
+        )
+
+    async def iter_chat_ids(self, sources: Iterable[str] = PLATFORM_SOURCES) -> AsyncIterator[str]:
+        """
+        Every deliverable chat id from the given sources, deduplicated
+
+        Args:
+            sources: Recipient sources to include
+        """
+        seen = set()
+        cursor = self.db.telegram_recipients.find(
+            {**self._deliverable(), "source": {"$in": list(sources)}},
+            {"_id": 0, "chat_id": 1}
+        ).batch_size(BATCH_SIZE)
+        async for doc in cursor:
+            if doc["chat_id"] not in seen:
+                seen.add(doc["chat_id"])
+                yield doc["chat_id"]
+
+    async def chat_ids_for_users(
+        self,
+        user_ids: List[str],
+        source: str = SOURCE_SUBSCRIPTIONS,
+        preference: Optional[str] = None
+    ) -> List[str]:
+        """
+        Deliverable chat ids for a batch of accounts (one $in query)
+
+        Args:
+            user_ids: Account ids (at most BATCH_SIZE for one query)
+            source: Recipient source
+            preference: Skip accounts that turned this flag off
+        """
+        query = {**self._deliverable(), "user_id": {"$in": user_ids}, "source": source}
+        if preference:
+            query[preference] = {"$ne": False}
+        docs = await self.db.telegram_recipients.find(
+            query, {"_id": 0, "chat_id": 1}
+        ).to_list(None)
+        return [doc["chat_id"] for doc in docs]
+
+    async def backfill(self, force: bool = False) -> int:
+        """
+        Build the projection from users, authors and connections
+
+        Runs only while the collection is empty unless `force` is set.
+
+        Returns:
+            Number of recipients written
+        """
+        if self.db is None:
+            return 0
+        await self._ensure_indexes()
+        if not force and await self.db.telegram_recipients.estimated_document_count():
+            return 0
+
+        now = datetime.now(timezone.utc)
+        written = 0
+        ops = []
+
+        async def flush():
+            nonlocal ops, written
+            if ops:
+                await self.db.telegram_recipients.bulk_write(ops, ordered=False)
+                written += len(ops)
+                ops = []
+
+        query = {"telegram_connected": True, "telegram_chat_id": {"$exists": True, "$ne": None}}
+        for source, collection in ((SOURCE_USERS, self.db.users), (SOURCE_AUTHORS, self.db.authors)):
+            async for doc in collection.find(
+                query, {"_id": 0, "id": 1, "telegram_chat_id": 1, "telegram_username": 1}
+            ).batch_size(BATCH_SIZE):
+                if not doc.get("id"):
+                    continue
+                ops.append(UpdateOne(
+                    {"user_id": doc["id"], "source": source},
+                    {"$set": {
+                        "chat_id": str(doc["telegram_chat_id"]),
+                        "username": doc.get("telegram_username"),
+                        "connected": True,
+                        "updated_at": now
+                    }, "$setOnInsert": {"blocked": False}},
+                    upsert=True
+                ))
+                if len(ops) >= BATCH_SIZE:
+                    await flush()
+
+        async for conn in self.db.telegram_user_connections.find(
+            {"is_active": True, "telegram_chat_id": {"$exists": True, "$ne": None}},
+            {"_id": 0, "user_id": 1, "telegram_chat_id": 1, "telegram_username": 1, **{f: 1 for f in PREFERENCE_FIELDS}}
+        ).batch_size(BATCH_SIZE):
+            ops.append(UpdateOne(
+                {"user_id": conn["user_id"], "source": SOURCE_SUBSCRIPTIONS},
+                {"$set": {
+                    "chat_id": str(conn["telegram_chat_id"]),
+                    "username": conn.get("telegram_username"),
+                    "connected": True,
+                    "updated_at": now,
+                    **{f: conn[f] for f in PREFERENCE_FIELDS if f in conn}
+                }, "$setOnInsert": {"blocked": False}},
+                upsert=True
+            ))
+            if len(ops) >= BATCH_SIZE:
+                await flush()
+
+        await flush()
+        logger.info(f"📇 Telegram recipients backfilled: {written}")
+        return written
+
+    async def get_stats(self) -> dict:
+        if self.db is None:
+            return {}
+        grouped = await self.db.telegram_recipients.aggregate([
+            {"$match": self._deliverable()},
+            {"$group": {"_id": "$source", "count": {"$sum": 1}}}
+        ]).to_list(None)
+        return {"deliverable": {g["_id"]: g["count"] for g in grouped}}
+
+    def _deliverable(self) -> dict:
+        return {"connected": True, "blocked": {"$ne": True}, "muted": {"$ne": True}}
+
+    async def _ensure_indexes(self):
+        if self._indexes_ready:
+            return
+        await self.db.telegram_recipients.create_index(
+            [("user_id", 1), ("source", 1)], unique=True
+        )
+        await self.db.telegram_recipients.create_index(
+            [("source", 1), ("connected", 1), ("chat_id", 1)]
+        )
+        await self.db.telegram_recipients.create_index("chat_id")
+        self._indexes_ready = True
+
+
+# Global instance
+telegram_recipients = TelegramRecipients()
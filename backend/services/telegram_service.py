@@ -14,7 +14,11 @@ class TelegramService:
     """Service for Telegram bot integration"""
     
     def __init__(self):
-        self.client = httpx.AsyncClient(timeout=10.0)
+        # One pooled client for every bot request (broadcasts reuse connections)
+        self.client = httpx.AsyncClient(
+            timeout=10.0,
+            limits=httpx.Limits(max_connections=50, max_keepalive_connections=20)
+        )
     
     async def close(self):
         """Close HTTP client"""
@@ -63,7 +67,13 @@ class TelegramService:
             else:
                 error = result.get('description', 'Unknown error')
                 logger.error(f"❌ Telegram error: {error}")
-                return {'success': False, 'error': error}
+                return {
+                    'success': False,
+                    'error': error,
+                    'status_code': response.status_code,
+                    # Set on 429 (flood control)
+                    'retry_after': (result.get('parameters') or {}).get('retry_after')
+                }
                 
         except Exception as e:
             logger.error(f"❌ Telegram exception: {e}")
@@ -198,9 +208,14 @@ class TelegramService:
         Returns:
             Result of send operation
         """
+        return await self.send_message(
+            bot_token, chat_id, self.format_live_started_message(session_data)
+        )
+    
+    def format_live_started_message(self, session_data: dict) -> str:
+        """Text of the live-started notification (shared with broadcasts)"""
         title = session_data.get('title', 'Live Session')
         description = session_data.get('description', '')
-        session_id = session_data.get('id', '')
         
         message = f"""
 🔴 <b>СТРИМ НАЧАЛСЯ!</b>
@@ -212,7 +227,7 @@ class TelegramService:
 👉 Присоединиться сейчас в приложении
 """
         
-        return await self.send_message(bot_token, chat_id, message.strip())
+        return message.strip()
     
     async def send_live_ended_notification(
         self,
@@ -231,6 +246,12 @@ class TelegramService:
         Returns:
             Result of send operation
         """
+        return await self.send_message(
+            bot_token, chat_id, self.format_live_ended_message(session_data)
+        )
+    
+    def format_live_ended_message(self, session_data: dict) -> str:
+        """Text of the live-ended notification (shared with broadcasts)"""
         title = session_data.get('title', 'Live Session')
         participants = session_data.get('participants_count', 0)
         duration = session_data.get('duration_minutes', 0)
@@ -247,7 +268,7 @@ class TelegramService:
 Запись будет доступна в подкастах!
 """
         
-        return await self.send_message(bot_token, chat_id, message.strip())
+        return message.strip()
     
     async def send_hand_raised_notification(
         self,
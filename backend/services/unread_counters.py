@@ -0,0 +1,220 @@
+"""
+Unread Counters
+One `unread_counters` document per user holding the unread notification
+count, adjusted with $inc next to every write that changes it; unread
+messages come from the conversation summaries (`unread.<user_id>`), so
+badge polls read a few documents (usually from memory) instead of counting
+"""
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from pymongo import UpdateOne
+
+from services.conversation_summaries import conversation_summaries
+
+logger = logging.getLogger(__name__)
+
+# Cached counters are re-read after this long; writes made on this worker
+# update the cache immediately, writes on other workers show up within it
+CACHE_TTL = 5.0
+# Bound on cached users (least recently used are evicted first)
+MAX_CACHED_USERS = 20000
+
+
+class UnreadCounters:
+    """
+    Materialized unread counts
+
+    - Increments never upsert: a user's counter document is created on
+      first read, empty, and the existing unread documents are added to
+      it with $inc, so increments landing meanwhile are never overwritten
+    - Decrements use the number of documents actually changed, so a
+      repeated "mark read" never drives a counter down twice
+    - Reads clamp at zero in case of drift; marking everything read
+      resets the count
+    - Message counts have a single source of truth, the conversation
+      summaries; message_added() / messages_read() / conversation_cleared()
+      only keep the cached copy current and announce the change
+    """
+
+    def __init__(self, db=None):
+        self.db = db
+        # user_id -> (counters, expires_at)
+        self._cache: "OrderedDict[str, Tuple[dict, float]]" = OrderedDict()
+        self._indexes_ready = False
+        # Called with the user ids after every counter write (real-time channel)
+        self.on_change: Optional[Callable[[Iterable[str]], None]] = None
+
+        # Stats
+        self.hits = 0
+        self.misses = 0
+        self.recounts = 0
+
+    def set_db(self, db):
+        self.db = db
+
+    async def get(self, user_id: str) -> dict:
+        """
+        Unread counts of a user
+
+        Returns:
+            {"notifications", "messages", "conversations": {peer_id: count}}
+        """
+        entry = self._cache.get(user_id)
+        if entry and entry[1] > time.monotonic():
+            self._cache.move_to_end(user_id)
+            self.hits += 1
+            return entry[0]
+
+        self.misses += 1
+        doc = await self.db.unread_counters.find_one({"user_id": user_id}, {"_id": 0})
+        if doc is None:
+            doc = await self.recount(user_id)
+        conversations = await conversation_summaries.unread_counts(user_id)
+        counters = {
+            "notifications": max(0, doc.get("notifications", 0)),
+            "messages": sum(conversations.values()),
+            "conversations": conversations
+        }
+        self._store(user_id, counters)
+        return counters
+
+    async def recount(self, user_id: str) -> dict:
+        """
+        Create a user's counter document from notifications
+
+        The empty document is inserted before counting, so increments from
+        then on land on it; the counted baseline is added with $inc by
+        whichever worker inserted it. (A document written while counting
+        can be counted twice; the read clamps and read-all resets cover it.)
+
+        Returns:
+            The counter document
+        """
+        await self._ensure_indexes()
+        now = datetime.now(timezone.utc)
+        result = await self.db.unread_counters.update_one(
+            {"user_id": user_id},
+            {"$setOnInsert": {"notifications": 0, "updated_at": now}},
+            upsert=True
+        )
+        if result.upserted_id is not None:
+            self.recounts += 1
+            notifications = await self.db.notifications.count_documents({"user_id": user_id, "is_read": False})
+            if notifications:
+                await self.db.unread_counters.update_one({"user_id": user_id}, {"$inc": {"notifications": notifications}})
+        return await self.db.unread_counters.find_one({"user_id": user_id}, {"_id": 0}) or {}
+
+    async def notification_added(self, user_id: str, count: int = 1):
+        await self._inc(user_id, {"notifications": count})
+
+    async def notifications_added(self, user_ids: Iterable[str]):
+        """One new notification for each user (bulk fan-out)"""
+        user_ids = list(user_ids)
+        if self.db is None or not user_ids:
+            return
+        now = datetime.now(timezone.utc)
+        await self.db.unread_counters.bulk_write([
+            UpdateOne({"user_id": user_id}, {"$inc": {"notifications": 1}, "$set": {"updated_at": now}})
+            for user_id in user_ids
+        ], ordered=False)
+        for user_id in user_ids:
+            self._apply(user_id, {"notifications": 1})
+        self._changed(user_ids)
+
+    async def notifications_read(self, user_id: str, count: int = 1):
+        if count:
+            await self._inc(user_id, {"notifications": -count})
+
+    async def notifications_cleared(self, user_id: str):
+        """Every notification of the user was marked read"""
+        if self.db is None or not user_id:
+            return
+        await self.db.unread_counters.update_one(
+            {"user_id": user_id},
+            {"$set": {"notifications": 0, "updated_at": datetime.now(timezone.utc)}}
+        )
+        entry = self._cache.get(user_id)
+        if entry is not None:
+            entry[0]["notifications"] = 0
+        self._changed([user_id])
+
+    async def message_added(self, recipient_id: str, sender_id: str):
+        """Called after conversation_summaries.message_sent()"""
+        if recipient_id and recipient_id != sender_id:
+            self._apply(recipient_id, {"messages": 1, f"conversations.{sender_id}": 1})
+            self._changed([recipient_id])
+
+    async def messages_read(self, recipient_id: str, sender_id: str, count: int):
+        """Called after conversation_summaries.read()"""
+        if count:
+            self._apply(recipient_id, {"messages": -count, f"conversations.{sender_id}": -count})
+            self._changed([recipient_id])
+
+    async def conversation_cleared(self, user_id: str, peer_id: str):
+        """Called after conversation_summaries.deleted()"""
+        self._cache.pop(user_id, None)
+        self._changed([user_id])
+
+    def invalidate(self, user_id: str):
+        """Forget the cached counters (written by another worker)"""
+        self._cache.pop(user_id, None)
+
+    def get_stats(self) -> dict:
+        return {
+            "cached_users": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "recounts": self.recounts
+        }
+
+    async def _inc(self, user_id: str, deltas: Dict[str, int]):
+        if self.db is None or not user_id:
+            return
+        await self.db.unread_counters.update_one(
+            {"user_id": user_id},
+            {"$inc": deltas, "$set": {"updated_at": datetime.now(timezone.utc)}}
+        )
+        self._apply(user_id, deltas)
+        self._changed([user_id])
+
+    def _changed(self, user_ids: Iterable[str]):
+        if self.on_change is not None:
+            self.on_change(user_ids)
+
+    def _apply(self, user_id: str, deltas: Dict[str, int]):
+        """Write-through to the cached entry (if any)"""
+        entry = self._cache.get(user_id)
+        if entry is None:
+            return
+        counters = entry[0]
+        for field, delta in deltas.items():
+            if field.startswith("conversations."):
+                peer_id = field.split(".", 1)[1]
+                conversations = counters["conversations"]
+                conversations[peer_id] = max(0, conversations.get(peer_id, 0) + delta)
+                if not conversations[peer_id]:
+                    del conversations[peer_id]
+            else:
+                counters[field] = max(0, counters[field] + delta)
+
+    def _store(self, user_id: str, counters: dict):
+        self._cache.pop(user_id, None)
+        self._cache[user_id] = (counters, time.monotonic() + CACHE_TTL)
+        while len(self._cache) > MAX_CACHED_USERS:
+            self._cache.popitem(last=False)
+
+    async def _ensure_indexes(self):
+        if self._indexes_ready:
+            return
+        await self.db.unread_counters.create_index("user_id", unique=True)
+        await self.db.notifications.create_index([("user_id", 1), ("is_read", 1)])
+        await self.db.messages.create_index([("recipient_id", 1), ("is_read", 1), ("sender_id", 1)])
+        self._indexes_ready = True
+
+
+# Global instance (database is set on startup)
+unread_counters = UnreadCounters()
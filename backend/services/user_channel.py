@@ -0,0 +1,283 @@
+"""
+User Channel
+Per-user WebSocket carrying new notifications, direct messages and unread
+counter changes as they happen; events are appended to a capped
+`user_events` collection that every worker tails, so a socket held by
+one worker receives events produced on any other
+"""
+import asyncio
+import logging
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from pymongo import CursorType
+
+from services.live_protocol import FrameCache, LiveSocket
+from services.unread_counters import unread_counters
+
+logger = logging.getLogger(__name__)
+
+# Size of the capped user_events collection (oldest events are overwritten)
+EVENTS_COLLECTION_BYTES = 64 * 1024 * 1024
+# Published events are delivered and written to user_events in one batch
+# per interval; counter changes of a user within it become one frame
+FLUSH_INTERVAL = 0.05
+# Open sockets kept per user (tabs / devices); the oldest is closed beyond this
+MAX_SOCKETS_PER_USER = 10
+# Pause before re-opening the tailable cursor (empty collection, errors)
+TAIL_RETRY_DELAY = 1.0
+# Event ids remembered to skip replays after a reopen
+MAX_SEEN_EVENTS = 10000
+
+
+def _plain(doc: dict) -> dict:
+    """Drop the Mongo _id and make datetimes JSON-safe"""
+    return {
+        key: value.isoformat() if isinstance(value, datetime) else value
+        for key, value in doc.items() if key != "_id"
+    }
+
+
+class UserChannel:
+    """
+    Per-user socket registry with cross-worker delivery
+
+    - Frames use the live-room wire protocol (JSON or MessagePack) and are
+      encoded once per event, like room broadcasts
+    - A socket first receives a `counters` snapshot, then `notification`,
+      `message` and `counters` events; clients no longer need to poll
+    - Counter events only carry the user ids whose counters changed: the
+      worker holding the socket reads the (cached) counters and sends them
+    - Without a usable user_events collection delivery stays local to the
+      producing worker
+    """
+
+    def __init__(self, db=None):
+        self.db = db
+        self.worker_id = uuid.uuid4().hex
+        # user_id -> open sockets
+        self.connections: Dict[str, List[LiveSocket]] = {}
+        # Waiting for the next flush: local deliveries, user_events documents,
+        # users whose counters changed here / on another worker
+        self._local: List[Tuple[List[str], dict]] = []
+        self._outgoing: List[dict] = []
+        self._changed: Set[str] = set()
+        self._dirty: Set[str] = set()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._tail_task: Optional[asyncio.Task] = None
+        self._shared = False
+
+        # Stats
+        self.published = 0
+        self.frames_sent = 0
+        self.remote_events = 0
+        self.remote_skipped = 0
+
+    def set_db(self, db):
+        self.db = db
+
+    async def start(self):
+        """Create the capped collection and start tailing it"""
+        try:
+            if "user_events" not in await self.db.list_collection_names():
+                await self.db.create_collection("user_events", capped=True, size=EVENTS_COLLECTION_BYTES)
+            self._shared = True
+        except Exception as e:
+            # Created concurrently by another worker
+            self._shared = "user_events" in await self.db.list_collection_names()
+            if not self._shared:
+                logger.warning(f"user_events unavailable ({e}); user channel delivers locally only")
+        if self._shared and (self._tail_task is None or self._tail_task.done()):
+            self._tail_task = asyncio.create_task(self._tail())
+        self._ensure_flush()
+
+    async def connect(self, conn: LiveSocket, user_id: str) -> LiveSocket:
+        """Register a user's accepted socket and send the current counters"""
+        sockets = self.connections.setdefault(user_id, [])
+        sockets.append(conn)
+        while len(sockets) > MAX_SOCKETS_PER_USER:
+            oldest = sockets.pop(0)
+            try:
+                await oldest.close(code=4009)
+            except Exception:
+                pass
+        await conn.send_json({"type": "counters", **await unread_counters.get(user_id)})
+        self._ensure_flush()
+        return conn
+
+    def disconnect(self, user_id: str, conn: LiveSocket):
+        sockets = self.connections.get(user_id)
+        if not sockets or conn not in sockets:
+            return
+        sockets.remove(conn)
+        if not sockets:
+            del self.connections[user_id]
+
+    def publish(self, user_ids: Iterable[str], message: dict):
+        """
+        Send an event to every socket of the given users, on any worker
+
+        Args:
+            user_ids: Recipients
+            message: Event with a "type" (JSON-safe)
+        """
+        user_ids = [user_id for user_id in dict.fromkeys(user_ids) if user_id]
+        if not user_ids:
+            return
+        self.published += 1
+        self._local.append((user_ids, message))
+        if self._shared:
+            self._outgoing.append(self._event(user_ids, message))
+        self._ensure_flush()
+
+    def notification(self, notification: dict):
+        """A notification was stored for notification["user_id"]"""
+        self.publish([notification.get("user_id")], {
+            "type": "notification",
+            "notification": _plain(notification)
+        })
+
+    def message(self, message: dict):
+        """A direct message was stored for message["recipient_id"]"""
+        message = _plain(message)
+        if (message.get("attachment_url") or "").startswith("data:"):
+            # Inline attachments stay in the messages API
+            message["attachment_url"] = None
+            message["has_attachment"] = True
+        self.publish([message.get("recipient_id")], {
+            "type": "message",
+            "message": message
+        })
+
+    def counters_changed(self, user_ids: Iterable[str]):
+        """unread_counters hook: these users' counters were written"""
+        for user_id in user_ids:
+            if user_id:
+                self._changed.add(user_id)
+        self._ensure_flush()
+
+    async def close(self):
+        for task in (self._flush_task, self._tail_task):
+            if task and not task.done():
+                task.cancel()
+        await self.flush()
+
+    def get_stats(self) -> dict:
+        return {
+            "worker_id": self.worker_id,
+            "users": len(self.connections),
+            "sockets": sum(len(sockets) for sockets in self.connections.values()),
+            "cross_worker": self._shared,
+            "tailing": self._tail_task is not None and not self._tail_task.done(),
+            "published": self.published,
+            "frames_sent": self.frames_sent,
+            "remote_events": self.remote_events,
+            "remote_skipped": self.remote_skipped
+        }
+
+    async def flush(self):
+        """Deliver pending events locally and hand them to other workers"""
+        local, self._local = self._local, []
+        outgoing, self._outgoing = self._outgoing, []
+        changed, self._changed = self._changed, set()
+        dirty, self._dirty = self._dirty | changed, set()
+
+        if changed and self._shared:
+            outgoing.append(self._event(sorted(changed), {"type": "counters"}))
+        if outgoing and self.db is not None:
+            try:
+                await self.db.user_events.insert_many(outgoing, ordered=False)
+            except Exception as e:
+                logger.error(f"user_events write error ({len(outgoing)} events): {e}")
+
+        for user_ids, message in local:
+            await self._deliver(user_ids, message)
+        for user_id in dirty:
+            if user_id in self.connections:
+                counters = await unread_counters.get(user_id)
+                await self._deliver([user_id], {"type": "counters", **counters})
+
+    def _event(self, user_ids: List[str], message: dict) -> dict:
+        return {
+            "origin": self.worker_id,
+            "user_ids": user_ids,
+            "message": message,
+            "created_at": datetime.now(timezone.utc)
+        }
+
+    async def _deliver(self, user_ids: List[str], message: dict):
+        frames = FrameCache(message)
+        for user_id in user_ids:
+            for conn in list(self.connections.get(user_id, ())):
+                try:
+                    await conn.send_frame(frames.get(conn.encoding))
+                    self.frames_sent += 1
+                except Exception:
+                    self.disconnect(user_id, conn)
+
+    def _receive(self, event: dict):
+        """An event published by another worker"""
+        local = [user_id for user_id in event.get("user_ids") or [] if user_id in self.connections]
+        if not local:
+            self.remote_skipped += 1
+            return
+        self.remote_events += 1
+        message = event.get("message") or {}
+        if message.get("type") == "counters":
+            # Written on the other worker: our cached copy is stale
+            for user_id in local:
+                unread_counters.invalidate(user_id)
+            self._dirty.update(local)
+        else:
+            self._local.append((local, message))
+        self._ensure_flush()
+
+    def _ensure_flush(self):
+        if self._flush_task is None or self._flush_task.done():
+            try:
+                self._flush_task = asyncio.get_running_loop().create_task(self._run_flush())
+            except RuntimeError:
+                # No running loop (import time / sync caller): next call starts it
+                pass
+
+    async def _run_flush(self):
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"User channel flush error: {e}")
+
+    async def _tail(self):
+        """Follow user_events written by other workers (tailable await cursor)"""
+        last = await self.db.user_events.find_one({}, {"created_at": 1}, sort=[("$natural", -1)])
+        since = last["created_at"] if last else None
+        # ObjectIds from different workers are not ordered, so a reopened
+        # cursor starts at the last timestamp and skips events already seen
+        seen: "OrderedDict[object, None]" = OrderedDict()
+        logger.info(f"User channel tailing user_events (worker {self.worker_id[:8]})")
+        while True:
+            query = {"origin": {"$ne": self.worker_id}}
+            if since is not None:
+                query["created_at"] = {"$gte": since}
+            try:
+                cursor = self.db.user_events.find(query, cursor_type=CursorType.TAILABLE_AWAIT)
+                async for event in cursor:
+                    if event["_id"] in seen:
+                        continue
+                    seen[event["_id"]] = None
+                    if len(seen) > MAX_SEEN_EVENTS:
+                        seen.popitem(last=False)
+                    since = event["created_at"]
+                    self._receive(event)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"user_events tail error: {e}")
+            # Cursor died (empty collection, capped rollover, error): reopen
+            await asyncio.sleep(TAIL_RETRY_DELAY)
+
+# Global instance (database is set on startup)
+user_channel = UserChannel()
@@ -0,0 +1,437 @@
+"""
+Web Push Delivery
+Sends browser push messages: payloads are encrypted (RFC 8291,
+aes128gcm) and VAPID JWTs signed (RFC 8292) on a worker pool so the
+crypto never blocks the event loop, then posted over a pooled HTTP
+client with bounded concurrency. Subscriptions the push service reports
+as gone (404/410) are pruned
+"""
+import asyncio
+import base64
+import json
+import logging
+import os
+import struct
+import time
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.asymmetric.utils import decode_dss_signature
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+from services.notification_outbox import OutboxPermanentError, OutboxRetry, _iterate, notification_outbox
+
+logger = logging.getLogger(__name__)
+
+# Concurrent requests to push services per API process
+PUSH_CONCURRENCY = int(os.environ.get("WEB_PUSH_CONCURRENCY", "50"))
+# Encryption / signing pool: "thread" or "process"
+CRYPTO_POOL = os.environ.get("WEB_PUSH_CRYPTO_POOL", "thread")
+CRYPTO_WORKERS = int(os.environ.get("WEB_PUSH_CRYPTO_WORKERS", str(min(4, os.cpu_count() or 1))))
+# VAPID JWTs are valid for 12h and reused per push service until close to expiry
+VAPID_EXPIRY = 12 * 3600
+VAPID_REFRESH_MARGIN = 600
+# How long the push service keeps an undelivered message (seconds)
+DEFAULT_TTL = 24 * 3600
+# aes128gcm record size; one record holds the whole payload
+RECORD_SIZE = 4096
+MAX_PAYLOAD_SIZE = RECORD_SIZE - 16 - 1 - 86
+# Latency samples kept per push service for percentiles
+LATENCY_SAMPLES = 500
+# Subscriptions sent per web_push_batch outbox job
+PUSH_BATCH_SIZE = 100
+
+
+def _b64url(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _b64url_decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def _hkdf(salt: bytes, ikm: bytes, info: bytes, length: int) -> bytes:
+    return HKDF(algorithm=hashes.SHA256(), length=length, salt=salt, info=info).derive(ikm)
+
+
+def encrypt_payload(p256dh: str, auth: str, payload: bytes) -> bytes:
+    """
+    Encrypt a push message body for one subscription (RFC 8291)
+
+    Runs on the crypto pool; module-level so a process pool can pickle it.
+
+    Args:
+        p256dh: Subscription public key (base64url, uncompressed P-256 point)
+        auth: Subscription auth secret (base64url)
+        payload: Message bytes
+
+    Returns:
+        aes128gcm body (header + single record)
+    """
+    ua_public = _b64url_decode(p256dh)
+    auth_secret = _b64url_decode(auth)
+    ua_key = ec.EllipticCurvePublicKey.from_encoded_point(ec.SECP256R1(), ua_public)
+
+    as_private = ec.generate_private_key(ec.SECP256R1())
+    as_public = as_private.public_key().public_bytes(
+        serialization.Encoding.X962, serialization.PublicFormat.UncompressedPoint
+    )
+    shared_secret = as_private.exchange(ec.ECDH(), ua_key)
+
+    ikm = _hkdf(auth_secret, shared_secret, b"WebPush: info\x00" + ua_public + as_public, 32)
+    salt = os.urandom(16)
+    cek = _hkdf(salt, ikm, b"Content-Encoding: aes128gcm\x00", 16)
+    nonce = _hkdf(salt, ikm, b"Content-Encoding: nonce\x00", 12)
+
+    # 0x02 marks the last (only) record; no padding
+    ciphertext = AESGCM(cek).encrypt(nonce, payload + b"\x02", None)
+    header = salt + struct.pack("!IB", RECORD_SIZE, len(as_public)) + as_public
+    return header + ciphertext
+
+
+def sign_vapid(private_key: str, audience: str, subject: str, expires_at: int) -> str:
+    """
+    ES256-signed VAPID JWT for one push service origin (RFC 8292)
+
+    Args:
+        private_key: Raw P-256 private key (base64url, as printed by
+            `npx web-push generate-vapid-keys`)
+        audience: Push service origin, e.g. "https://fcm.googleapis.com"
+        subject: Contact URI ("mailto:..." or "https://...")
+        expires_at: Unix time the token expires
+    """
+    key = ec.derive_private_key(int.from_bytes(_b64url_decode(private_key), "big"), ec.SECP256R1())
+    header = _b64url(json.dumps({"typ": "JWT", "alg": "ES256"}, separators=(",", ":")).encode())
+    claims = _b64url(json.dumps(
+        {"aud": audience, "exp": expires_at, "sub": subject}, separators=(",", ":")
+    ).encode())
+    signing_input = f"{header}.{claims}".encode()
+    r, s = decode_dss_signature(key.sign(signing_input, ec.ECDSA(hashes.SHA256())))
+    return f"{header}.{claims}.{_b64url(r.to_bytes(32, 'big') + s.to_bytes(32, 'big'))}"
+
+
+class _Latency:
+    """Latency / outcome counters of one push service"""
+
+    def __init__(self):
+        self.samples: deque = deque(maxlen=LATENCY_SAMPLES)
+        self.sent = 0
+        self.failed = 0
+        self.gone = 0
+
+    def to_dict(self) -> dict:
+        ordered = sorted(self.samples)
+
+        def pct(p):
+            return round(ordered[min(len(ordered) - 1, int(len(ordered) * p))], 1) if ordered else None
+
+        return {
+            "sent": self.sent,
+            "failed": self.failed,
+            "gone": self.gone,
+            "p50_ms": pct(0.5),
+            "p95_ms": pct(0.95),
+            "max_ms": round(ordered[-1], 1) if ordered else None
+        }
+
+
+class WebPushService:
+    """
+    Web Push sender shared by the push routes and outbox jobs
+
+    - Encryption and JWT signing run on CRYPTO_POOL; JWTs are cached per
+      push service origin, so signing happens about twice a day
+    - At most PUSH_CONCURRENCY requests are in flight
+    - Latency is tracked per push service origin (FCM, Mozilla, Apple, ...)
+    - Delivered through the `web_push_batch` / `web_push` outbox jobs:
+      gone subscriptions are deleted, throttled / failing ones retried
+    """
+
+    def __init__(self, db=None):
+        self.db = db
+        self.public_key: Optional[str] = None
+        self.private_key: Optional[str] = None
+        self.subject = os.environ.get("VAPID_SUBJECT", "mailto:admin@example.com")
+        self._client: Optional[httpx.AsyncClient] = None
+        self._executor: Optional[Executor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        # origin -> (jwt, expires_at)
+        self._vapid_tokens: Dict[str, Tuple[str, int]] = {}
+        self._latency: Dict[str, _Latency] = {}
+        self._indexes_ready = False
+
+        # Stats
+        self.sent = 0
+        self.failed = 0
+        self.pruned = 0
+        self.rate_limited = 0
+
+    def set_db(self, db):
+        self.db = db
+
+    def set_vapid_keys(self, public_key: str, private_key: str, subject: Optional[str] = None):
+        self.public_key = public_key
+        self.private_key = private_key
+        if subject:
+            self.subject = subject
+        self._vapid_tokens.clear()
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=10.0,
+                limits=httpx.Limits(max_connections=PUSH_CONCURRENCY, max_keepalive_connections=PUSH_CONCURRENCY)
+            )
+        return self._client
+
+    async def send(
+        self,
+        subscription: dict,
+        message: dict,
+        ttl: int = DEFAULT_TTL,
+        urgency: str = "normal"
+    ) -> dict:
+        """
+        Send one push message
+
+        Args:
+            subscription: Browser PushSubscription (endpoint, keys.p256dh, keys.auth)
+            message: JSON payload for the service worker
+            ttl: Seconds the push service may hold the message
+            urgency: very-low / low / normal / high
+
+        Returns:
+            {"success", "status_code", "gone", "retry_after", "error"}
+        """
+        endpoint = subscription.get("endpoint")
+        keys = subscription.get("keys") or {}
+        if not endpoint or not keys.get("p256dh") or not keys.get("auth"):
+            return {"success": False, "gone": True, "error": "Incomplete subscription"}
+        if not self.private_key:
+            return {"success": False, "error": "VAPID keys not configured"}
+
+        data = json.dumps(message, ensure_ascii=False, separators=(",", ":")).encode()
+        if len(data) > MAX_PAYLOAD_SIZE:
+            return {"success": False, "error": f"Payload exceeds {MAX_PAYLOAD_SIZE} bytes"}
+
+        parts = urlsplit(endpoint)
+        origin = f"{parts.scheme}://{parts.netloc}"
+        loop = asyncio.get_running_loop()
+        try:
+            body = await loop.run_in_executor(self._pool(), encrypt_payload, keys["p256dh"], keys["auth"], data)
+        except Exception as e:
+            # Malformed keys (bad base64, not a P-256 point): this subscription can never work
+            self.failed += 1
+            return {"success": False, "gone": True, "error": f"Invalid subscription keys: {e}"}
+        token = await self._vapid_token(origin)
+
+        headers = {
+            "TTL": str(ttl),
+            "Urgency": urgency,
+            "Content-Encoding": "aes128gcm",
+            "Content-Type": "application/octet-stream",
+            "Authorization": f"vapid t={token}, k={self.public_key}"
+        }
+        latency = self._latency.setdefault(origin, _Latency())
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(PUSH_CONCURRENCY)
+
+        async with self._slots:
+            started = time.perf_counter()
+            try:
+                response = await self.client.post(endpoint, content=body, headers=headers)
+            except httpx.HTTPError as e:
+                latency.failed += 1
+                self.failed += 1
+                return {"success": False, "error": str(e) or type(e).__name__}
+            latency.samples.append((time.perf_counter() - started) * 1000)
+
+        status_code = response.status_code
+        if status_code in (200, 201, 202):
+            latency.sent += 1
+            self.sent += 1
+            return {"success": True, "status_code": status_code}
+
+        latency.failed += 1
+        self.failed += 1
+        result = {"success": False, "status_code": status_code, "error": response.text[:200]}
+        if status_code in (404, 410):
+            latency.gone += 1
+            result["gone"] = True
+        elif status_code == 429:
+            self.rate_limited += 1
+            retry_after = response.headers.get("Retry-After")
+            result["retry_after"] = float(retry_after) if retry_after and retry_after.isdigit() else None
+        elif status_code in (401, 403):
+            # JWT rejected (e.g. clock skew): sign a fresh one next time
+            self._vapid_tokens.pop(origin, None)
+        return result
+
+    async def prune(self, endpoints: List[str]) -> int:
+        """Delete subscriptions the push service no longer knows"""
+        if self.db is None or not endpoints:
+            return 0
+        await self._ensure_indexes()
+        result = await self.db.push_subscriptions.delete_many(
+            {"subscription.endpoint": {"$in": endpoints}}
+        )
+        self.pruned += result.deleted_count
+        return result.deleted_count
+
+    async def enqueue(self, subscriptions, message: dict, key: str) -> int:
+        """
+        Queue a message for push_subscriptions documents
+
+        Subscriptions (a list or a cursor) are grouped into
+        `web_push_batch` outbox jobs of PUSH_BATCH_SIZE.
+
+        Args:
+            subscriptions: push_subscriptions documents (id, subscription)
+            message: JSON payload for the service worker
+            key: Idempotency key of this send
+
+        Returns:
+            Number of subscriptions queued
+        """
+        queued = 0
+        job_count = 0
+        batch: List[dict] = []
+        jobs: List[dict] = []
+
+        async for sub in _iterate(subscriptions):
+            batch.append({"id": sub.get("id"), **(sub.get("subscription") or {})})
+            queued += 1
+            if len(batch) >= PUSH_BATCH_SIZE:
+                jobs.append(self._batch_job(batch, message, f"{key}:{job_count}"))
+                job_count += 1
+                batch = []
+            if len(jobs) >= PUSH_BATCH_SIZE:
+                await notification_outbox.enqueue_many(jobs)
+                jobs = []
+        if batch:
+            jobs.append(self._batch_job(batch, message, f"{key}:{job_count}"))
+        await notification_outbox.enqueue_many(jobs)
+        return queued
+
+    def get_stats(self) -> dict:
+        return {
+            "configured": bool(self.private_key),
+            "crypto_pool": CRYPTO_POOL,
+            "sent": self.sent,
+            "failed": self.failed,
+            "pruned": self.pruned,
+            "rate_limited": self.rate_limited,
+            "push_services": {origin: stats.to_dict() for origin, stats in self._latency.items()}
+        }
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    # ----- outbox handlers -----
+
+    async def deliver_batch(self, job: dict) -> dict:
+        """
+        `web_push_batch` outbox handler
+
+        payload: subscriptions (PushSubscription + id), message.
+        Sends to every subscription concurrently; failures that may
+        succeed later (including unexpected errors) become individual
+        `web_push` jobs so the batch is never re-sent as a whole.
+        """
+        payload = job["payload"]
+        subscriptions = payload["subscriptions"]
+        results = await asyncio.gather(*[
+            self.send(sub, payload["message"]) for sub in subscriptions
+        ], return_exceptions=True)
+        results = [
+            {"success": False, "error": str(r) or type(r).__name__} if isinstance(r, Exception) else r
+            for r in results
+        ]
+
+        gone = []
+        retries = []
+        key = job.get("idempotency_key") or job["id"]
+        for sub, result in zip(subscriptions, results):
+            if result.get("success"):
+                continue
+            if result.get("gone"):
+                gone.append(sub.get("endpoint"))
+            elif result.get("status_code") in (None, 429) or result["status_code"] >= 500:
+                retries.append(notification_outbox.new_job(
+                    "web_push",
+                    {"subscription": sub, "message": payload["message"]},
+                    idempotency_key=f"{key}:{sub.get('id') or sub.get('endpoint')}",
+                    delay=result.get("retry_after") or 0,
+                    parent_id=job["id"]
+                ))
+        await self.prune([endpoint for endpoint in gone if endpoint])
+        await notification_outbox.enqueue_many(retries)
+        return {
+            "sent": sum(1 for r in results if r.get("success")),
+            "pruned": len(gone),
+            "retrying": len(retries)
+        }
+
+    async def deliver_one(self, job: dict):
+        """`web_push` outbox handler; payload: subscription, message"""
+        subscription = job["payload"]["subscription"]
+        result = await self.send(subscription, job["payload"]["message"])
+        if result.get("success"):
+            return None
+        if result.get("gone"):
+            await self.prune([subscription.get("endpoint")])
+            raise OutboxPermanentError("Push subscription is gone")
+        if result.get("status_code") and result["status_code"] < 500 and result["status_code"] != 429:
+            raise OutboxPermanentError(result.get("error") or f"Push service returned {result['status_code']}")
+        raise OutboxRetry(result.get("error") or "Push send failed", result.get("retry_after"))
+
+    # ----- internals -----
+
+    def _batch_job(self, subscriptions: List[dict], message: dict, key: str) -> dict:
+        return notification_outbox.new_job(
+            "web_push_batch",
+            {"subscriptions": subscriptions, "message": message},
+            idempotency_key=key
+        )
+
+    def _pool(self) -> Executor:
+        if self._executor is None:
+            if CRYPTO_POOL == "process":
+                self._executor = ProcessPoolExecutor(max_workers=CRYPTO_WORKERS)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=CRYPTO_WORKERS, thread_name_prefix="web-push")
+        return self._executor
+
+    async def _ensure_indexes(self):
+        if self._indexes_ready:
+            return
+        await self.db.push_subscriptions.create_index("subscription.endpoint")
+        self._indexes_ready = True
+
+    async def _vapid_token(self, origin: str) -> str:
+        cached = self._vapid_tokens.get(origin)
+        now = int(time.time())
+        if cached and cached[1] - now > VAPID_REFRESH_MARGIN:
+            return cached[0]
+        expires_at = now + VAPID_EXPIRY
+        token = await asyncio.get_running_loop().run_in_executor(
+            self._pool(), sign_vapid, self.private_key, origin, self.subject, expires_at
+        )
+        self._vapid_tokens[origin] = (token, expires_at)
+        return token
+
+
+# Global instance
+web_push = WebPushService()
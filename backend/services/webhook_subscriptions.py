@@ -0,0 +1,180 @@
+"""
+Webhook Subscriptions Index
+Active webhooks held in memory as event -> subscribers, loaded once at
+startup and kept current by the webhook routes and, on replica sets, a
+change stream; events nobody subscribed to cost no database round trip
+"""
+import asyncio
+import logging
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Fields needed to deliver an event
+WEBHOOK_PROJECTION = {
+    "id": 1,
+    "url": 1,
+    "secret": 1,
+    "events": 1,
+    "is_active": 1,
+    "telegram_bot_token": 1,
+    "telegram_chat_id": 1,
+}
+
+# Full reload interval when change streams are unavailable (standalone mongod)
+RELOAD_INTERVAL = 60.0
+
+
+class WebhookSubscriptions:
+    """
+    Event -> active webhooks map
+
+    - subscribers() answers from memory once loaded; the first call loads
+      the index if startup did not
+    - put()/remove() are called by every route that writes a webhook
+    - Delivery counters written by the webhook service do not touch the
+      index (the change stream ignores them)
+    """
+
+    def __init__(self, db=None):
+        self.db = db
+        # event -> {webhook_id: webhook}
+        self._by_event: Dict[str, Dict[str, dict]] = {}
+        # Mongo _id -> webhook id (change stream deletes only carry _id)
+        self._ids: Dict[object, str] = {}
+        self._loaded = False
+        self._loading: Optional[asyncio.Future] = None
+        self._watch_task: Optional[asyncio.Task] = None
+
+        # Stats
+        self.lookups = 0
+        self.empty_lookups = 0
+        self.reloads = 0
+
+    def set_db(self, db):
+        self.db = db
+
+    async def load(self):
+        """(Re)build the index from all active webhooks"""
+        if self._loading is not None:
+            return await self._loading
+        self._loading = asyncio.get_running_loop().create_future()
+        try:
+            by_event: Dict[str, Dict[str, dict]] = {}
+            ids: Dict[object, str] = {}
+            async for webhook in self.db.webhooks.find({"is_active": True}, WEBHOOK_PROJECTION):
+                ids[webhook.pop("_id")] = webhook["id"]
+                for event in webhook.get("events") or []:
+                    by_event.setdefault(event, {})[webhook["id"]] = webhook
+            self._by_event, self._ids = by_event, ids
+            self._loaded = True
+            self.reloads += 1
+            self._loading.set_result(None)
+        except Exception as e:
+            self._loading.set_exception(e)
+            # Nobody else awaits the future when the load fails alone
+            self._loading.exception()
+            raise
+        finally:
+            self._loading = None
+
+    async def subscribers(self, event: str) -> List[dict]:
+        """
+        Active webhooks subscribed to an event
+
+        Args:
+            event: Event name (e.g. 'reaction.added')
+
+        Returns:
+            Webhook documents (WEBHOOK_PROJECTION fields)
+        """
+        if not self._loaded:
+            await self.load()
+        self.lookups += 1
+        webhooks = self._by_event.get(event)
+        if not webhooks:
+            self.empty_lookups += 1
+            return []
+        return list(webhooks.values())
+
+    async def subscriber(self, event: str, webhook_id: str) -> Optional[dict]:
+        """A webhook if it is still active and subscribed to the event"""
+        if not self._loaded:
+            await self.load()
+        return (self._by_event.get(event) or {}).get(webhook_id)
+
+    def has_subscribers(self, event: str) -> bool:
+        return bool(self._by_event.get(event)) or not self._loaded
+
+    def put(self, webhook: dict):
+        """Index a created or updated webhook (inactive ones are removed)"""
+        webhook_id = webhook["id"]
+        self.remove(webhook_id)
+        if not webhook.get("is_active", True):
+            return
+        entry = {k: webhook[k] for k in WEBHOOK_PROJECTION if k in webhook}
+        if "_id" in webhook:
+            self._ids[webhook["_id"]] = webhook_id
+        for event in entry.get("events") or []:
+            self._by_event.setdefault(event, {})[webhook_id] = entry
+
+    def remove(self, webhook_id: str):
+        for event in list(self._by_event):
+            subscribers = self._by_event[event]
+            subscribers.pop(webhook_id, None)
+            if not subscribers:
+                del self._by_event[event]
+
+    def start_watch(self):
+        """Follow webhooks changes from other workers"""
+        if self._watch_task is None or self._watch_task.done():
+            self._watch_task = asyncio.create_task(self._watch())
+
+    async def close(self):
+        if self._watch_task and not self._watch_task.done():
+            self._watch_task.cancel()
+
+    def get_stats(self) -> dict:
+        return {
+            "events": {event: len(subscribers) for event, subscribers in self._by_event.items()},
+            "webhooks": len({wid for subscribers in self._by_event.values() for wid in subscribers}),
+            "lookups": self.lookups,
+            "empty_lookups": self.empty_lookups,
+            "reloads": self.reloads,
+            "watching": self._watch_task is not None and not self._watch_task.done()
+        }
+
+    async def _watch(self):
+        # Inserts, replaces, deletes and updates of subscription fields only
+        pipeline = [{"$match": {"$or": [
+            {"operationType": {"$in": ["insert", "replace", "delete"]}},
+            *[
+                {f"updateDescription.updatedFields.{field}": {"$exists": True}}
+                for field in WEBHOOK_PROJECTION if field != "id"
+            ]
+        ]}}]
+        try:
+            async with self.db.webhooks.watch(pipeline, full_document="updateLookup") as stream:
+                logger.info("Webhook subscriptions following change stream")
+                async for change in stream:
+                    doc = change.get("fullDocument")
+                    if doc and doc.get("id"):
+                        self.put(doc)
+                    else:
+                        webhook_id = self._ids.pop(change.get("documentKey", {}).get("_id"), None)
+                        if webhook_id:
+                            self.remove(webhook_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.info(f"Webhook change stream unavailable ({e}); reloading every {RELOAD_INTERVAL:.0f}s")
+            while True:
+                await asyncio.sleep(RELOAD_INTERVAL)
+                try:
+                    await self.load()
+                except Exception as e:
+                    logger.error(f"Webhook subscriptions reload error: {e}")
+
+
+# Global instance (database is set on startup)
+webhook_subscriptions = WebhookSubscriptions()
@@ -0,0 +1,233 @@
+"""
+XP Accrual Service
+Buffers XP awards in memory and writes them to MongoDB in batches,
+so live-room handlers never wait on XP bookkeeping
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+# Flush pending XP at least this often (seconds)
+FLUSH_INTERVAL = 2.0
+# ...or as soon as this many transactions are buffered
+MAX_PENDING_TRANSACTIONS = 500
+# Minimum seconds between badge checks for the same user
+BADGE_CHECK_DEBOUNCE = 60.0
+
+
+class XPAccrualService:
+    """
+    In-memory XP accumulator
+
+    - award() only appends to a buffer (no I/O on the caller's path)
+    - Transactions are flushed with one insert_many
+    - User totals are updated with one bulk_write of atomic $inc ops
+    - A failed flush puts its batch back for the next one; transactions
+      carry their _id, so re-inserting an already written one is a no-op
+    - Of the user $incs, only those the bulk_write reports as failed are
+      retried; when the outcome is unknown (e.g. the connection dropped
+      mid-write) every total of the batch is retried, so a user may be
+      credited twice (at-least-once)
+    - Participation badge checks run at most once per user per
+      BADGE_CHECK_DEBOUNCE seconds
+    """
+
+    def __init__(self, db=None):
+        self.db = db
+        self._transactions: List[dict] = []
+        # user_id -> {breakdown_key: xp}
+        self._totals: Dict[str, Dict[str, int]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+
+        # user_id -> monotonic time of last badge check
+        self._badge_checked_at: Dict[str, float] = {}
+        # users whose badge check was deferred by the debounce window
+        self._badge_dirty: set = set()
+
+        # Stats
+        self.awarded = 0
+        self.flushes = 0
+
+    def set_db(self, db):
+        self.db = db
+
+    def award(
+        self,
+        user_id: str,
+        action: str,
+        xp_amount: int,
+        breakdown_key: str,
+        metadata: dict = None
+    ):
+        """
+        Queue an XP award
+
+        Args:
+            user_id: User receiving XP
+            action: Transaction action name (e.g. "live_chat_message")
+            xp_amount: XP to add
+            breakdown_key: xp_breakdown field to increment
+            metadata: Extra data stored on the transaction
+        """
+        if xp_amount == 0:
+            return
+
+        self._transactions.append({
+            "_id": ObjectId(),
+            "user_id": user_id,
+            "action": action,
+            "xp_earned": xp_amount,
+            "timestamp": datetime.now(timezone.utc),
+            "metadata": metadata or {}
+        })
+        user_totals = self._totals.setdefault(user_id, {})
+        user_totals[breakdown_key] = user_totals.get(breakdown_key, 0) + xp_amount
+        self.awarded += 1
+
+        self._ensure_task()
+        if len(self._transactions) >= MAX_PENDING_TRANSACTIONS:
+            self._wakeup.set()
+
+    async def flush(self):
+        """Write all buffered XP to the database"""
+        async with self._flush_lock:
+            if self.db is None or not (self._transactions or self._totals):
+                return
+
+            transactions, self._transactions = self._transactions, []
+            totals, self._totals = self._totals, {}
+            written = False
+
+            try:
+                # Only credit users that exist (one query per batch)
+                existing = await self.db.users.find(
+                    {"id": {"$in": list(totals.keys())}},
+                    {"_id": 0, "id": 1}
+                ).to_list(length=None)
+                existing_ids = {u["id"] for u in existing}
+
+                for user_id in totals.keys() - existing_ids:
+                    logger.warning(f"User {user_id} not found for XP award")
+
+                transactions = [t for t in transactions if t["user_id"] in existing_ids]
+                if transactions:
+                    try:
+                        await self.db.xp_transactions.insert_many(transactions, ordered=False)
+                    except BulkWriteError as e:
+                        # Duplicates are transactions a failed flush already wrote
+                        if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+                            raise
+                written = True
+
+                users = list(existing_ids)
+                ops = []
+                for user_id in users:
+                    inc = {f"xp_breakdown.{key}": xp for key, xp in totals[user_id].items()}
+                    inc["xp_total"] = sum(totals[user_id].values())
+                    ops.append(UpdateOne({"id": user_id}, {"$inc": inc}))
+                if ops:
+                    try:
+                        await self.db.users.bulk_write(ops, ordered=False)
+                    except BulkWriteError as e:
+                        # Unordered: every op not listed in writeErrors was applied
+                        failed = {users[err["index"]] for err in e.details.get("writeErrors", [])}
+                        logger.error(f"XP flush error ({len(failed)} of {len(ops)} users), retrying those: {e}")
+                        self._requeue([], {user_id: totals[user_id] for user_id in failed})
+                        existing_ids -= failed
+
+                self.flushes += 1
+                logger.info(f"Flushed {len(transactions)} XP transactions for {len(ops)} users")
+            except Exception as e:
+                # Outcome of the $incs unknown: retry them all (at-least-once)
+                logger.error(f"XP flush error ({len(transactions)} transactions, {len(totals)} users), retrying: {e}")
+                self._requeue([] if written else transactions, totals)
+                return
+
+            self._badge_dirty.update(existing_ids)
+
+        await self._run_badge_checks()
+
+    def _requeue(self, transactions: List[dict], totals: Dict[str, Dict[str, int]]):
+        """Put a failed batch back in front of what was awarded meanwhile"""
+        self._transactions = transactions + self._transactions
+        for user_id, user_totals in totals.items():
+            merged = self._totals.setdefault(user_id, {})
+            for key, xp in user_totals.items():
+                merged[key] = merged.get(key, 0) + xp
+        self._ensure_task()
+
+    async def close(self):
+        """Stop the flush loop and write whatever is still buffered"""
+        if self._flush_task and not self._flush_task.done():
+            self._flush_task.cancel()
+        await self.flush()
+
+    def get_stats(self) -> dict:
+        return {
+            "awarded": self.awarded,
+            "flushes": self.flushes,
+            "pending_transactions": len(self._transactions),
+            "pending_users": len(self._totals),
+            "pending_badge_checks": len(self._badge_dirty)
+        }
+
+    async def _run_badge_checks(self):
+        """Check participation badges for users outside the debounce window"""
+        now = time.monotonic()
+        due = [
+            user_id for user_id in self._badge_dirty
+            if now - self._badge_checked_at.get(user_id, 0) >= BADGE_CHECK_DEBOUNCE
+        ]
+        if not due:
+            return
+
+        from routes.badges import check_and_award_participation_badges
+
+        for user_id in due:
+            self._badge_dirty.discard(user_id)
+            self._badge_checked_at[user_id] = now
+            try:
+                await check_and_award_participation_badges(user_id)
+            except Exception as e:
+                logger.error(f"Badge check error: {e}")
+
+        # Forget users that have been quiet for a while
+        if len(self._badge_checked_at) > 10000:
+            cutoff = now - BADGE_CHECK_DEBOUNCE
+            self._badge_checked_at = {
+                user_id: t for user_id, t in self._badge_checked_at.items() if t >= cutoff
+            }
+
+    def _ensure_task(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        """Flush loop; also picks up badge checks deferred by the debounce"""
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            if self._transactions or self._totals:
+                await self.flush()
+            elif self._badge_dirty:
+                await self._run_badge_checks()
+            else:
+                break
+
+
+# Global instance (database is set from routes.live_sessions.set_db)
+xp_accrual = XPAccrualService()
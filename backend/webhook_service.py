@@ -1,17 +1,34 @@
 """
 Webhook Service for FOMO Podcasts Platform
 Handles webhook delivery with retry logic and Telegram integration
+
+Every delivery is a `webhook_delivery` outbox job, so retries and
+deliveries waiting on an open circuit survive restarts. The job only
+hands its attempt to the endpoint's bounded queue (concurrency slots,
+circuit breaker) and completes; the endpoint worker records the outcome
+as a delayed follow-up job, so a slow endpoint never holds an outbox
+worker. An attempt still queued in memory when the process dies is
+lost. Call logs / stats are written in batches
 """
 
 import httpx
 import asyncio
+import importlib.util
 import logging
 import hashlib
 import hmac
 import json
+import time
 from typing import Dict, List, Optional
 from datetime import datetime, timezone
 from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+
+from services.notification_outbox import OutboxPermanentError, notification_outbox
+from services.webhook_subscriptions import webhook_subscriptions
+
+# httpx negotiates HTTP/2 when h2 is installed (requirements.txt)
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
 
 logger = logging.getLogger(__name__)
 
@@ -31,107 +48,366 @@ WEBHOOK_EVENTS = [
 MAX_RETRIES = 3
 RETRY_DELAYS = [1, 5, 15]  # seconds (exponential-ish backoff)
 
+# Pending deliveries per endpoint; beyond this jobs are re-scheduled
+ENDPOINT_QUEUE_SIZE = 1000
+# Times one attempt is re-scheduled (open circuit, full queue) before the
+# delivery is given up
+MAX_DEFERRALS = 20
+# Concurrent requests per endpoint
+ENDPOINT_CONCURRENCY = 4
+# Consecutive failures that open an endpoint's circuit
+BREAKER_THRESHOLD = 5
+# Open-circuit cooldown, doubled on every failed probe
+BREAKER_COOLDOWN = 30.0
+MAX_BREAKER_COOLDOWN = 600.0
+# Idle endpoint workers exit after this long
+ENDPOINT_IDLE_SECONDS = 300.0
+# Seconds between log / stats flushes
+FLUSH_INTERVAL = 1.0
+
+
+class _Endpoint:
+    """Queue, concurrency slots and circuit breaker of one webhook"""
+
+    def __init__(self, webhook_id: str):
+        self.webhook_id = webhook_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=ENDPOINT_QUEUE_SIZE)
+        self.slots = asyncio.Semaphore(ENDPOINT_CONCURRENCY)
+        self.in_flight = 0
+        self.worker: Optional[asyncio.Task] = None
+        # closed -> open (after BREAKER_THRESHOLD failures) -> half_open (one probe)
+        self.state = "closed"
+        self.failures = 0
+        self.open_until = 0.0
+        self.cooldown = BREAKER_COOLDOWN
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+        self.cooldown = BREAKER_COOLDOWN
+
+    def record_failure(self):
+        if self.state == "open":
+            # Requests already in flight when the circuit opened
+            return
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= BREAKER_THRESHOLD:
+            logger.warning(f"Webhook {self.webhook_id} circuit open for {self.cooldown:.0f}s")
+            self.state = "open"
+            self.open_until = time.monotonic() + self.cooldown
+            self.cooldown = min(self.cooldown * 2, MAX_BREAKER_COOLDOWN)
+
+    def to_dict(self) -> dict:
+        return {
+            "state": self.state,
+            "queued": self.queue.qsize(),
+            "in_flight": self.in_flight,
+            "consecutive_failures": self.failures,
+            "open_for": round(max(0.0, self.open_until - time.monotonic()), 1) if self.state == "open" else 0
+        }
+
 
 class WebhookService:
     """Service for managing and triggering webhooks"""
     
     def __init__(self, db: AsyncIOMotorDatabase):
         self.db = db
-        self.client = httpx.AsyncClient(timeout=10.0)
+        webhook_subscriptions.set_db(db)
+        # Pooled keep-alive client shared by all endpoints (HTTP/2 when h2 is installed)
+        self.client = httpx.AsyncClient(
+            timeout=10.0,
+            http2=HTTP2_AVAILABLE,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=50, keepalive_expiry=60)
+        )
+        self._endpoints: Dict[str, _Endpoint] = {}
+        self._log_buffer: List[Dict] = []
+        # webhook_id -> [total, successful, failed]
+        self._stats_buffer: Dict[str, List[int]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        notification_outbox.register("webhook_delivery", self.deliver_job)
+        
+        # Stats
+        self.queued = 0
+        self.delivered = 0
+        self.failed = 0
+        self.retried = 0
+        self.deferred = 0
     
     async def close(self):
-        """Close HTTP client"""
+        """Stop endpoint workers, write buffered logs and close HTTP client"""
+        for endpoint in self._endpoints.values():
+            if endpoint.worker and not endpoint.worker.done():
+                endpoint.worker.cancel()
+        if self._flush_task and not self._flush_task.done():
+            self._flush_task.cancel()
+        await self.flush()
         await self.client.aclose()
     
-    async def trigger_webhooks(self, event: str, data: Dict):
+    async def trigger_webhooks(
+        self,
+        event: str,
+        data: Dict,
+        parent_id: Optional[str] = None,
+        key: Optional[str] = None
+    ) -> int:
         """
         Trigger all active webhooks subscribed to this event
         
+        Only enqueues one `webhook_delivery` outbox job per webhook.
+        
         Args:
             event: Event name (e.g., 'podcast.created')
             data: Event data payload
+            parent_id: Outbox job the deliveries belong to
+            key: Idempotency key prefix (a re-run never duplicates a delivery)
+        
+        Returns:
+            Number of deliveries queued
         """
         if event not in WEBHOOK_EVENTS:
             logger.warning(f"Unknown webhook event: {event}")
-            return
+            return 0
         
-        # Find all active webhooks subscribed to this event
-        webhooks = await self.db.webhooks.find({
-            'is_active': True,
-            'events': event
-        }).to_list(100)
+        # Active subscribers come from the in-memory index
+        webhooks = await webhook_subscriptions.subscribers(event)
+        if not webhooks:
+            return 0
         
         logger.info(f"Triggering {len(webhooks)} webhooks for event: {event}")
         
-        # Trigger webhooks concurrently
-        tasks = [self._trigger_webhook(webhook, event, data) for webhook in webhooks]
-        await asyncio.gather(*tasks, return_exceptions=True)
+        payload = {
+            'event': event,
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'data': data
+        }
+        jobs = [
+            self._delivery_job(webhook['id'], event, payload, 1, f"{key}:{webhook['id']}" if key else None, parent_id)
+            for webhook in webhooks
+        ]
+        self.queued += await notification_outbox.enqueue_many(jobs)
+        return len(jobs)
+    
+    async def deliver_job(self, job: Dict) -> Optional[Dict]:
+        """
+        `webhook_delivery` outbox handler
+        
+        payload: webhook_id, event, payload (signed body), attempt, key,
+        deferrals.
+        Hands the attempt to the endpoint's queue and completes without
+        waiting for the HTTP call; _run_attempt() enqueues the retry.
+        A delivery the endpoint can't take now (full queue) is enqueued
+        again, delayed, before this job completes.
+        """
+        p = job["payload"]
+        webhook = await webhook_subscriptions.subscriber(p["event"], p["webhook_id"])
+        if webhook is None:
+            return {"skipped": "Webhook inactive or unsubscribed"}
+        
+        if self._submit(webhook, p, job["id"]):
+            return {"queued": p.get("attempt", 1)}
+        return await self._follow_up(p, job["id"], None)
+    
+    def get_stats(self) -> Dict:
+        return {
+            "http2": HTTP2_AVAILABLE,
+            "queued": self.queued,
+            "delivered": self.delivered,
+            "failed": self.failed,
+            "retried": self.retried,
+            "deferred": self.deferred,
+            "pending_logs": len(self._log_buffer),
+            "endpoints": {
+                webhook_id: endpoint.to_dict()
+                for webhook_id, endpoint in self._endpoints.items()
+            }
+        }
+    
+    async def flush(self):
+        """Write buffered call logs and stats counters"""
+        logs, self._log_buffer = self._log_buffer, []
+        stats, self._stats_buffer = self._stats_buffer, {}
+        
+        try:
+            if logs:
+                await self.db.webhook_logs.insert_many(logs, ordered=False)
+            if stats:
+                now = datetime.now(timezone.utc).isoformat()
+                await self.db.webhooks.bulk_write([
+                    UpdateOne(
+                        {'id': webhook_id},
+                        {
+                            '$inc': {
+                                'total_calls': total,
+                                'successful_calls': successful,
+                                'failed_calls': failed
+                            },
+                            '$set': {'last_triggered_at': now, 'updated_at': now}
+                        }
+                    )
+                    for webhook_id, (total, successful, failed) in stats.items()
+                ], ordered=False)
+        except Exception as e:
+            logger.error(f"Webhook log flush error ({len(logs)} logs, {len(stats)} webhooks): {e}")
+    
+    def _delivery_job(
+        self,
+        webhook_id: str,
+        event: str,
+        payload: Dict,
+        attempt: int,
+        key: Optional[str],
+        parent_id: Optional[str],
+        delay: float = 0,
+        job_key: Optional[str] = None,
+        deferrals: int = 0
+    ) -> Dict:
+        return notification_outbox.new_job(
+            "webhook_delivery",
+            {
+                "webhook_id": webhook_id, "event": event, "payload": payload,
+                "attempt": attempt, "key": key, "deferrals": deferrals
+            },
+            idempotency_key=job_key or key,
+            parent_id=parent_id,
+            delay=delay
+        )
+    
+    def _submit(self, webhook: Dict, p: Dict, job_id: str) -> bool:
+        """Put one attempt on the endpoint's queue (False if it is full)"""
+        webhook_id = webhook['id']
+        endpoint = self._endpoints.get(webhook_id)
+        if endpoint is None:
+            endpoint = self._endpoints[webhook_id] = _Endpoint(webhook_id)
+        
+        try:
+            endpoint.queue.put_nowait((webhook, p, job_id))
+        except asyncio.QueueFull:
+            logger.warning(f"Webhook {webhook_id} queue full, deferring {p['event']}")
+            return False
+        
+        if endpoint.worker is None or endpoint.worker.done():
+            endpoint.worker = asyncio.create_task(self._endpoint_worker(endpoint))
+        return True
+    
+    async def _follow_up(self, p: Dict, job_id: str, outcome: Optional[bool]) -> Optional[Dict]:
+        """
+        Enqueue what comes after an attempt
+        
+        Args:
+            p: Payload of the delivery's job
+            job_id: That job (parent of the follow-up)
+            outcome: True / False for a delivered / failed attempt, None if
+                the endpoint couldn't take it (open circuit, full queue)
+        
+        Returns:
+            Result for the job's record
+        
+        Raises:
+            OutboxPermanentError: No attempts or deferrals left
+        """
+        if outcome:
+            return None
+        
+        attempt = p.get("attempt", 1)
+        key = p.get("key")
+        if outcome is None:
+            deferrals = p.get("deferrals", 0) + 1
+            if deferrals > MAX_DEFERRALS:
+                self.failed += 1
+                raise OutboxPermanentError(f"Webhook endpoint unavailable, gave up after {MAX_DEFERRALS} deferrals")
+            # Same attempt again once the circuit may let it through
+            endpoint = self._endpoints.get(p["webhook_id"])
+            delay = RETRY_DELAYS[-1]
+            if endpoint is not None and endpoint.state == "open":
+                delay = max(1.0, endpoint.open_until - time.monotonic())
+            self.deferred += 1
+            await notification_outbox.enqueue_many([self._delivery_job(
+                p["webhook_id"], p["event"], p["payload"], attempt,
+                key, job_id, delay, f"{key}:{attempt}:deferred:{deferrals}" if key else None, deferrals
+            )])
+            return {"deferred": round(delay, 1)}
+        
+        if attempt >= MAX_RETRIES:
+            self.failed += 1
+            raise OutboxPermanentError(f"Webhook delivery failed after {attempt} attempts")
+        self.retried += 1
+        await notification_outbox.enqueue_many([self._delivery_job(
+            p["webhook_id"], p["event"], p["payload"], attempt + 1,
+            key, job_id, RETRY_DELAYS[attempt - 1], f"{key}:{attempt + 1}" if key else None
+        )])
+        return {"retrying": attempt + 1}
+    
+    async def _endpoint_worker(self, endpoint: _Endpoint):
+        """Drain one endpoint's queue within its concurrency and circuit state"""
+        while True:
+            try:
+                delivery = await asyncio.wait_for(endpoint.queue.get(), ENDPOINT_IDLE_SECONDS)
+            except asyncio.TimeoutError:
+                if endpoint.in_flight == 0 and endpoint.queue.empty():
+                    self._endpoints.pop(endpoint.webhook_id, None)
+                    return
+                continue
+            
+            if endpoint.state == "open":
+                if endpoint.open_until > time.monotonic():
+                    # Not held in memory: re-scheduled as an outbox job
+                    await self._record(delivery, None)
+                    continue
+                endpoint.state = "half_open"
+            
+            if endpoint.state == "half_open":
+                # One probe at a time until the endpoint answers again
+                await self._run_attempt(endpoint, *delivery)
+                continue
+            
+            await endpoint.slots.acquire()
+            endpoint.in_flight += 1
+            task = asyncio.create_task(self._run_attempt(endpoint, *delivery))
+            task.add_done_callback(lambda _t, e=endpoint: self._release(e))
+    
+    def _release(self, endpoint: _Endpoint):
+        endpoint.in_flight -= 1
+        endpoint.slots.release()
+    
+    async def _run_attempt(self, endpoint: _Endpoint, webhook: Dict, p: Dict, job_id: str):
+        success = False
+        try:
+            success = await self._attempt(endpoint, webhook, p["event"], p["payload"], p.get("attempt", 1))
+        except Exception as e:
+            logger.error(f"Webhook {webhook['id']} attempt error: {e}")
+        await self._record((webhook, p, job_id), success)
+    
+    async def _record(self, delivery: tuple, outcome: Optional[bool]):
+        """Follow-up of an attempt whose outbox job has already completed"""
+        webhook, p, job_id = delivery
+        try:
+            await self._follow_up(p, job_id, outcome)
+        except OutboxPermanentError as e:
+            logger.warning(f"Webhook {webhook['id']} {p['event']}: {e}")
+        except Exception as e:
+            logger.error(f"Webhook {webhook['id']} follow-up not queued ({p['event']}): {e}")
     
-    async def _trigger_webhook(self, webhook: Dict, event: str, data: Dict):
+    async def _attempt(self, endpoint: _Endpoint, webhook: Dict, event: str, payload: Dict, attempt: int) -> bool:
         """
-        Trigger a single webhook with retry logic
+        Deliver one event to one webhook (a single attempt)
         
         Args:
+            endpoint: Endpoint state of the webhook
             webhook: Webhook document from database
             event: Event name
-            data: Event payload
+            payload: Signed body
+            attempt: 1-based attempt number
+        
+        Returns:
+            Whether the endpoint accepted the event
         """
         webhook_id = webhook['id']
         url = webhook['url']
         secret = webhook.get('secret')
         
-        # Check if Telegram integration is configured
-        telegram_bot_token = webhook.get('telegram_bot_token')
-        telegram_chat_id = webhook.get('telegram_chat_id')
-        
-        # Send Telegram notification if configured
-        if telegram_bot_token and telegram_chat_id:
-            try:
-                from services.telegram_service import telegram_service
-                
-                # Send formatted notification based on event type
-                if event == 'podcast.created':
-                    await telegram_service.send_podcast_notification(
-                        telegram_bot_token,
-                        telegram_chat_id,
-                        data
-                    )
-                elif event == 'live.started':
-                    await telegram_service.send_live_notification(
-                        telegram_bot_token,
-                        telegram_chat_id,
-                        data
-                    )
-                elif event == 'comment.created':
-                    await telegram_service.send_comment_notification(
-                        telegram_bot_token,
-                        telegram_chat_id,
-                        data
-                    )
-                elif event == 'follower.new':
-                    await telegram_service.send_follower_notification(
-                        telegram_bot_token,
-                        telegram_chat_id,
-                        data
-                    )
-                else:
-                    # Generic message for other events
-                    message = f"🔔 Событие: {event}\n\nДанные: {json.dumps(data, indent=2, ensure_ascii=False)}"
-                    await telegram_service.send_message(
-                        telegram_bot_token,
-                        telegram_chat_id,
-                        message[:4000]  # Telegram limit
-                    )
-            except Exception as e:
-                logger.error(f"Telegram notification failed: {e}")
-        
-        # Continue with regular webhook call
-        # Prepare payload
-        payload = {
-            'event': event,
-            'timestamp': datetime.now(timezone.utc).isoformat(),
-            'data': data
-        }
+        # Send Telegram notification if configured (once per event)
+        if attempt == 1 and webhook.get('telegram_bot_token') and webhook.get('telegram_chat_id'):
+            await self._send_telegram(webhook, event, payload['data'])
         
         # Add signature if secret is provided
         headers = {'Content-Type': 'application/json'}
@@ -139,57 +415,98 @@ class WebhookService:
             signature = self._generate_signature(payload, secret)
             headers['X-Webhook-Signature'] = signature
         
-        # Try sending with retries
-        for attempt in range(1, MAX_RETRIES + 1):
-            try:
-                response = await self.client.post(
-                    url,
-                    json=payload,
-                    headers=headers
-                )
-                
-                success = 200 <= response.status_code < 300
-                
-                # Log the webhook call
-                await self._log_webhook_call(
-                    webhook_id=webhook_id,
-                    event=event,
-                    payload=payload,
-                    status_code=response.status_code,
-                    response_body=response.text[:500],  # Limit response body
-                    attempt=attempt,
-                    success=success
-                )
-                
-                # Update webhook stats
-                await self._update_webhook_stats(webhook_id, success)
-                
-                if success:
-                    logger.info(f"Webhook {webhook_id} triggered successfully (attempt {attempt})")
-                    return
-                else:
-                    logger.warning(f"Webhook {webhook_id} failed with status {response.status_code}")
-                    
-            except Exception as e:
-                error_message = str(e)
-                logger.error(f"Webhook {webhook_id} error (attempt {attempt}): {error_message}")
+        success = False
+        try:
+            response = await self.client.post(
+                url,
+                json=payload,
+                headers=headers
+            )
+            
+            success = 200 <= response.status_code < 300
+            
+            # Log the webhook call
+            self._log_webhook_call(
+                webhook_id=webhook_id,
+                event=event,
+                payload=payload,
+                status_code=response.status_code,
+                response_body=response.text[:500],  # Limit response body
+                attempt=attempt,
+                success=success
+            )
+            
+            if success:
+                logger.info(f"Webhook {webhook_id} triggered successfully (attempt {attempt})")
+            else:
+                logger.warning(f"Webhook {webhook_id} failed with status {response.status_code}")
                 
-                # Log the error
-                await self._log_webhook_call(
-                    webhook_id=webhook_id,
-                    event=event,
-                    payload=payload,
-                    error_message=error_message,
-                    attempt=attempt,
-                    success=False
-                )
+        except Exception as e:
+            error_message = str(e)
+            logger.error(f"Webhook {webhook_id} error (attempt {attempt}): {error_message}")
             
-            # Wait before retry (except on last attempt)
-            if attempt < MAX_RETRIES:
-                await asyncio.sleep(RETRY_DELAYS[attempt - 1])
+            # Log the error
+            self._log_webhook_call(
+                webhook_id=webhook_id,
+                event=event,
+                payload=payload,
+                error_message=error_message,
+                attempt=attempt,
+                success=False
+            )
         
-        # All retries failed
-        await self._update_webhook_stats(webhook_id, success=False)
+        # Update webhook stats
+        self._update_webhook_stats(webhook_id, success)
+        
+        if success:
+            endpoint.record_success()
+            self.delivered += 1
+        else:
+            endpoint.record_failure()
+        return success
+    
+    async def _send_telegram(self, webhook: Dict, event: str, data: Dict):
+        """Send the webhook's Telegram notification for an event"""
+        telegram_bot_token = webhook['telegram_bot_token']
+        telegram_chat_id = webhook['telegram_chat_id']
+        try:
+            from services.telegram_service import telegram_service
+            
+            # Send formatted notification based on event type
+            if event == 'podcast.created':
+                await telegram_service.send_podcast_notification(
+                    telegram_bot_token,
+                    telegram_chat_id,
+                    data
+                )
+            elif event == 'live.started':
+                await telegram_service.send_live_notification(
+                    telegram_bot_token,
+                    telegram_chat_id,
+                    data
+                )
+            elif event == 'comment.created':
+                await telegram_service.send_comment_notification(
+                    telegram_bot_token,
+                    telegram_chat_id,
+                    data
+                )
+            elif event == 'follower.new':
+                await telegram_service.send_follower_notification(
+                    telegram_bot_token,
+                    telegram_chat_id,
+                    data
+                )
+            else:
+                # Generic message for other events
+                message = f"🔔 Событие: {event}\n\nДанные: {json.dumps(data, indent=2, ensure_ascii=False)}"
+                await telegram_service.send_message(
+                    telegram_bot_token,
+                    telegram_chat_id,
+                    message[:4000]  # Telegram limit
+                )
+        except Exception as e:
+            logger.error(f"Telegram notification failed: {e}")
     
     async def test_webhook(self, url: str, secret: Optional[str] = None) -> Dict:
         """
@@ -291,7 +608,7 @@ class WebhookService:
         ).hexdigest()
         return signature
     
-    async def _log_webhook_call(
+    def _log_webhook_call(
         self,
         webhook_id: str,
         event: str,
@@ -302,7 +619,7 @@ class WebhookService:
         attempt: int = 1,
         success: bool = False
     ):
-        """Log webhook call to database"""
+        """Buffer a webhook call log (written by the next flush)"""
         log_entry = {
             'webhook_id': webhook_id,
             'event': event,
@@ -315,26 +632,24 @@ class WebhookService:
             'created_at': datetime.now(timezone.utc).isoformat()
         }
         
-        await self.db.webhook_logs.insert_one(log_entry)
+        self._log_buffer.append(log_entry)
+        self._ensure_flush_task()
     
-    async def _update_webhook_stats(self, webhook_id: str, success: bool):
-        """Update webhook statistics"""
-        update = {
-            '$inc': {
-                'total_calls': 1,
-                'successful_calls': 1 if success else 0,
-                'failed_calls': 0 if success else 1
-            },
-            '$set': {
-                'last_triggered_at': datetime.now(timezone.utc).isoformat(),
-                'updated_at': datetime.now(timezone.utc).isoformat()
-            }
-        }
-        
-        await self.db.webhooks.update_one(
-            {'id': webhook_id},
-            update
-        )
+    def _update_webhook_stats(self, webhook_id: str, success: bool):
+        """Buffer webhook statistics (coalesced into one $inc per webhook)"""
+        counters = self._stats_buffer.setdefault(webhook_id, [0, 0, 0])
+        counters[0] += 1
+        counters[1 if success else 2] += 1
+        self._ensure_flush_task()
+    
+    def _ensure_flush_task(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._run_flush())
+    
+    async def _run_flush(self):
+        while self._log_buffer or self._stats_buffer:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            await self.flush()
 
 
 # Global webhook service instance (will be initialized in server.py)
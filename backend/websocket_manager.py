@@ -6,20 +6,33 @@ from typing import Dict, List, Set
 from fastapi import WebSocket
 import json
 import asyncio
-from datetime import datetime
+from datetime import datetime, timezone
+
+from services.live_coalescer import RoomEventCoalescer
+from services.live_chat_log import chat_log, new_ring_buffer, recent_messages
+from services import live_protocol
+from services.live_protocol import LiveSocket, FrameCache
+from services.live_presence import PresenceService
 
 class ConnectionManager:
     def __init__(self):
         # room_id -> list of websocket connections
-        self.active_connections: Dict[str, List[WebSocket]] = {}
+        self.active_connections: Dict[str, List[LiveSocket]] = {}
         # room_id -> room data (participants, speakers, listeners)
         self.rooms: Dict[str, dict] = {}
         # user_id -> room_id mapping
         self.user_rooms: Dict[str, str] = {}
+        # Speaking-status flips are merged into one frame per room tick
+        self.coalescer = RoomEventCoalescer(
+            self.broadcast_to_room,
+            lambda room_id: len(self.active_connections.get(room_id, []))
+        )
+        # Heartbeats, idle reaping and batched join/leave events
+        self.presence = PresenceService(self._reap_idle, self._broadcast_presence)
         
-    async def connect(self, websocket: WebSocket, room_id: str, user_id: str, role: str = "listener"):
-        """Connect user to a live room"""
-        await websocket.accept()
+    async def connect(self, websocket: WebSocket, room_id: str, user_id: str, role: str = "listener") -> LiveSocket:
+        """Connect user to a live room (JSON or binary protocol, negotiated on accept)"""
+        websocket = await live_protocol.accept(websocket)
         
         # Initialize room if doesn't exist
         if room_id not in self.active_connections:
@@ -29,7 +42,7 @@ class ConnectionManager:
                 "speakers": set(),
                 "listeners": set(),
                 "hand_raised": set(),
-                "chat_messages": [],
+                "chat_messages": new_ring_buffer(),
                 "started_at": datetime.utcnow().isoformat()
             }
         
@@ -51,16 +64,19 @@ class ConnectionManager:
         else:
             self.rooms[room_id]["listeners"].add(user_id)
         
-        # Broadcast join event
-        await self.broadcast_to_room(room_id, {
-            "type": "user_joined",
+        # Join event goes out in the next batched presence frame
+        self.presence.register(room_id, id(websocket), user_id, websocket, {
             "user_id": user_id,
-            "role": role,
-            "stats": self.get_room_stats(room_id)
+            "role": role
         })
+        return websocket
     
-    def disconnect(self, websocket: WebSocket, room_id: str, user_id: str):
+    def disconnect(self, websocket: LiveSocket, room_id: str, user_id: str):
         """Disconnect user from room"""
+        if not self.presence.unregister(room_id, id(websocket), websocket):
+            # Already removed (e.g. reaped as idle)
+            return
+        
         if room_id in self.active_connections:
             if websocket in self.active_connections[room_id]:
                 self.active_connections[room_id].remove(websocket)
@@ -77,17 +93,39 @@ class ConnectionManager:
             if not self.active_connections[room_id]:
                 del self.active_connections[room_id]
                 del self.rooms[room_id]
+                self.coalescer.discard(room_id)
         
         if user_id in self.user_rooms:
             del self.user_rooms[user_id]
     
+    async def _reap_idle(self, room_id: str, conn_id: int, websocket: LiveSocket):
+        """Close and remove a connection that stopped answering pings"""
+        entry = self.presence.entries.get((room_id, conn_id))
+        try:
+            await websocket.close(code=4008)
+        except Exception:
+            pass
+        if entry:
+            self.disconnect(websocket, room_id, entry["user_id"])
+    
+    async def _broadcast_presence(self, room_id: str, joined: list, left: list):
+        """Send one frame with all joins/leaves since the last presence tick"""
+        await self.broadcast_to_room(room_id, {
+            "type": "presence",
+            "joined": joined,
+            "left": left,
+            "stats": self.get_room_stats(room_id)
+        })
+    
     async def broadcast_to_room(self, room_id: str, message: dict):
         """Broadcast message to all participants in room"""
         if room_id in self.active_connections:
+            # Encode once per wire format, not once per listener
+            frames = FrameCache(message)
             disconnected = []
-            for connection in self.active_connections[room_id]:
+            for connection in list(self.active_connections[room_id]):
                 try:
-                    await connection.send_json(message)
+                    await connection.send_frame(frames.get(connection.encoding))
                 except Exception as e:
                     disconnected.append(connection)
             
@@ -131,7 +169,7 @@ class ConnectionManager:
             "speakers": list(room["speakers"]),
             "listeners": list(room["listeners"]),
             "hand_raised": list(room["hand_raised"]),
-            "chat_messages": room["chat_messages"][-50:],  # Last 50 messages
+            "chat_messages": recent_messages(room["chat_messages"], 50),  # Last 50 messages
             "stats": self.get_room_stats(room_id),
             "started_at": room["started_at"]
         }
@@ -196,28 +234,28 @@ class ConnectionManager:
         })
     
     async def handle_chat_message(self, room_id: str, user_id: str, username: str, message: str):
-        """Handle chat message"""
+        """Handle chat message; returns the stored message"""
         if room_id not in self.rooms:
-            return
+            return None
         
+        now = datetime.now(timezone.utc)
         chat_message = {
-            "id": f"{user_id}_{datetime.utcnow().timestamp()}",
+            "id": f"{user_id}_{now.timestamp()}",
             "user_id": user_id,
             "username": username,
             "message": message,
-            "timestamp": datetime.utcnow().isoformat()
+            "timestamp": now.isoformat()
         }
         
+        # Ring buffer keeps the last 100; full history is persisted in the background
         self.rooms[room_id]["chat_messages"].append(chat_message)
-        
-        # Keep only last 100 messages
-        if len(self.rooms[room_id]["chat_messages"]) > 100:
-            self.rooms[room_id]["chat_messages"] = self.rooms[room_id]["chat_messages"][-100:]
+        chat_log.append(room_id, chat_message, room_type="live_room")
         
         await self.broadcast_to_room(room_id, {
             "type": "chat_message",
             "message": chat_message
         })
+        return chat_message
     
     async def update_speaking_status(self, room_id: str, user_id: str, is_speaking: bool):
         """Update user speaking status"""
@@ -227,11 +265,8 @@ class ConnectionManager:
         if user_id in self.rooms[room_id]["participants"]:
             self.rooms[room_id]["participants"][user_id]["is_speaking"] = is_speaking
         
-        await self.broadcast_to_room(room_id, {
-            "type": "speaking_status",
-            "user_id": user_id,
-            "is_speaking": is_speaking
-        })
+        # Delivered in the next room_tick frame
+        self.coalescer.set_speaking(room_id, user_id, is_speaking)
 
 # Global manager instance
 manager = ConnectionManager()
@@ -4,17 +4,28 @@ import { Hand, Check, X, Clock, ChevronRight } from 'lucide-react';
 
 const API = `${process.env.REACT_APP_BACKEND_URL}/api`;
 
-export const HandRaiseQueue = ({ sessionId, currentUserId, isModerator, onSpeakerApproved }) => {
+export const HandRaiseQueue = ({ sessionId, currentUserId, isModerator, liveQueue, onSpeakerApproved }) => {
   const [queue, setQueue] = useState([]);
   const [loading, setLoading] = useState(false);
+  // Parent passes queue updates pushed over the live-room socket
+  const isLive = liveQueue !== undefined;
 
   useEffect(() => {
     if (sessionId) {
       fetchQueue();
-      const interval = setInterval(fetchQueue, 5000);
-      return () => clearInterval(interval);
+      // Poll only when no socket pushes are available
+      if (!isLive) {
+        const interval = setInterval(fetchQueue, 5000);
+        return () => clearInterval(interval);
+      }
     }
-  }, [sessionId]);
+  }, [sessionId, isLive]);
+
+  useEffect(() => {
+    if (isLive) {
+      setQueue(liveQueue);
+    }
+  }, [liveQueue, isLive]);
 
   const fetchQueue = async () => {
     try {
@@ -30,7 +41,7 @@ export const HandRaiseQueue = ({ sessionId, currentUserId, isModerator, onSpeake
     setLoading(true);
     try {
       await axios.post(`${API}/live/${sessionId}/approve-speaker?hand_raise_id=${handRaiseId}&moderator_id=${currentUserId}`);
-      fetchQueue();
+      if (!isLive) fetchQueue();
       onSpeakerApproved?.();
     } catch (error) {
       console.error('Approve error:', error);
@@ -17,7 +17,8 @@ const CommentItem = memo(({
   onSetReplyTo,
   onSetReplyText,
   onLike,
-  onReply
+  onReply,
+  onLoadReplies
 }) => {
   const formatDate = (dateStr) => {
     if (!dateStr) return '';
@@ -53,7 +54,7 @@ const CommentItem = memo(({
             <button 
               onClick={() => onLike(comment.id)}
               className={`flex items-center gap-1 text-sm ${
-                comment.liked_by?.includes(currentUserId) 
+                comment.liked_by_user 
                   ? 'text-emerald-600' 
                   : 'text-gray-500 hover:text-emerald-600'
               }`}
@@ -131,7 +132,11 @@ const CommentItem = memo(({
                     </div>
                     <button 
                       onClick={() => onLike(reply.id)}
-                      className="flex items-center gap-1 text-xs text-gray-500 hover:text-emerald-600 mt-1 ml-2"
+                      className={`flex items-center gap-1 text-xs mt-1 ml-2 ${
+                        reply.liked_by_user 
+                          ? 'text-emerald-600' 
+                          : 'text-gray-500 hover:text-emerald-600'
+                      }`}
                     >
                       <ThumbsUp className="w-3 h-3" />
                       {reply.likes_count > 0 && reply.likes_count}
@@ -141,6 +146,16 @@ const CommentItem = memo(({
               ))}
             </div>
           )}
+          
+          {/* Remaining replies load on demand */}
+          {onLoadReplies && comment.reply_count > (comment.replies?.length || 0) && (
+            <button
+              onClick={() => onLoadReplies(comment.id)}
+              className="mt-2 ml-8 text-sm text-emerald-600 hover:text-emerald-700"
+            >
+              View {comment.reply_count - (comment.replies?.length || 0)} more replies
+            </button>
+          )}
         </div>
       </div>
     </div>
@@ -160,6 +175,10 @@ export const PodcastCommentsSection = ({
   isConnected,
   onAddComment,
   onLikeComment,
+  onLoadReplies,
+  onLoadMore,
+  hasMore = false,
+  totalCount,
   initiallyOpen = false
 }) => {
   const [showComments, setShowComments] = useState(initiallyOpen);
@@ -200,7 +219,7 @@ export const PodcastCommentsSection = ({
       >
         <h2 className="text-xl font-bold text-gray-900 flex items-center gap-2">
           <MessageCircle className="w-5 h-5" />
-          Comments ({comments.length})
+          Comments ({totalCount ?? comments.length})
         </h2>
         {showComments ? (
           <ChevronUp className="w-5 h-5 text-gray-500" />
@@ -259,9 +278,20 @@ export const PodcastCommentsSection = ({
                 onSetReplyText={handleSetReplyText}
                 onLike={onLikeComment}
                 onReply={handleSubmitReply}
+                onLoadReplies={onLoadReplies}
               />
             ))}
             
+            {hasMore && onLoadMore && (
+              <Button
+                onClick={onLoadMore}
+                variant="ghost"
+                className="w-full text-gray-600 hover:text-gray-900"
+              >
+                Load more comments
+              </Button>
+            )}
+            
             {comments.length === 0 && (
               <div className="text-center py-8">
                 <MessageCircle className="w-12 h-12 text-gray-300 mx-auto mb-3" />
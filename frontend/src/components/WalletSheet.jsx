@@ -22,6 +22,7 @@ import {
 import { toast } from 'sonner';
 import { TelegramConnect } from './TelegramConnect';
 import { getRatingBorderClass } from '../utils/ratingUtils';
+import { useUserChannel } from '../hooks/use-user-channel';
 
 const API = `${process.env.REACT_APP_BACKEND_URL}/api`;
 
@@ -87,32 +88,37 @@ export const WalletSheet = () => {
         setActiveLives([]);
       }
     };
-    
-    // Fetch unread messages count
+
+    if (isOpen) {
+      fetchProfile();
+      fetchActiveLives();
+    }
+  }, [isOpen, isLoggedIn, walletAddress, user, authorId]);
+
+  // Unread counts are pushed over the user channel
+  const { counters, connected: channelConnected } = useUserChannel(authorId, { walletAddress });
+
+  useEffect(() => {
+    if (counters) setUnreadMessages(counters.messages);
+  }, [counters]);
+
+  // Poll only while the channel is down
+  useEffect(() => {
+    if (!authorId || channelConnected) return;
+
     const fetchUnreadCount = async () => {
-      if (!authorId) return;
       try {
-        const res = await axios.get(`${API}/users/${authorId}/conversations`);
-        const convs = res.data || [];
-        const total = convs.reduce((sum, c) => sum + (c.unread_count || 0), 0);
-        setUnreadMessages(total);
+        const res = await axios.get(`${API}/users/${authorId}/unread-counts`);
+        setUnreadMessages(res.data?.messages || 0);
       } catch (error) {
         setUnreadMessages(0);
       }
     };
 
-    if (isOpen) {
-      fetchProfile();
-      fetchActiveLives();
-    }
-    
-    // Fetch unread messages periodically
-    if (authorId) {
-      fetchUnreadCount();
-      const interval = setInterval(fetchUnreadCount, 30000); // every 30 sec
-      return () => clearInterval(interval);
-    }
-  }, [isOpen, isLoggedIn, walletAddress, user, authorId]);
+    fetchUnreadCount();
+    const interval = setInterval(fetchUnreadCount, 30000); // every 30 sec
+    return () => clearInterval(interval);
+  }, [authorId, channelConnected]);
 
   const copyAddress = () => {
     if (walletAddress) {
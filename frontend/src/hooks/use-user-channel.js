@@ -0,0 +1,86 @@
+import { useEffect, useRef, useState } from "react"
+
+const API = `${process.env.REACT_APP_BACKEND_URL}/api`
+
+const RECONNECT_MIN_MS = 1000
+const RECONNECT_MAX_MS = 30000
+const PING_INTERVAL_MS = 25000
+
+/**
+ * Real-time notifications, direct messages and unread counters for one user.
+ *
+ * Opens /api/notifications/ws (authenticated with the stored access token
+ * or the connected wallet) and reconnects with backoff. `connected` lets
+ * callers fall back to polling only while the socket is down.
+ */
+export function useUserChannel(userId, { walletAddress, onEvent } = {}) {
+  const [counters, setCounters] = useState(null)
+  const [connected, setConnected] = useState(false)
+  const onEventRef = useRef(onEvent)
+  onEventRef.current = onEvent
+
+  useEffect(() => {
+    if (!userId) return undefined
+
+    let ws = null
+    let closed = false
+    let retryDelay = RECONNECT_MIN_MS
+    let retryTimer = null
+    let pingTimer = null
+
+    const open = () => {
+      const params = new URLSearchParams({ user_id: userId })
+      const token = localStorage.getItem("access_token")
+      if (token) params.set("token", token)
+      if (walletAddress) params.set("wallet", walletAddress)
+
+      const wsUrl = API.replace("https://", "wss://").replace("http://", "ws://")
+      ws = new WebSocket(`${wsUrl}/notifications/ws?${params}`)
+
+      ws.onopen = () => {
+        retryDelay = RECONNECT_MIN_MS
+        setConnected(true)
+        pingTimer = setInterval(() => {
+          if (ws.readyState === WebSocket.OPEN) ws.send(JSON.stringify({ type: "ping" }))
+        }, PING_INTERVAL_MS)
+      }
+
+      ws.onmessage = (event) => {
+        let data
+        try {
+          data = JSON.parse(event.data)
+        } catch (error) {
+          return
+        }
+        if (data.type === "counters") {
+          setCounters({
+            notifications: data.notifications || 0,
+            messages: data.messages || 0,
+            conversations: data.conversations || {}
+          })
+        }
+        if (onEventRef.current) onEventRef.current(data)
+      }
+
+      ws.onclose = (event) => {
+        setConnected(false)
+        clearInterval(pingTimer)
+        // 4401: not allowed to subscribe to this user; don't hammer the server
+        if (closed || event.code === 4401) return
+        retryTimer = setTimeout(open, retryDelay)
+        retryDelay = Math.min(retryDelay * 2, RECONNECT_MAX_MS)
+      }
+    }
+
+    open()
+
+    return () => {
+      closed = true
+      clearTimeout(retryTimer)
+      clearInterval(pingTimer)
+      if (ws) ws.close()
+    }
+  }, [userId, walletAddress])
+
+  return { counters, connected }
+}
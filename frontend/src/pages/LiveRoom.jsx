@@ -89,6 +89,7 @@ export const LiveRoom = () => {
   // Speech support state
   const [showSpeechSupport, setShowSpeechSupport] = useState(false);
   const [lastSpeaker, setLastSpeaker] = useState(null);
+  const [handRaiseQueue, setHandRaiseQueue] = useState(undefined);
   
   // Check if user is moderator/admin
   const isModerator = isHost || userRole === 'moderator' || userRole === 'admin';
@@ -381,6 +382,19 @@ export const LiveRoom = () => {
         setStats(data.stats);
         break;
       
+      case 'presence':
+        // Joins/leaves batched by the server once per tick
+        (data.joined || [])
+          .filter(u => u.user_id !== userId)
+          .slice(0, 3)
+          .forEach(u => toast.success(`${u.user_id} joined`, { duration: 2000 }));
+        setStats(data.stats);
+        break;
+      
+      case 'ping':
+        sendWSMessage({ type: 'pong' });
+        break;
+      
       case 'chat_message':
         console.log('💬 Chat message:', data.message);
         setChatMessages(prev => [...prev, data.message]);
@@ -414,6 +428,24 @@ export const LiveRoom = () => {
         setStats(data.stats);
         break;
       
+      case 'room_tick':
+        // Only the latest speaking state per user is sent each tick
+        if (data.speaking && Object.keys(data.speaking).length) {
+          setParticipants(prev =>
+            prev.map(p =>
+              p.user_id in data.speaking
+                ? { ...p, is_speaking: data.speaking[p.user_id] }
+                : p
+            )
+          );
+        }
+        break;
+      
+      case 'hand_raise_queue':
+        // Pushed on every queue change (replaces polling)
+        setHandRaiseQueue(data.queue || []);
+        break;
+      
       case 'speaking_status':
         setParticipants(prev => 
           prev.map(p => 
@@ -954,6 +986,7 @@ export const LiveRoom = () => {
             sessionId={podcastId}
             currentUserId={userId}
             isModerator={isModerator}
+            liveQueue={handRaiseQueue}
             onSpeakerApproved={() => {}}
           />
         </div>
@@ -219,6 +219,7 @@ export const LiveRoom = () => {
   const wsRef = useRef(null);
   const [wsConnected, setWsConnected] = useState(false);
   const reconnectTimeoutRef = useRef(null);
+  const reconnectAttemptsRef = useRef(0);
   
   // Audio state
   const [isHandRaised, setIsHandRaised] = useState(false);
@@ -285,6 +286,7 @@ export const LiveRoom = () => {
     ws.onopen = () => {
       console.log('WebSocket connected');
       setWsConnected(true);
+      reconnectAttemptsRef.current = 0;
       // Don't show toast on reconnect to avoid spam
     };
     
@@ -305,11 +307,15 @@ export const LiveRoom = () => {
       console.log('WebSocket closed');
       setWsConnected(false);
       
-      // Reconnect after delay if session is still active
+      // Reconnect after delay if session is still active.
+      // Exponential backoff with jitter so a server restart doesn't bring
+      // every listener back in the same instant
       if (session?.status === 'live' || session?.status === 'active') {
+        const attempt = reconnectAttemptsRef.current++;
+        const delay = Math.min(30000, 1000 * 2 ** attempt) * (0.5 + Math.random());
         reconnectTimeoutRef.current = setTimeout(() => {
           connectWebSocket();
-        }, 3000);
+        }, delay);
       }
     };
     
@@ -340,6 +346,22 @@ export const LiveRoom = () => {
         setStats(data.stats || stats);
         break;
         
+      case 'presence': {
+        // Joins/leaves batched by the server once per tick
+        const others = (data.joined || []).filter(u => u.user_id !== userId);
+        if (others.length === 1) {
+          toast.info(`${others[0].username || 'User'} joined`);
+        } else if (others.length > 1) {
+          toast.info(`${others.length} people joined`);
+        }
+        setStats(data.stats || stats);
+        break;
+      }
+        
+      case 'ping':
+        sendWsMessage({ type: 'pong' });
+        break;
+        
       case 'chat_message':
         setMessages(prev => [...prev, data.message]);
         // Play sound for new messages from others
@@ -359,6 +381,23 @@ export const LiveRoom = () => {
         }, 2000);
         break;
         
+      case 'room_tick': {
+        // Reactions arrive merged per emoji; cap floating emojis per tick
+        const burst = [];
+        Object.entries(data.reactions || {}).forEach(([emoji, count]) => {
+          for (let i = 0; i < Math.min(count, 5); i++) {
+            burst.push({ id: `${Date.now()}_${emoji}_${i}`, emoji, count });
+          }
+        });
+        if (burst.length) {
+          setReactions(prev => [...prev, ...burst]);
+          setTimeout(() => {
+            setReactions(prev => prev.slice(burst.length));
+          }, 2000);
+        }
+        break;
+      }
+        
       case 'hand_raised_update':
         setHandRaised(data.hand_raised || []);
         setStats(data.stats || stats);
@@ -56,6 +56,7 @@ import TelegramNotifyButton from '../components/TelegramNotifyButton';
 import SimilarByTags from '../components/SimilarByTags';
 
 const API = `${process.env.REACT_APP_BACKEND_URL}/api`;
+const COMMENTS_PAGE_SIZE = 20;
 
 // Reaction types with icons
 const REACTIONS = [
@@ -74,6 +75,7 @@ export const PodcastDetail = () => {
   const { playPodcast, currentPodcast, isPlaying, togglePlay, currentTime, seek } = usePlayer();
   const [podcast, setPodcast] = useState(null);
   const [comments, setComments] = useState([]);
+  const [hasMoreComments, setHasMoreComments] = useState(false);
   const [loading, setLoading] = useState(true);
   const [author, setAuthor] = useState(null);
   const [isFollowing, setIsFollowing] = useState(false);
@@ -140,8 +142,18 @@ export const PodcastDetail = () => {
             console.log('WebSocket message:', data);
             
             if (data.type === 'new_comment') {
-              // Add new comment to list
-              setComments(prev => [data.comment, ...prev]);
+              // Add new comment to its thread (skip our own, already added)
+              const comment = data.comment;
+              setComments(prev => {
+                if (comment.parent_id) {
+                  return prev.map(c => 
+                    c.id === comment.parent_id && !(c.replies || []).some(r => r.id === comment.id)
+                      ? { ...c, replies: [...(c.replies || []), comment], reply_count: (c.reply_count || 0) + 1 }
+                      : c
+                  );
+                }
+                return prev.some(c => c.id === comment.id) ? prev : [comment, ...prev];
+              });
             } else if (data.type === 'comment_liked') {
               // Update comment likes
               setComments(prev => prev.map(c => 
@@ -196,7 +208,9 @@ export const PodcastDetail = () => {
         setLoading(true);
         const [podcastRes, commentsRes, reactionsRes] = await Promise.all([
           axios.get(`${API}/podcasts/${podcastId}`),
-          axios.get(`${API}/podcasts/${podcastId}/comments`),
+          axios.get(`${API}/podcasts/${podcastId}/comments`, {
+            params: { user_id: currentUserId, limit: COMMENTS_PAGE_SIZE }
+          }),
           axios.get(`${API}/podcasts/${podcastId}/reactions`)
         ]);
         
@@ -204,6 +218,7 @@ export const PodcastDetail = () => {
         
         setPodcast(podcastRes.data);
         setComments(commentsRes.data);
+        setHasMoreComments(commentsRes.data.length === COMMENTS_PAGE_SIZE);
         setReactions(reactionsRes.data.reactions || {});
         setIsSaved(podcastRes.data.saves?.includes(currentUserId) || false);
         
@@ -316,14 +331,15 @@ export const PodcastDetail = () => {
       if (parentId) {
         // Add reply to parent comment
         setComments(prev => prev.map(c => {
-          if (c.id === parentId) {
-            return { ...c, replies: [...(c.replies || []), response.data] };
+          if (c.id === parentId && !(c.replies || []).some(r => r.id === response.data.id)) {
+            return { ...c, replies: [...(c.replies || []), response.data], reply_count: (c.reply_count || 0) + 1 };
           }
           return c;
         }));
       } else {
-        setComments(prev => [response.data, ...prev]);
+        setComments(prev => prev.some(c => c.id === response.data.id) ? prev : [response.data, ...prev]);
       }
+      setPodcast(prev => prev && { ...prev, comments_count: (prev.comments_count || 0) + 1 });
       
       toast.success('Comment added!');
     } catch (error) {
@@ -340,29 +356,16 @@ export const PodcastDetail = () => {
       const response = await axios.post(`${API}/comments/${commentId}/like`, formData);
       
       // Update comment likes in state
-      setComments(comments.map(c => {
+      const { liked, likes_count } = response.data;
+      setComments(prev => prev.map(c => {
         if (c.id === commentId) {
-          return { 
-            ...c, 
-            likes_count: response.data.liked ? c.likes_count + 1 : c.likes_count - 1,
-            liked_by: response.data.liked 
-              ? [...(c.liked_by || []), currentUserId]
-              : (c.liked_by || []).filter(id => id !== currentUserId)
-          };
+          return { ...c, likes_count, liked_by_user: liked };
         }
         // Check replies
         if (c.replies) {
           return {
             ...c,
-            replies: c.replies.map(r => {
-              if (r.id === commentId) {
-                return {
-                  ...r,
-                  likes_count: response.data.liked ? r.likes_count + 1 : r.likes_count - 1
-                };
-              }
-              return r;
-            })
+            replies: c.replies.map(r => r.id === commentId ? { ...r, likes_count, liked_by_user: liked } : r)
           };
         }
         return c;
@@ -372,6 +375,44 @@ export const PodcastDetail = () => {
     }
   };
   
+  const loadMoreComments = async () => {
+    const last = comments[comments.length - 1];
+    if (!last) return;
+    try {
+      const response = await axios.get(`${API}/podcasts/${podcastId}/comments`, {
+        params: { user_id: currentUserId, limit: COMMENTS_PAGE_SIZE, before: last.cursor }
+      });
+      setComments(prev => [
+        ...prev,
+        ...response.data.filter(c => !prev.some(p => p.id === c.id))
+      ]);
+      setHasMoreComments(response.data.length === COMMENTS_PAGE_SIZE);
+    } catch (error) {
+      console.error('Failed to load comments:', error);
+    }
+  };
+  
+  const loadCommentReplies = async (commentId) => {
+    // Continue after the last reply the server sent (ones posted here have no cursor)
+    const loaded = (comments.find(c => c.id === commentId)?.replies || []).filter(r => r.cursor);
+    const last = loaded[loaded.length - 1];
+    try {
+      const response = await axios.get(`${API}/podcasts/${podcastId}/comments/${commentId}/replies`, {
+        params: { user_id: currentUserId, after: last?.cursor }
+      });
+      setComments(prev => prev.map(c => {
+        if (c.id !== commentId) return c;
+        const replies = c.replies || [];
+        return {
+          ...c,
+          replies: [...replies, ...response.data.filter(r => !replies.some(p => p.id === r.id))]
+        };
+      }));
+    } catch (error) {
+      console.error('Failed to load replies:', error);
+    }
+  };
+  
   const handleReaction = async (reactionType) => {
     try {
       const formData = new FormData();
@@ -487,6 +528,8 @@ export const PodcastDetail = () => {
   };
   
   const totalReactions = Object.values(reactions).reduce((a, b) => a + b, 0);
+  // Comments are paginated: the podcast keeps the total
+  const commentsCount = Math.max(podcast?.comments_count || 0, comments.length);
   
   if (loading) {
     return (
@@ -591,7 +634,7 @@ export const PodcastDetail = () => {
                 </div>
                 <div className="flex items-center gap-1.5">
                   <MessageCircle className="w-4 h-4" />
-                  {comments.length} comments
+                  {commentsCount} comments
                 </div>
               </div>
               
@@ -851,7 +894,7 @@ export const PodcastDetail = () => {
                   <TabsList className="bg-gray-100 p-1 rounded-xl w-full grid grid-cols-4">
                     <TabsTrigger value="comments" className="rounded-lg text-sm">
                       <MessageCircle className="w-4 h-4 mr-1" />
-                      Chat ({comments.length})
+                      Chat ({commentsCount})
                     </TabsTrigger>
                     <TabsTrigger value="qa" className="rounded-lg text-sm">
                       <HelpCircle className="w-4 h-4 mr-1" />
@@ -877,6 +920,10 @@ export const PodcastDetail = () => {
                       isConnected={isConnected}
                       onAddComment={(text, parentId) => handleAddComment(text, parentId)}
                       onLikeComment={handleLikeComment}
+                      onLoadReplies={loadCommentReplies}
+                      onLoadMore={loadMoreComments}
+                      hasMore={hasMoreComments}
+                      totalCount={commentsCount}
                       initiallyOpen={true}
                     />
                   </TabsContent>
@@ -1061,7 +1108,7 @@ export const PodcastDetail = () => {
                     <MessageCircle className="w-4 h-4" />
                     <span className="text-xs font-medium">Comments</span>
                   </div>
-                  <p className="text-2xl font-bold text-gray-900">{comments.length}</p>
+                  <p className="text-2xl font-bold text-gray-900">{commentsCount}</p>
                 </div>
               </div>
               
@@ -1107,7 +1154,7 @@ export const PodcastDetail = () => {
                     {Math.min(100, Math.round(
                       ((podcast.listens_count || 0) * 2 + 
                        totalReactions * 5 + 
-                       comments.length * 10 + 
+                       commentsCount * 10 + 
                        (podcast.saves_count || 0) * 3) / 10
                     ))}%
                   </span>
@@ -1119,7 +1166,7 @@ export const PodcastDetail = () => {
                       width: `${Math.min(100, Math.round(
                         ((podcast.listens_count || 0) * 2 + 
                          totalReactions * 5 + 
-                         comments.length * 10 + 
+                         commentsCount * 10 + 
                          (podcast.saves_count || 0) * 3) / 10
                       ))}%` 
                     }}
@@ -20,6 +20,11 @@ import { PrivateClubManager } from '../components/PrivateClubManager';
 import { TelegramConnect } from '../components/TelegramConnect';
 
 const API = `${process.env.REACT_APP_BACKEND_URL}/api`;
+const MESSAGE_PAGE_SIZE = 50;
+
+// Attachments are served by the backend (/api/messages/attachments/...);
+// older messages may still carry inline data: URLs
+const attachmentSrc = (url) => (url && url.startsWith('/api/') ? `${process.env.REACT_APP_BACKEND_URL}${url}` : url);
 
 // Telegram Channel Card Component
 const TelegramChannelCard = ({ channel, onUpdate, onDelete }) => {
@@ -185,6 +190,8 @@ export const SocialHub = () => {
   const [conversations, setConversations] = useState([]);
   const [selectedConversation, setSelectedConversation] = useState(null);
   const [messages, setMessages] = useState([]);
+  const [hasOlderMessages, setHasOlderMessages] = useState(false);
+  const [loadingOlder, setLoadingOlder] = useState(false);
   const [newMessage, setNewMessage] = useState('');
   const [searchQuery, setSearchQuery] = useState('');
   const [showNewChat, setShowNewChat] = useState(false);
@@ -287,11 +294,33 @@ export const SocialHub = () => {
   const loadConversation = async (conversation) => {
     setSelectedConversation(conversation);
     try {
-      const res = await axios.get(`${API}/messages/${currentUserId}/${conversation.user_id}`);
+      const res = await axios.get(`${API}/messages/${currentUserId}/${conversation.user_id}`, {
+        params: { limit: MESSAGE_PAGE_SIZE }
+      });
       setMessages(res.data || []);
+      setHasOlderMessages((res.data || []).length === MESSAGE_PAGE_SIZE);
     } catch (error) {
       console.error('Failed to load messages:', error);
       setMessages([]);
+      setHasOlderMessages(false);
+    }
+  };
+  
+  // Older history, one keyset page at a time
+  const loadOlderMessages = async () => {
+    if (!selectedConversation || !messages.length || loadingOlder) return;
+    setLoadingOlder(true);
+    try {
+      const res = await axios.get(`${API}/messages/${currentUserId}/${selectedConversation.user_id}`, {
+        params: { limit: MESSAGE_PAGE_SIZE, before: messages[0].cursor }
+      });
+      const older = res.data || [];
+      setMessages(prev => [...older, ...prev]);
+      setHasOlderMessages(older.length === MESSAGE_PAGE_SIZE);
+    } catch (error) {
+      console.error('Failed to load older messages:', error);
+    } finally {
+      setLoadingOlder(false);
     }
   };
   
@@ -856,9 +885,16 @@ export const SocialHub = () => {
                   
                   {/* Messages */}
                   <div className="flex-1 overflow-y-auto p-4 space-y-4">
+                    {hasOlderMessages && (
+                      <div className="flex justify-center">
+                        <Button variant="ghost" size="sm" onClick={loadOlderMessages} disabled={loadingOlder}>
+                          {loadingOlder ? <Loader2 className="w-4 h-4 animate-spin" /> : 'Load earlier messages'}
+                        </Button>
+                      </div>
+                    )}
                     {messages.map((msg, idx) => (
                       <div
-                        key={idx}
+                        key={msg.id || idx}
                         className={`flex ${msg.sender_id === currentUserId ? 'justify-end' : 'justify-start'}`}
                       >
                         <div className={`max-w-[70%] rounded-2xl px-4 py-2 ${
@@ -870,14 +906,17 @@ export const SocialHub = () => {
                           {msg.attachment_url && (
                             <div className="mb-2">
                               {msg.attachment_type === 'image' ? (
-                                <img 
-                                  src={msg.attachment_url} 
-                                  alt="attachment" 
-                                  className="max-w-full rounded-lg max-h-60 object-cover"
-                                />
+                                <a href={attachmentSrc(msg.attachment_url)} target="_blank" rel="noopener noreferrer">
+                                  <img 
+                                    src={attachmentSrc(msg.thumbnail_url || msg.attachment_url)} 
+                                    alt="attachment" 
+                                    loading="lazy"
+                                    className="max-w-full rounded-lg max-h-60 object-cover"
+                                  />
+                                </a>
                               ) : (
                                 <a 
-                                  href={msg.attachment_url} 
+                                  href={attachmentSrc(msg.attachment_url)} 
                                   download={msg.attachment_name}
                                   className={`flex items-center gap-2 p-2 rounded-lg ${
                                     msg.sender_id === currentUserId 